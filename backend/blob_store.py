@@ -0,0 +1,204 @@
+"""
+Content-addressed blob storage
+Uploads are streamed in chunks into GridFS or a local directory (chosen by
+LOGO_BLOB_BACKEND), hashed on the fly and stored once per SHA-256. Neither
+backend ever holds a whole file in memory.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from gridfs.errors import FileExists
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+LOGO_BLOB_BACKEND = os.environ.get('LOGO_BLOB_BACKEND', 'gridfs')  # gridfs or filesystem
+LOGO_BLOB_DIR = os.environ.get('LOGO_BLOB_DIR', str(Path(__file__).parent / 'blobs'))
+GRIDFS_BUCKET = os.environ.get('LOGO_GRIDFS_BUCKET', 'blobs')
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+@dataclass
+class StoredBlob:
+    sha256: str
+    size: int
+    created: bool  # False when an identical blob already existed
+
+
+async def iter_upload(upload, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Chunks of a starlette UploadFile (or anything with an async read(n))"""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+class GridFSBlobStore:
+    backend = 'gridfs'
+
+    def __init__(self, db, bucket_name: str = GRIDFS_BUCKET):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=UPLOAD_CHUNK_SIZE)
+        self.files = db[f'{bucket_name}.files']
+        self.chunks = db[f'{bucket_name}.chunks']
+
+    async def put(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> StoredBlob:
+        # The hash is only known at the end, so write under a pending name and rename or discard
+        grid_in = self.bucket.open_upload_stream('pending')
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"blob exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        sha256 = hasher.hexdigest()
+        if await self.exists(sha256):
+            await grid_in.abort()
+            return StoredBlob(sha256, size, created=False)
+        await grid_in.set('filename', sha256)
+        try:
+            await grid_in.close()
+        except FileExists:
+            # A concurrent upload of the same bytes won (unique filename index, see indexes.py)
+            await self.chunks.delete_many({'files_id': grid_in._id})
+            return StoredBlob(sha256, size, created=False)
+        return StoredBlob(sha256, size, created=True)
+
+    async def exists(self, sha256: str) -> bool:
+        return await self.files.find_one({'filename': sha256}, {'_id': 1}) is not None
+
+    async def read(self, sha256: str) -> Optional[bytes]:
+        file = await self.files.find_one({'filename': sha256}, {'_id': 1})
+        if not file:
+            return None
+        grid_out = await self.bucket.open_download_stream(file['_id'])
+        return await grid_out.read()
+
+    async def stream(self, sha256: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes [start, end) in chunk-sized pieces"""
+        file = await self.files.find_one({'filename': sha256}, {'_id': 1})
+        if not file:
+            return
+        grid_out = await self.bucket.open_download_stream(file['_id'])
+        grid_out.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = UPLOAD_CHUNK_SIZE if remaining is None else min(UPLOAD_CHUNK_SIZE, remaining)
+            chunk = await grid_out.read(size)
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    def local_path(self, sha256: str) -> Optional[Path]:
+        return None
+
+    async def delete(self, sha256: str) -> int:
+        deleted = 0
+        async for file in self.files.find({'filename': sha256}, {'_id': 1}):
+            await self.bucket.delete(file['_id'])
+            deleted += 1
+        return deleted
+
+
+class FilesystemBlobStore:
+    backend = 'filesystem'
+
+    def __init__(self, root: str = LOGO_BLOB_DIR):
+        self.root = Path(root)
+        self.tmp = self.root / 'tmp'
+
+    def path(self, sha256: str) -> Path:
+        if not _SHA256_RE.match(sha256):
+            raise ValueError(f"Not a sha256 digest: {sha256!r}")
+        return self.root / sha256[:2] / sha256[2:]
+
+    async def put(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> StoredBlob:
+        loop = asyncio.get_running_loop()
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(f"blob exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    await loop.run_in_executor(None, fh.write, chunk)
+            sha256 = hasher.hexdigest()
+            target = self.path(sha256)
+            if target.exists():
+                return StoredBlob(sha256, size, created=False)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, target)
+            return StoredBlob(sha256, size, created=True)
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+
+    async def exists(self, sha256: str) -> bool:
+        return self.path(sha256).exists()
+
+    async def read(self, sha256: str) -> Optional[bytes]:
+        path = self.path(sha256)
+        if not path.exists():
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, path.read_bytes)
+
+    async def stream(self, sha256: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes [start, end) in chunk-sized pieces"""
+        loop = asyncio.get_running_loop()
+        with open(self.path(sha256), 'rb') as fh:
+            fh.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = UPLOAD_CHUNK_SIZE if remaining is None else min(UPLOAD_CHUNK_SIZE, remaining)
+                chunk = await loop.run_in_executor(None, fh.read, size)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, sha256: str) -> Optional[Path]:
+        """Path for zero-copy responses, None if the blob is missing"""
+        path = self.path(sha256)
+        return path if path.exists() else None
+
+    async def delete(self, sha256: str) -> int:
+        try:
+            self.path(sha256).unlink()
+            return 1
+        except FileNotFoundError:
+            return 0
+
+
+def create_blob_store(db, backend: str = LOGO_BLOB_BACKEND):
+    if backend == 'filesystem':
+        return FilesystemBlobStore()
+    if backend == 'gridfs':
+        return GridFSBlobStore(db)
+    raise ValueError(f"Unknown LOGO_BLOB_BACKEND: {backend}")
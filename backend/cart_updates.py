@@ -0,0 +1,87 @@
+"""
+Atomic cart mutations
+Builders for single-statement Mongo update pipelines that add, replace or
+remove cart lines and recompute the cart totals server-side, so concurrent
+writes to the same cart never lose an update.
+"""
+import hashlib
+from datetime import datetime
+from typing import List, Optional
+
+
+def cart_line_id(product_id: str, variant_color: str, size: str, design_json: Optional[str] = None,
+                 personalized: bool = False) -> str:
+    """Stable id for a cart line: same product, colour, size and design -> same line"""
+    design_hash = hashlib.sha256(design_json.encode('utf-8')).hexdigest() if design_json else ''
+    parts = [product_id, variant_color, size, design_hash]
+    if personalized:
+        # Name-printed garments are a separate line from the same garment without names
+        parts.append('personalized')
+    key = '|'.join(parts)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _line_ids(items_expr) -> dict:
+    return {'$map': {'input': items_expr, 'as': 'e', 'in': '$$e.line_id'}}
+
+
+def totals_stages(now: datetime, shipping_cost: float, free_shipping_threshold: float) -> List[dict]:
+    """Recompute subtotal/design_total/shipping/total from the items array"""
+    def line_sum(price_field: str) -> dict:
+        return {'$round': [{'$sum': {'$map': {
+            'input': '$items', 'as': 'i',
+            'in': {'$multiply': [f'$$i.{price_field}', '$$i.quantity']},
+        }}}, 2]}
+
+    return [
+        {'$set': {'subtotal': line_sum('base_price'), 'design_total': line_sum('design_price')}},
+        {'$set': {'shipping': {'$cond': [
+            {'$gte': [{'$add': ['$subtotal', '$design_total']}, free_shipping_threshold]},
+            0.0,
+            shipping_cost,
+        ]}}},
+        {'$set': {
+            'total': {'$round': [{'$add': ['$subtotal', '$design_total', '$shipping']}, 2]},
+            'updated_at': {'$literal': now},
+        }},
+    ]
+
+
+def upsert_lines_pipeline(lines: List[dict], new_cart_id: str, now: datetime,
+                          shipping_cost: float, free_shipping_threshold: float) -> List[dict]:
+    """Replace lines whose line_id already exists (in place) and append the rest"""
+    new_lines = {'$literal': lines}
+    new_ids = [line['line_id'] for line in lines]
+    merged = {'$let': {
+        'vars': {'existing': {'$ifNull': ['$items', []]}},
+        'in': {'$concatArrays': [
+            {'$map': {'input': '$$existing', 'as': 'it', 'in': {'$cond': [
+                {'$in': ['$$it.line_id', new_ids]},
+                {'$arrayElemAt': [{'$filter': {
+                    'input': new_lines, 'as': 'n', 'cond': {'$eq': ['$$n.line_id', '$$it.line_id']},
+                }}, 0]},
+                '$$it',
+            ]}}},
+            {'$filter': {'input': new_lines, 'as': 'n', 'cond': {
+                '$not': [{'$in': ['$$n.line_id', _line_ids('$$existing')]}],
+            }}},
+        ]},
+    }}
+    return [
+        {'$set': {
+            'id': {'$ifNull': ['$id', new_cart_id]},
+            'user_id': {'$ifNull': ['$user_id', None]},
+            'items': merged,
+        }},
+        *totals_stages(now, shipping_cost, free_shipping_threshold),
+    ]
+
+
+def remove_line_pipeline(line_id: str, now: datetime, shipping_cost: float,
+                         free_shipping_threshold: float) -> List[dict]:
+    return [
+        {'$set': {'items': {'$filter': {
+            'input': '$items', 'as': 'it', 'cond': {'$ne': ['$$it.line_id', {'$literal': line_id}]},
+        }}}},
+        *totals_stages(now, shipping_cost, free_shipping_threshold),
+    ]
@@ -0,0 +1,281 @@
+"""
+In-memory product catalog
+Holds a snapshot of all active products with secondary indexes so the
+product listing endpoints never touch Mongo. Staleness is bounded by a
+catalog version counter that /seed bumps and every worker polls.
+"""
+import asyncio
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import orjson
+from pymongo import ReturnDocument
+
+from search_index import SearchHit, SearchIndex
+
+logger = logging.getLogger(__name__)
+
+CATALOG_POLL_INTERVAL = float(os.environ.get('CATALOG_POLL_INTERVAL', '5'))
+CATALOG_META_ID = 'products'
+
+# Stable listing order: featured first, then cheapest, slug breaks ties.
+# Slugs survive /seed (ids do not), so cursors stay valid across a reseed.
+# Mongo reads use the same order so the compound indexes below serve them.
+LISTING_SORT = [('featured', -1), ('base_price', 1), ('slug', 1)]
+LISTING_INDEXES = [
+    [('active', 1)] + LISTING_SORT,
+    [('category', 1), ('active', 1)] + LISTING_SORT,
+]
+
+
+def listing_key(product: dict) -> Tuple[bool, float, str]:
+    return (not product.get('featured', False), product['base_price'], product['slug'])
+
+
+def encode_cursor(product: dict) -> str:
+    """Opaque keyset cursor pointing just past this product"""
+    raw = json.dumps([bool(product.get('featured', False)), product['base_price'], product['slug']],
+                     separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, float, str]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        featured, base_price, slug = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {e}") from e
+    if not isinstance(featured, bool) or not isinstance(base_price, (int, float)) or not isinstance(slug, str):
+        raise ValueError("invalid cursor")
+    return (not featured, float(base_price), slug)
+
+
+class CatalogSnapshot:
+    """Immutable view of the active catalog at one version."""
+
+    def __init__(self, products: List[dict], version: int, serializer: Optional[Callable[[dict], bytes]] = None):
+        self.version = version
+        # Positions follow the listing order, so sorted postings are listing-ordered too
+        order = sorted(range(len(products)), key=lambda i: listing_key(products[i]))
+        self.products = [products[i] for i in order]
+        # Position -> index in the loaded (Mongo natural) order, for skip/limit callers
+        self._load_rank = order
+        products = self.products
+        self._keys = [listing_key(p) for p in products]
+        self.by_id: Dict[str, int] = {}
+        self.by_slug: Dict[str, int] = {}
+        self.by_category: Dict[str, List[int]] = {}
+        self.by_brand: Dict[str, List[int]] = {}
+        self.by_print_method: Dict[str, List[int]] = {}
+        self.featured: List[int] = []
+
+        for pos, product in enumerate(products):
+            self.by_id[product['id']] = pos
+            self.by_slug[product['slug']] = pos
+            self.by_category.setdefault(product.get('category'), []).append(pos)
+            self.by_brand.setdefault(product.get('brand'), []).append(pos)
+            for method in product.get('print_methods', []):
+                self.by_print_method.setdefault(method, []).append(pos)
+            if product.get('featured'):
+                self.featured.append(pos)
+
+        # Price-sorted parallel arrays for min_price/max_price range filtering
+        by_price = sorted(range(len(products)), key=lambda pos: products[pos]['base_price'])
+        self._prices = [products[pos]['base_price'] for pos in by_price]
+        self._price_positions = by_price
+
+        self.search_index = SearchIndex(products)
+
+        # Changes with the version counter and with the product set itself (ids change on /seed)
+        fingerprint = hashlib.sha256(f"{version}:".encode('utf-8'))
+        for product in products:
+            fingerprint.update(product['id'].encode('utf-8'))
+        self.fingerprint = fingerprint.hexdigest()
+
+        # Canonical JSON per product, serialized on first use and kept for this version
+        self._serializer = serializer or orjson.dumps
+        self._json: List[Optional[bytes]] = [None] * len(products)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def get_by_id(self, product_id: str) -> Optional[dict]:
+        pos = self.by_id.get(product_id)
+        return None if pos is None else self.products[pos]
+
+    def get_by_slug(self, slug: str) -> Optional[dict]:
+        pos = self.by_slug.get(slug)
+        return None if pos is None else self.products[pos]
+
+    def _price_range(self, min_price: Optional[float], max_price: Optional[float]) -> Set[int]:
+        lo = 0 if min_price is None else bisect.bisect_left(self._prices, min_price)
+        hi = len(self._prices) if max_price is None else bisect.bisect_right(self._prices, max_price)
+        return set(self._price_positions[lo:hi])
+
+    def filter(
+        self,
+        category: Optional[str] = None,
+        brand: Optional[str] = None,
+        print_method: Optional[str] = None,
+        featured: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+    ) -> List[int]:
+        """Positions matching all filters, in catalog order"""
+        postings: List[List[int]] = []
+        if category:
+            postings.append(self.by_category.get(category, []))
+        if brand:
+            postings.append(self.by_brand.get(brand, []))
+        if print_method:
+            postings.append(self.by_print_method.get(print_method, []))
+        if featured:
+            postings.append(self.featured)
+
+        # Intersect starting from the shortest posting list
+        postings.sort(key=len)
+        candidates: Optional[Set[int]] = None
+        for posting in postings:
+            candidates = set(posting) if candidates is None else candidates.intersection(posting)
+            if not candidates:
+                return []
+        if min_price is not None or max_price is not None:
+            in_range = self._price_range(min_price, max_price)
+            candidates = in_range if candidates is None else candidates & in_range
+        if featured is False:
+            featured_set = set(self.featured)
+            if candidates is None:
+                candidates = set(range(len(self.products)))
+            candidates -= featured_set
+
+        if candidates is None:
+            return list(range(len(self.products)))
+        return sorted(candidates)
+
+    def search(self, search: str, **filters) -> List[SearchHit]:
+        """Full-text hits within the filtered products, best match first"""
+        allowed = self.filter(**filters) if any(v is not None for v in filters.values()) else None
+        return self.search_index.search(search, allowed=allowed)
+
+    def query_positions(self, skip: int = 0, limit: int = 50, search: Optional[str] = None,
+                        load_order: bool = False, **filters) -> List[int]:
+        """skip/limit window; load_order keeps the natural order the skip/limit API always returned"""
+        if search:
+            positions = [hit.pos for hit in self.search(search, **filters)]
+        else:
+            positions = self.filter(**filters)
+            if load_order:
+                positions.sort(key=self._load_rank.__getitem__)
+        return positions[skip:skip + limit]
+
+    def query(self, skip: int = 0, limit: int = 50, search: Optional[str] = None, **filters) -> List[dict]:
+        return [self.products[pos] for pos in self.query_positions(skip, limit, search, **filters)]
+
+    def page_positions(self, cursor: Optional[str], limit: int = 50, **filters) -> Tuple[List[int], Optional[str]]:
+        """Keyset pagination: positions strictly after the cursor plus the next cursor"""
+        positions = self.filter(**filters)
+        start = 0
+        if cursor:
+            # The cursor's product may be gone after a reseed; its key still orders correctly
+            start = bisect.bisect_left(positions, bisect.bisect_right(self._keys, decode_cursor(cursor)))
+        window = positions[start:start + limit]
+        next_cursor = encode_cursor(self.products[window[-1]]) if window and start + limit < len(positions) else None
+        return window, next_cursor
+
+    def page(self, cursor: Optional[str], limit: int = 50, **filters) -> Tuple[List[dict], Optional[str]]:
+        window, next_cursor = self.page_positions(cursor, limit, **filters)
+        return [self.products[pos] for pos in window], next_cursor
+
+    def product_json(self, pos: int) -> bytes:
+        data = self._json[pos]
+        if data is None:
+            data = self._json[pos] = self._serializer(self.products[pos])
+        return data
+
+    def list_json(self, positions: List[int]) -> bytes:
+        """JSON array of products assembled from the cached per-product bytes"""
+        return b'[' + b','.join([self.product_json(pos) for pos in positions]) + b']'
+
+
+class CatalogEngine:
+    """Owns the current snapshot and keeps it in step with the version counter"""
+
+    def __init__(self, db, serializer: Optional[Callable[[dict], bytes]] = None,
+                 poll_interval: float = CATALOG_POLL_INTERVAL):
+        self.db = db
+        self.serializer = serializer
+        self.poll_interval = poll_interval
+        self.snapshot = CatalogSnapshot([], version=-1)
+        self.loaded = False
+        self.reloads = 0
+        self._lock = asyncio.Lock()
+        self._poller: Optional[asyncio.Task] = None
+
+    async def read_version(self) -> int:
+        meta = await self.db.catalog_meta.find_one({'_id': CATALOG_META_ID})
+        return meta['version'] if meta else 0
+
+    async def load(self) -> CatalogSnapshot:
+        async with self._lock:
+            # Read the version first so a concurrent /seed can only make us reload again
+            version = await self.read_version()
+            # Unsorted: the snapshot orders by listing key itself and remembers this natural order
+            products = await self.db.products.find({'active': True}, {'_id': 0}).to_list(None)
+            self.snapshot = CatalogSnapshot(products, version, serializer=self.serializer)
+            self.loaded = True
+            self.reloads += 1
+            logger.info(f"Catalog loaded: {len(products)} products (version {version})")
+            return self.snapshot
+
+    async def get(self) -> CatalogSnapshot:
+        if not self.loaded:
+            return await self.load()
+        return self.snapshot
+
+    async def bump_version(self) -> int:
+        """Mark the catalog as changed for all workers and reload locally"""
+        meta = await self.db.catalog_meta.find_one_and_update(
+            {'_id': CATALOG_META_ID},
+            {'$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        await self.load()
+        return meta['version']
+
+    async def refresh_if_stale(self) -> bool:
+        if self.loaded and await self.read_version() == self.snapshot.version:
+            return False
+        await self.load()
+        return True
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh_if_stale()
+            except Exception as e:
+                logger.warning(f"Catalog refresh failed: {e}")
+
+    def start(self):
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def stats(self) -> dict:
+        return {
+            'version': self.snapshot.version,
+            'products': len(self.snapshot),
+            'loaded': self.loaded,
+            'reloads': self.reloads,
+        }
@@ -0,0 +1,93 @@
+"""
+Checkout status polling
+The success page polls /api/checkout/status/{session_id} until the payment
+settles. CheckoutStatusCache answers a poll from, in order: a short-lived
+per-worker cache of the last Stripe answer, the payment transaction in
+Mongo once it is paid (webhook or an earlier poll), and only then Stripe -
+with concurrent polls for the same session sharing one upstream call. The
+transaction and order are marked paid once, by the call that saw it.
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from retention import payment_state_update
+from stripe_gateway import CheckoutStatus
+from ttl_cache import TTLCache
+
+
+def is_final(status: CheckoutStatus) -> bool:
+    return status.payment_status == 'paid' or status.status == 'expired'
+
+
+class CheckoutStatusCache:
+    def __init__(self, db, ttl: float, final_ttl: float, maxsize: int):
+        self.db = db
+        self.final_ttl = final_ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.polls = 0
+        self.coalesced = 0
+        self.db_answers = 0
+        self.upstream_calls = 0
+
+    async def get(self, session_id: str, gateway) -> CheckoutStatus:
+        self.polls += 1
+        found, status = self.cache.get(session_id)
+        if found:
+            return status
+        task = self._inflight.get(session_id)
+        if task:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._resolve(session_id, gateway))
+            self._inflight[session_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        return await asyncio.shield(task)
+
+    async def _paid_transaction(self, session_id: str) -> Optional[CheckoutStatus]:
+        tx = await self.db.payment_transactions.find_one(
+            {'session_id': session_id, 'payment_status': 'paid'},
+            {'_id': 0, 'amount': 1, 'currency': 1, 'metadata': 1},
+        )
+        if tx is None:
+            return None
+        # Same shape as Stripe's answer: amount_total in minor units
+        return CheckoutStatus(status='complete', payment_status='paid', amount_total=round(tx['amount'] * 100),
+                              currency=tx.get('currency'), metadata=tx.get('metadata') or {})
+
+    async def _mark_paid(self, session_id: str) -> None:
+        # Filtered on not yet paid: a webhook that got there first is not rewritten
+        await asyncio.gather(
+            self.db.payment_transactions.update_one(
+                {'session_id': session_id, 'payment_status': {'$ne': 'paid'}},
+                payment_state_update('paid', {'updated_at': datetime.now(timezone.utc).isoformat()}),
+            ),
+            self.db.orders.update_one(
+                {'stripe_session_id': session_id, 'payment_status': {'$ne': 'paid'}},
+                {'$set': {'payment_status': 'paid', 'status': 'processing'}},
+            ),
+        )
+
+    async def _resolve(self, session_id: str, gateway) -> CheckoutStatus:
+        status = await self._paid_transaction(session_id)
+        if status is not None:
+            self.db_answers += 1
+        else:
+            self.upstream_calls += 1
+            status = await gateway.get_checkout_status(session_id)
+            if status.payment_status == 'paid':
+                await self._mark_paid(session_id)
+        self.cache.set(session_id, status, ttl=self.final_ttl if is_final(status) else None)
+        return status
+
+    def stats(self) -> dict:
+        return {
+            'polls': self.polls,
+            'upstream_calls': self.upstream_calls,
+            'saved_calls': self.polls - self.upstream_calls,
+            'cache_hits': self.cache.hits,
+            'coalesced': self.coalesced,
+            'db_answers': self.db_answers,
+            'cache': self.cache.stats(),
+        }
@@ -0,0 +1,129 @@
+"""
+Content-addressed design assets
+Logo images embedded in designs (data URLs from the customizer) are stored
+once per SHA-256 in the blob store, with a small metadata document in
+design_assets. Carts/orders keep only the hash and a short URL. The
+pixels are fetched lazily from /api/design-assets/{hash} when the customizer
+or production actually needs them. Only raster images are accepted: the
+bytes are served back from the shop's own origin, where HTML or a scripted
+SVG would run as the shop.
+"""
+import base64
+import binascii
+import re
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from blob_store import single_chunk
+
+ASSET_URL_PREFIX = '/api/design-assets/'
+MAX_ASSET_BYTES = 10 * 1024 * 1024
+ASSET_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/webp', 'image/gif')
+
+_DATA_URL_RE = re.compile(r'^data:(?P<type>[\w.+-]+/[\w.+-]+)(?:;[\w=.+-]+)*;base64,(?P<data>.*)$', re.S)
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class InvalidAsset(ValueError):
+    pass
+
+
+def asset_url(sha256: str) -> str:
+    return f"{ASSET_URL_PREFIX}{sha256}"
+
+
+def asset_hash_from_url(url: Optional[str]) -> Optional[str]:
+    if url and url.startswith(ASSET_URL_PREFIX):
+        candidate = url[len(ASSET_URL_PREFIX):]
+        if _HASH_RE.match(candidate):
+            return candidate
+    return None
+
+
+def is_asset_hash(value: str) -> bool:
+    return bool(_HASH_RE.match(value))
+
+
+def parse_data_url(value: str) -> Optional[Tuple[str, bytes]]:
+    """(content_type, bytes) for a base64 data URL, None for anything else"""
+    match = _DATA_URL_RE.match(value or '')
+    if not match:
+        return None
+    content_type = match.group('type').lower()
+    if content_type not in ASSET_CONTENT_TYPES:
+        raise InvalidAsset(f"unsupported content type: {content_type}")
+    encoded = match.group('data')
+    if len(encoded) * 3 // 4 > MAX_ASSET_BYTES:
+        raise InvalidAsset("asset too large")
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidAsset(f"invalid base64: {e}") from e
+    return content_type, data
+
+
+class DesignAssetStore:
+    def __init__(self, db, blobs):
+        self.collection = db.design_assets
+        self.blobs = blobs
+        self.stored = 0
+        self.deduplicated = 0
+
+    async def put(self, content_type: str, data: bytes) -> str:
+        """Store bytes under their SHA-256; identical uploads share one document"""
+        blob = await self.blobs.put(single_chunk(data), max_bytes=MAX_ASSET_BYTES)
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            # last_used_at keeps a re-used asset out of the retention sweep
+            await self.collection.update_one(
+                {'_id': blob.sha256},
+                {'$setOnInsert': {
+                    'content_type': content_type,
+                    'size': blob.size,
+                    'created_at': now,
+                }, '$set': {'last_used_at': now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass
+        if blob.created:
+            self.stored += 1
+        else:
+            self.deduplicated += 1
+        return blob.sha256
+
+    async def touch(self, sha256: str) -> None:
+        """Mark an already stored asset as used again (see retention.py)"""
+        await self.collection.update_one(
+            {'_id': sha256}, {'$set': {'last_used_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def get(self, sha256: str) -> Optional[dict]:
+        return await self.collection.find_one({'_id': sha256})
+
+    async def read(self, sha256: str) -> Optional[bytes]:
+        return await self.blobs.read(sha256)
+
+    async def intern(self, value: str) -> Tuple[str, Optional[str]]:
+        """Replace a data URL with its asset URL; returns (url, hash)"""
+        existing = asset_hash_from_url(value)
+        if existing:
+            await self.touch(existing)
+            return value, existing
+        parsed = parse_data_url(value)
+        if parsed is None:
+            return value, None
+        sha256 = await self.put(*parsed)
+        return asset_url(sha256), sha256
+
+    async def resolve_data_url(self, sha256: str) -> Optional[str]:
+        asset = await self.get(sha256)
+        data = await self.read(sha256) if asset else None
+        if data is None:
+            return None
+        return f"data:{asset['content_type']};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def stats(self) -> dict:
+        return {'stored': self.stored, 'deduplicated': self.deduplicated}
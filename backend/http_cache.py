@@ -0,0 +1,97 @@
+"""
+HTTP caching helpers
+Strong ETags derived from version tokens, If-None-Match handling,
+single-range requests and per-route Cache-Control policies (overridable via
+environment).
+"""
+import hashlib
+import os
+import re
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+
+CACHE_POLICIES = {
+    'products': os.environ.get('CACHE_CONTROL_PRODUCTS', 'public, max-age=60, must-revalidate'),
+    'product': os.environ.get('CACHE_CONTROL_PRODUCT', 'public, max-age=60, must-revalidate'),
+    'categories': os.environ.get('CACHE_CONTROL_CATEGORIES', 'public, max-age=3600'),
+    'pricing': os.environ.get('CACHE_CONTROL_PRICING', 'public, max-age=300, must-revalidate'),
+    'design_asset': os.environ.get('CACHE_CONTROL_DESIGN_ASSET', 'public, max-age=31536000, immutable'),
+    'logo': os.environ.get('CACHE_CONTROL_LOGO', 'public, max-age=31536000, immutable'),
+}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def query_token(request: Request) -> str:
+    """Order-independent representation of the query string"""
+    return '&'.join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) for a single "bytes=" range; None means send the whole body.
+
+    Multiple ranges and malformed headers are ignored (RFC 9110 14.2 allows it).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def if_range_allows(request: Request, etag: str) -> bool:
+    """A Range is only honoured when If-Range is absent or names the current ETag"""
+    if_range = request.headers.get('if-range')
+    return if_range is None or if_range.strip() == etag
+
+
+def raw_json(body: bytes, response: Response) -> Response:
+    """Pre-serialized JSON body carrying the headers already set on the injected response"""
+    headers = {k: v for k, v in response.headers.items() if k != 'content-length'}
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def conditional(request: Request, response: Response, etag: str, policy: str) -> Optional[Response]:
+    """Return a 304 if the client already has this representation, else set caching headers"""
+    cache_control = CACHE_POLICIES[policy]
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = cache_control
+    return None
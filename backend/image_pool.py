@@ -0,0 +1,125 @@
+"""
+Sandboxed image worker pool
+Decoding and rasterising customer files (PNG/JPEG/SVG/PDF) is CPU heavy and
+the inputs are untrusted, so the work runs in a spawn process pool whose
+workers have an address-space limit and a per-task CPU alarm.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+IMAGE_POOL_SIZE = int(os.environ.get('IMAGE_POOL_SIZE', str(min(2, os.cpu_count() or 1))))
+IMAGE_TASK_TIMEOUT = int(os.environ.get('IMAGE_TASK_TIMEOUT', '20'))  # seconds per task
+IMAGE_WORKER_MEMORY_MB = int(os.environ.get('IMAGE_WORKER_MEMORY_MB', '768'))
+# Pillow refuses anything larger (decompression bombs)
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', str(40_000_000)))
+
+
+class ImageTaskTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise ImageTaskTimeout("image task exceeded its time limit")
+
+
+def _init_worker(memory_mb: int, max_pixels: int) -> None:
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not limit image worker memory: {e}")
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _on_alarm)
+    import warnings
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+def _limited(timeout: int, fn, *args):
+    """Runs inside the worker: fn(*args) under a SIGALRM deadline"""
+    if hasattr(signal, 'SIGALRM'):
+        signal.alarm(timeout)
+    try:
+        return fn(*args)
+    finally:
+        if hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+
+
+class ImageWorkerPool:
+    def __init__(self, pool_size: int = IMAGE_POOL_SIZE, timeout: int = IMAGE_TASK_TIMEOUT,
+                 memory_mb: int = IMAGE_WORKER_MEMORY_MB, max_pixels: int = IMAGE_MAX_PIXELS):
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.max_pixels = max_pixels
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.latency = LatencyStats()
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.memory_mb, self.max_pixels),
+            )
+            logger.info(f"Image worker pool started (workers={self.pool_size}, "
+                        f"timeout={self.timeout}s, memory={self.memory_mb}MB)")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """fn must be a module-level function so it can be pickled into the pool"""
+        self.start()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            # The outer deadline also covers a worker that died or never got scheduled
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, _limited, self.timeout, fn, *args),
+                timeout=self.timeout * 3,
+            )
+        except (ImageTaskTimeout, asyncio.TimeoutError):
+            self.timed_out += 1
+            raise ImageTaskTimeout(f"{getattr(fn, '__name__', fn)} timed out")
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool on the next call
+            self.failed += 1
+            self.shutdown()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            self.latency.observe((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.pool_size,
+            'pending': self._pending,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'latency': self.latency.snapshot(),
+        }
@@ -0,0 +1,186 @@
+"""
+Index registry
+Declarative list of every index the API relies on, applied idempotently at
+startup, plus an explain()-based audit that flags collection scans for the
+known query shapes.
+
+CLI:
+    python indexes.py apply
+    python indexes.py audit
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from blob_store import GRIDFS_BUCKET
+from catalog import LISTING_INDEXES, LISTING_SORT
+from retention import CART_RETENTION_DAYS, WEBHOOK_RETENTION_DAYS, retention_seconds
+
+logger = logging.getLogger(__name__)
+
+# Mongo error codes for an existing index with other options/keys under the same name
+INDEX_CONFLICT_CODES = {85, 86}
+DUPLICATE_KEY_CODE = 11000
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    unique: bool = False
+    options: Dict[str, Any] = field(default_factory=dict, hash=False)
+
+    @property
+    def name(self) -> str:
+        return '_'.join(f"{k}_{d}" for k, d in self.keys)
+
+
+def _spec(collection: str, *keys: Tuple[str, int], unique: bool = False, **options) -> IndexSpec:
+    return IndexSpec(collection, tuple(keys), unique, options)
+
+
+INDEXES: List[IndexSpec] = [
+    _spec('users', ('email', 1), unique=True),
+    _spec('users', ('id', 1), unique=True),
+    _spec('products', ('id', 1), unique=True),
+    _spec('products', ('slug', 1), unique=True),
+    *[_spec('products', *keys) for keys in LISTING_INDEXES],
+    _spec('carts', ('session_id', 1), unique=True),
+    _spec('orders', ('id', 1), unique=True),
+    _spec('orders', ('order_number', 1), unique=True),
+    _spec('orders', ('stripe_session_id', 1)),
+    _spec('orders', ('vipps_reference', 1)),
+    _spec('payment_transactions', ('session_id', 1)),
+    _spec('payment_transactions', ('reference', 1)),
+    _spec('logos', ('id', 1), unique=True),
+    # One GridFS file per content hash, also under concurrent uploads of the same bytes
+    _spec(f'{GRIDFS_BUCKET}.files', ('filename', 1), unique=True),
+    _spec('webhook_inbox', ('status', 1), ('received_at', 1)),
+    # TTL indexes: the fields hold real Dates (see retention.py)
+    _spec('carts', ('updated_at', 1), expireAfterSeconds=retention_seconds(CART_RETENTION_DAYS)),
+    _spec('payment_transactions', ('expires_at', 1), expireAfterSeconds=0),
+    _spec('webhook_inbox', ('processed_at', 1), expireAfterSeconds=retention_seconds(WEBHOOK_RETENTION_DAYS)),
+    # Retention sweep: candidates by age, then the lines that still reference them
+    _spec('logos', ('created_at', 1)),
+    _spec('design_assets', ('created_at', 1)),
+    *[_spec(collection, (f'items.design.{field}', 1), sparse=True)
+      for collection in ('carts', 'orders') for field in ('logo_asset', 'preview_asset', 'logo_id')],
+]
+
+# Query shapes issued by server.py: (name, collection, filter, sort)
+QUERY_SHAPES: List[Tuple[str, str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ('users.by_email', 'users', {'email': 'audit@firmaprint.no'}, None),
+    ('users.by_id', 'users', {'id': 'audit'}, None),
+    ('products.by_id', 'products', {'id': 'audit'}, None),
+    ('products.by_slug', 'products', {'slug': 'audit', 'active': True}, None),
+    ('products.listing', 'products', {'active': True}, LISTING_SORT),
+    ('products.category_listing', 'products', {'category': 'audit', 'active': True}, LISTING_SORT),
+    ('carts.by_session', 'carts', {'session_id': 'audit'}, None),
+    ('orders.by_id', 'orders', {'id': 'audit'}, None),
+    ('orders.by_number', 'orders', {'order_number': 'audit'}, None),
+    ('orders.by_stripe_session', 'orders', {'stripe_session_id': 'audit'}, None),
+    ('orders.by_vipps_reference', 'orders', {'vipps_reference': 'audit'}, None),
+    ('payment_transactions.by_session', 'payment_transactions', {'session_id': 'audit'}, None),
+    ('payment_transactions.by_reference', 'payment_transactions', {'reference': 'audit'}, None),
+    ('logos.by_id', 'logos', {'id': 'audit'}, None),
+    ('webhook_inbox.pending', 'webhook_inbox', {'status': 'pending'}, [('received_at', 1)]),
+    ('carts.by_logo_asset', 'carts', {'items.design.logo_asset': {'$in': ['audit']}}, None),
+    ('orders.by_logo_asset', 'orders', {'items.design.logo_asset': {'$in': ['audit']}}, None),
+    ('orders.by_logo_id', 'orders', {'items.design.logo_id': {'$in': ['audit']}}, None),
+    ('logos.retention_candidates', 'logos', {'created_at': {'$lt': 'audit'}}, None),
+]
+
+
+async def apply_indexes(db, specs: List[IndexSpec] = INDEXES) -> List[dict]:
+    """Create every registered index; existing identical indexes are a no-op"""
+    results = []
+    for spec in specs:
+        status = 'ok'
+        try:
+            await db[spec.collection].create_index(
+                list(spec.keys), name=spec.name, unique=spec.unique, **spec.options
+            )
+        except OperationFailure as e:
+            if e.code in INDEX_CONFLICT_CODES and 'expireAfterSeconds' in spec.options:
+                # A changed retention window is updated in place instead of rebuilding the index
+                await db.command({'collMod': spec.collection, 'index': {
+                    'name': spec.name, 'expireAfterSeconds': spec.options['expireAfterSeconds'],
+                }})
+                status = 'ttl_updated'
+                logger.info(f"TTL of {spec.collection}.{spec.name} set to {spec.options['expireAfterSeconds']}s")
+            elif e.code in INDEX_CONFLICT_CODES:
+                status = 'conflict'
+                logger.error(f"Index {spec.collection}.{spec.name} exists with different options: {e}")
+            elif e.code == DUPLICATE_KEY_CODE:
+                status = 'duplicates'
+                logger.error(f"Unique index {spec.collection}.{spec.name} blocked by duplicate documents: {e}")
+            else:
+                raise
+        results.append({'collection': spec.collection, 'index': spec.name, 'unique': spec.unique, 'status': status})
+    return results
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get('stage', '?')]
+    for child_key in ('inputStage', 'queryPlan'):
+        if child_key in plan:
+            stages += _plan_stages(plan[child_key])
+    for child in plan.get('inputStages', []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def audit_queries(db, shapes=QUERY_SHAPES) -> List[dict]:
+    """explain() each known query shape and flag collection scans and in-memory sorts"""
+    report = []
+    for name, collection, query, sort in shapes:
+        find: Dict[str, Any] = {'find': collection, 'filter': query}
+        if sort:
+            find['sort'] = dict(sort)
+        explain = await db.command({'explain': find, 'verbosity': 'queryPlanner'})
+        stages = _plan_stages(explain['queryPlanner']['winningPlan'])
+        report.append({
+            'query': name,
+            'collection': collection,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages,
+            'in_memory_sort': 'SORT' in stages,
+        })
+    return report
+
+
+async def _main(command: str) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if command == 'apply':
+            results = await apply_indexes(db)
+            for r in results:
+                print(f"{r['status']:<10} {r['collection']}.{r['index']}{' (unique)' if r['unique'] else ''}")
+            return 0 if all(r['status'] in ('ok', 'ttl_updated') for r in results) else 1
+        report = await audit_queries(db)
+        for r in report:
+            flag = 'COLLSCAN' if r['collscan'] else ('SORT' if r['in_memory_sort'] else 'ok')
+            print(f"{flag:<10} {r['query']:<36} {' > '.join(r['stages'])}")
+        return 1 if any(r['collscan'] for r in report) else 0
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply or audit Firmaprint MongoDB indexes")
+    parser.add_argument('command', choices=['apply', 'audit'])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(args.command)))
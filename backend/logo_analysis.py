@@ -0,0 +1,249 @@
+"""
+Logo colour and complexity analysis
+Runs in the image worker pool on a downscaled raster of the logo:
+background removal, k-means colour quantisation to the dominant thread/ink
+colours, gradient-based edge density as a detail score, and a rough
+embroidery stitch estimate for a given print size. Results are cached per
+content SHA-256 in logo_analysis.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+from logo_derivatives import UnsupportedLogo, _rasterise
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_SIZE = 256          # longest side of the raster that is analysed
+MAX_CLUSTERS = 8
+MIN_COLOR_SHARE = 0.02       # colours covering less of the logo are ignored
+MERGE_DISTANCE = 28.0        # RGB distance under which two colours are one thread
+EDGE_THRESHOLD = 48.0
+MAX_EMBROIDERY_COLORS = 6
+MIN_RESOLUTION = 300
+
+# Rough production figures for the stitch estimate
+FILL_STITCHES_PER_CM2 = 150
+OUTLINE_STITCHES_PER_CM = 30
+
+# Pool timeouts, a broken pool or an unreadable blob are retried after this long
+ANALYSIS_RETRY_SECONDS = 300
+
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+STATUS_UNSUPPORTED = 'unsupported'
+
+
+# ---------- worker side (runs in the image pool) ----------
+
+def _sniff(data: bytes) -> str:
+    head = data[:512].lstrip()
+    if head.startswith(b'%PDF'):
+        return 'application/pdf'
+    if head.startswith(b'<?xml') or head.startswith(b'<svg') or b'<svg' in head:
+        return 'image/svg+xml'
+    return 'image/raster'
+
+
+def _foreground_mask(rgba: np.ndarray) -> np.ndarray:
+    alpha = rgba[..., 3]
+    if (alpha < 128).mean() > 0.01:
+        return alpha >= 128
+    # Opaque image: treat the dominant border colour as background
+    rgb = rgba[..., :3].astype(np.int16)
+    border = np.concatenate([rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]])
+    keys = (border[:, 0] >> 4) << 8 | (border[:, 1] >> 4) << 4 | (border[:, 2] >> 4)
+    values, counts = np.unique(keys, return_counts=True)
+    if counts.max() < 0.5 * len(border):
+        return np.ones(alpha.shape, dtype=bool)
+    background = border[keys == values[counts.argmax()]].mean(axis=0)
+    return np.linalg.norm(rgb - background, axis=-1) > MERGE_DISTANCE
+
+
+def _kmeans(pixels: np.ndarray, k: int, iterations: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    # Seed with the most common 4-bit colour bins
+    quantised = pixels.astype(np.int32) >> 4
+    keys = quantised[:, 0] << 8 | quantised[:, 1] << 4 | quantised[:, 2]
+    values, counts = np.unique(keys, return_counts=True)
+    seeds = values[np.argsort(counts)[::-1][:k]]
+    centres = np.stack([(seeds >> 8) & 15, (seeds >> 4) & 15, seeds & 15], axis=1).astype(np.float32) * 16 + 8
+    for _ in range(iterations):
+        distances = ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=-1)
+        labels = distances.argmin(axis=1)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, labels, pixels)
+        sizes = np.bincount(labels, minlength=len(centres)).astype(np.float32)
+        keep = sizes > 0
+        centres = sums[keep] / sizes[keep, None]
+    labels = ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+    return centres, np.bincount(labels, minlength=len(centres)) / len(pixels)
+
+
+def _dominant_colors(centres: np.ndarray, shares: np.ndarray) -> List[dict]:
+    colors: List[dict] = []
+    for index in np.argsort(shares)[::-1]:
+        centre, share = centres[index], float(shares[index])
+        for color in colors:
+            if np.linalg.norm(color['rgb'] - centre) < MERGE_DISTANCE:
+                color['share'] += share
+                break
+        else:
+            colors.append({'rgb': centre, 'share': share})
+    return [c for c in colors if c['share'] >= MIN_COLOR_SHARE]
+
+
+def analyze_logo(data: bytes) -> dict:
+    from PIL import Image
+
+    kind = _sniff(data)
+    image = _rasterise(data, kind, ANALYSIS_SIZE * 4)
+    width, height = image.size
+    # Nearest-neighbour keeps the original palette instead of inventing blended colours
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.NEAREST)
+    rgba = np.asarray(image)
+
+    mask = _foreground_mask(rgba)
+    coverage = float(mask.mean())
+    pixels = rgba[..., :3][mask].astype(np.float32)
+    if len(pixels) == 0:
+        pixels = rgba[..., :3].reshape(-1, 3).astype(np.float32)
+    if len(pixels) > 20000:
+        pixels = pixels[np.random.default_rng(0).choice(len(pixels), 20000, replace=False)]
+    centres, shares = _kmeans(pixels, MAX_CLUSTERS)
+    colors = _dominant_colors(centres, shares)
+
+    # Edge density: luminance gradient plus the outline of the foreground itself
+    luminance = rgba[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    luminance = np.where(mask, luminance, 255.0)
+    gx = np.abs(np.diff(luminance, axis=1, prepend=luminance[:, :1]))
+    gy = np.abs(np.diff(luminance, axis=0, prepend=luminance[:1, :]))
+    edges = (np.hypot(gx, gy) > EDGE_THRESHOLD)
+    edge_density = float(edges.sum() / max(mask.sum(), 1))
+
+    distinct_bins = len(np.unique((pixels.astype(np.int32) >> 3) @ np.array([1 << 10, 1 << 5, 1])))
+    photographic = distinct_bins > 1500
+
+    return {
+        'width': width,
+        'height': height,
+        'colors': ['#%02x%02x%02x' % tuple(int(round(v)) for v in c['rgb']) for c in colors],
+        'color_shares': [round(c['share'], 3) for c in colors],
+        'coverage': round(coverage, 4),
+        'edge_density': round(edge_density, 4),
+        # Outline length in multiples of the logo width, to scale with print size
+        'edge_length': round(float(edges.sum()) / rgba.shape[1], 2),
+        'photographic': photographic,
+        'vector': kind != 'image/raster',
+        'complexity': classify_complexity(len(colors), edge_density, photographic),
+    }
+
+
+def classify_complexity(color_count: int, edge_density: float, photographic: bool) -> str:
+    if photographic or color_count > 5 or edge_density > 0.25:
+        return 'detailed'
+    if color_count <= 2 and edge_density < 0.08:
+        return 'simple'
+    return 'normal'
+
+
+# ---------- API side ----------
+
+def estimate_stitches(analysis: dict, width_cm: float, height_cm: float) -> int:
+    """Fill stitches over the covered area plus satin outline; +-30% at best"""
+    area = width_cm * height_cm * analysis['coverage']
+    outline_cm = analysis['edge_length'] * width_cm
+    return int(round(area * FILL_STITCHES_PER_CM2 + outline_cm * OUTLINE_STITCHES_PER_CM, -2))
+
+
+def design_warnings(analysis: dict, print_method: str) -> List[str]:
+    warnings = []
+    if min(analysis['width'], analysis['height']) < MIN_RESOLUTION and not analysis.get('vector'):
+        warnings.append('Logoen har lav oppløsning. For best resultat, bruk minst 300x300 piksler.')
+    if print_method == 'embroidery':
+        if len(analysis['colors']) > MAX_EMBROIDERY_COLORS:
+            warnings.append(
+                f"Logoen har {len(analysis['colors'])} farger. Brodering støtter maks "
+                f"{MAX_EMBROIDERY_COLORS} trådfarger, så enkelte farger blir slått sammen."
+            )
+        if analysis['photographic']:
+            warnings.append('Logoen har fargeoverganger som ikke kan broderes. Vi anbefaler trykk.')
+        elif analysis['complexity'] == 'detailed':
+            warnings.append('Logoen har mange små detaljer som kan bli utydelige ved brodering.')
+    return warnings
+
+
+class LogoAnalyzer:
+    def __init__(self, db, blobs, pool):
+        self.collection = db.logo_analysis
+        self.blobs = blobs
+        self.pool = pool
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.computed = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    async def analyze(self, sha256: str, wait: Optional[float] = None) -> Optional[dict]:
+        """Cached analysis for a blob; None if it cannot be analysed or is not done within wait seconds"""
+        cached = await self.collection.find_one({'_id': sha256})
+        if cached and not self._retry_due(cached):
+            self.cache_hits += 1
+            return cached if cached['status'] == STATUS_READY else None
+        # Concurrent requests for the same logo share one computation
+        task = self._inflight.get(sha256)
+        if task:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._compute(sha256))
+            self._inflight[sha256] = task
+            task.add_done_callback(lambda _: self._inflight.pop(sha256, None))
+        try:
+            # Shielded: a caller that stops waiting leaves the analysis running and it is stored when done
+            return await asyncio.wait_for(asyncio.shield(task), wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+
+    @staticmethod
+    def _retry_due(cached: dict) -> bool:
+        # Only ready/unsupported are final; a failure is recomputed once its retry_after has passed
+        if cached['status'] != STATUS_FAILED:
+            return False
+        retry_after = cached.get('retry_after')
+        return retry_after is None or retry_after <= datetime.now(timezone.utc).isoformat()
+
+    async def _compute(self, sha256: str) -> Optional[dict]:
+        source = await self.blobs.read(sha256)
+        if source is None:
+            return None
+        doc = {'_id': sha256, 'analyzed_at': datetime.now(timezone.utc).isoformat()}
+        try:
+            doc.update(await self.pool.run(analyze_logo, source), status=STATUS_READY)
+            self.computed += 1
+        except UnsupportedLogo as e:
+            doc.update(status=STATUS_UNSUPPORTED, error=str(e))
+        except Exception as e:
+            logger.warning(f"Logo analysis for {sha256} failed: {e}")
+            retry_after = datetime.now(timezone.utc) + timedelta(seconds=ANALYSIS_RETRY_SECONDS)
+            doc.update(status=STATUS_FAILED, error=str(e) or type(e).__name__, retry_after=retry_after.isoformat())
+            self.failed += 1
+        try:
+            # Replaces an earlier failure, never a result another worker stored meanwhile
+            await self.collection.replace_one({'_id': sha256, 'status': STATUS_FAILED}, doc, upsert=True)
+        except DuplicateKeyError:
+            pass
+        return doc if doc['status'] == STATUS_READY else None
+
+    def stats(self) -> dict:
+        return {
+            'computed': self.computed,
+            'cache_hits': self.cache_hits,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,231 @@
+"""
+Logo derivatives
+Uploads enqueue rendering of small previews (LOGO_DERIVATIVE_SIZES px in PNG
+and WebP) in the image worker pool. SVGs are rasterised with cairosvg (which
+also needs the system cairo library) and PDFs by their first page with
+PyMuPDF, both in requirements.txt; if one is missing anyway, the logo is
+marked unsupported instead of failing.
+
+Derivatives are keyed by the source SHA-256 (collection logo_derivatives,
+bytes in the blob store), so the same file is only ever rendered once.
+"""
+import asyncio
+import io
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from blob_store import single_chunk
+
+logger = logging.getLogger(__name__)
+
+LOGO_DERIVATIVE_SIZES = tuple(sorted(
+    int(s) for s in os.environ.get('LOGO_DERIVATIVE_SIZES', '128,512,1024').split(',')
+))
+LOGO_DERIVATIVE_FORMATS = ('png', 'webp')
+FORMAT_CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+# A failed render (pool timeout, broken pool, missing blob) may be requeued after this long
+DERIVATIVE_RETRY_SECONDS = 300
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+STATUS_UNSUPPORTED = 'unsupported'
+
+
+class UnsupportedLogo(Exception):
+    pass
+
+
+# ---------- worker side (runs in the image pool) ----------
+
+def _rasterise(data: bytes, content_type: str, max_size: int):
+    from PIL import Image
+
+    if content_type == 'image/svg+xml':
+        try:
+            import cairosvg
+        except (ImportError, OSError):  # OSError: installed, but the cairo library is missing
+            raise UnsupportedLogo("cairosvg is not installed")
+        data = cairosvg.svg2png(bytestring=data, output_width=max_size)
+    elif content_type == 'application/pdf':
+        try:
+            import fitz
+        except ImportError:
+            raise UnsupportedLogo("PyMuPDF is not installed")
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            page = doc[0]
+            zoom = max_size / max(page.rect.width, page.rect.height)
+            data = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=True).tobytes('png')
+
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        image.draft('RGB', (max_size, max_size))  # decode at reduced scale
+    image.load()
+    return image.convert('RGBA')
+
+
+def render_derivatives(data: bytes, content_type: str, sizes: Tuple[int, ...],
+                       formats: Tuple[str, ...]) -> List[dict]:
+    from PIL import Image
+
+    image = _rasterise(data, content_type, max(sizes))
+    variants = []
+    # Largest first so each step downsamples the previous (already small) image
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        for fmt in formats:
+            out = io.BytesIO()
+            if fmt == 'webp':
+                image.save(out, 'WEBP', quality=85, method=4)
+            else:
+                image.save(out, 'PNG', optimize=True)
+            variants.append({
+                'size': size, 'format': fmt, 'width': image.width, 'height': image.height,
+                'data': out.getvalue(),
+            })
+    return variants
+
+
+# ---------- API side ----------
+
+def best_variant(variants: List[dict], size: int, fmt: str) -> Optional[dict]:
+    """Smallest rendering that covers `size`, else the largest; prefers `fmt`, falls back to PNG"""
+    for candidate_format in (fmt, 'png'):
+        matching = sorted((v for v in variants if v['format'] == candidate_format), key=lambda v: v['size'])
+        if matching:
+            return next((v for v in matching if v['size'] >= size), matching[-1])
+    return None
+
+
+class LogoDerivatives:
+    def __init__(self, db, blobs, pool, sizes: Tuple[int, ...] = LOGO_DERIVATIVE_SIZES,
+                 formats: Tuple[str, ...] = LOGO_DERIVATIVE_FORMATS):
+        self.collection = db.logo_derivatives
+        self.blobs = blobs
+        self.pool = pool
+        self.sizes = sizes
+        self.formats = formats
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self.rendered = 0
+        self.reused = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def enqueue(self, sha256: str, content_type: str) -> bool:
+        """Schedule rendering unless this content was seen before (and did not fail); True if queued"""
+        try:
+            result = await self.collection.update_one(
+                {'_id': sha256},
+                {'$setOnInsert': {
+                    'status': STATUS_PENDING,
+                    'content_type': content_type,
+                    'variants': [],
+                    'created_at': datetime.now(timezone.utc).isoformat(),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            result = None
+        if result is None or result.upserted_id is None:
+            if not await self._reset_failed(sha256):
+                self.reused += 1
+                return False
+            self.retried += 1
+        self._queue.put_nowait((sha256, content_type))
+        return True
+
+    async def _reset_failed(self, sha256: str) -> bool:
+        """Move a failed render whose retry_after has passed back to pending"""
+        now = datetime.now(timezone.utc).isoformat()
+        result = await self.collection.update_one(
+            {'_id': sha256, 'status': STATUS_FAILED, '$or': [
+                {'retry_after': {'$exists': False}}, {'retry_after': {'$lte': now}},
+            ]},
+            {'$set': {'status': STATUS_PENDING}, '$unset': {'retry_after': '', 'error': ''}},
+        )
+        return result.modified_count == 1
+
+    async def get(self, sha256: str) -> Optional[dict]:
+        return await self.collection.find_one({'_id': sha256})
+
+    async def _claim(self, sha256: str) -> bool:
+        """Lease a pending job so other API processes resuming the same queue skip it"""
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_one(
+            {'_id': sha256, 'status': STATUS_PENDING, '$or': [
+                {'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now.isoformat()}},
+            ]},
+            {'$set': {'lease_until': (now + timedelta(seconds=self.pool.timeout * 3)).isoformat()}},
+        )
+        return result.modified_count == 1
+
+    async def _render(self, sha256: str, content_type: str) -> None:
+        update = {'status': STATUS_FAILED, 'rendered_at': datetime.now(timezone.utc).isoformat()}
+        try:
+            source = await self.blobs.read(sha256)
+            if source is None:
+                raise FileNotFoundError(f"blob {sha256} is missing")
+            variants = await self.pool.run(render_derivatives, source, content_type, self.sizes, self.formats)
+            stored = []
+            for variant in variants:
+                blob = await self.blobs.put(single_chunk(variant.pop('data')))
+                stored.append({**variant, 'sha256': blob.sha256, 'bytes': blob.size})
+            update.update(status=STATUS_READY, variants=stored)
+            self.rendered += 1
+        except UnsupportedLogo as e:
+            update.update(status=STATUS_UNSUPPORTED, error=str(e))
+        except Exception as e:
+            logger.warning(f"Derivatives for {sha256} failed: {e}")
+            update['error'] = str(e) or type(e).__name__
+            retry_after = datetime.now(timezone.utc) + timedelta(seconds=DERIVATIVE_RETRY_SECONDS)
+            update['retry_after'] = retry_after.isoformat()
+            self.failed += 1
+        await self.collection.update_one({'_id': sha256}, {'$set': update, '$unset': {'lease_until': ''}})
+
+    async def _work(self) -> None:
+        while True:
+            sha256, content_type = await self._queue.get()
+            try:
+                if await self._claim(sha256):
+                    await self._render(sha256, content_type)
+            except Exception as e:
+                logger.error(f"Derivative worker error for {sha256}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def resume(self) -> int:
+        """Re-queue work left pending by a previous process"""
+        resumed = 0
+        async for doc in self.collection.find({'status': STATUS_PENDING}, {'content_type': 1}):
+            self._queue.put_nowait((doc['_id'], doc['content_type']))
+            resumed += 1
+        return resumed
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.pool.pool_size)]
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'rendered': self.rendered,
+            'reused': self.reused,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
@@ -0,0 +1,40 @@
+"""
+In-process metrics helpers
+Small, dependency-free counters and latency windows that the subsystems in
+server.py expose through the admin metrics endpoint.
+"""
+from collections import deque
+from typing import Deque, Dict
+
+
+class LatencyStats:
+    """Rolling latency statistics for one operation (milliseconds)."""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        self._samples.append(elapsed_ms)
+
+    def percentile(self, pct: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50), 2),
+            'p99_ms': round(self.percentile(99), 2),
+            'max_ms': round(self.max_ms, 2),
+        }
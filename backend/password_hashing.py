@@ -0,0 +1,110 @@
+"""
+Password hashing off the event loop
+bcrypt is deliberately slow (~200 ms per call at cost 12), so hashing and
+verification run in a dedicated, bounded process pool that the auth
+endpoints await instead of blocking uvicorn.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import bcrypt
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Work factor for new hashes. Existing hashes with a different cost are
+# transparently rehashed on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_POOL_SIZE = int(os.environ.get('PASSWORD_POOL_SIZE', str(min(2, os.cpu_count() or 1))))
+PASSWORD_QUEUE_DEPTH = int(os.environ.get('PASSWORD_QUEUE_DEPTH', '64'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full and the call is rejected."""
+
+
+# Worker functions must be module level so they can be pickled into the pool.
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Return the cost factor encoded in a bcrypt hash ($2b$12$...)."""
+    parts = hashed.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    def __init__(self, pool_size: int = PASSWORD_POOL_SIZE,
+                 queue_depth: int = PASSWORD_QUEUE_DEPTH,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.pool_size = max(1, pool_size)
+        self.queue_depth = max(self.pool_size, queue_depth)
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._stats: Dict[str, LatencyStats] = {'hash': LatencyStats(), 'verify': LatencyStats()}
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn keeps the workers free of the parent's Mongo client threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            logger.info(f"Password hasher started (workers={self.pool_size}, rounds={self.rounds})")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, op: str, fn, *args):
+        if self._pending >= self.queue_depth:
+            self.rejected += 1
+            raise PasswordHasherBusy(f"{self._pending} password operations already queued")
+        self.start()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            self._stats[op].observe((time.perf_counter() - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run('hash', _hashpw, password.encode('utf-8'), self.rounds)
+        return hashed.decode('utf-8')
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run('verify', _checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.pool_size,
+            'rounds': self.rounds,
+            'queue_depth': self.queue_depth,
+            'pending': self._pending,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+            'hash': self._stats['hash'].snapshot(),
+            'verify': self._stats['verify'].snapshot(),
+        }
@@ -0,0 +1,343 @@
+"""
+Data retention
+Carts, abandoned payment transactions and processed webhook events carry a
+real Date (carts.updated_at, payment_transactions.expires_at,
+webhook_inbox.processed_at) and are removed by MongoDB's TTL monitor through
+the indexes registered in indexes.py. Uploaded logos and design assets
+cannot expire on age alone - a cart or order may still point at them - so
+RetentionSweeper periodically lists the logos and design assets that have
+been neither created nor used within LOGO_RETENTION_DAYS, looks up which of
+them carts, orders and quote requests still reference (indexed on the
+design's logo_asset/preview_asset/logo_id), and deletes the rest with their
+derivatives and blobs. Deletes are conditional on last_used_at, so anything
+used again mid-sweep is kept. A lease keeps the sweep to one API process.
+The background sweep only reports what would go (a dry run) until
+RETENTION_DRY_RUN=false is set, and its first run is one interval after
+startup, so a deploy never deletes anything before a report has been seen.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from design_assets import asset_hash_from_url
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+CART_RETENTION_DAYS = float(os.environ.get('CART_RETENTION_DAYS', '30'))
+PAYMENT_RETENTION_DAYS = float(os.environ.get('PAYMENT_RETENTION_DAYS', '7'))
+WEBHOOK_RETENTION_DAYS = float(os.environ.get('WEBHOOK_RETENTION_DAYS', '30'))
+LOGO_RETENTION_DAYS = float(os.environ.get('LOGO_RETENTION_DAYS', '30'))
+RETENTION_SWEEP_INTERVAL = float(os.environ.get('RETENTION_SWEEP_INTERVAL', str(6 * 60 * 60)))
+# Deleting is opt-in: the background sweep is a dry run unless RETENTION_DRY_RUN=false
+RETENTION_DRY_RUN = os.environ.get('RETENTION_DRY_RUN', 'true').lower() not in ('0', 'false', 'no')
+
+# Payment states that never turn into money; transactions in them expire
+EXPIRABLE_PAYMENT_STATES = ('pending', 'CREATED', 'ABORTED', 'EXPIRED', 'TERMINATED')
+
+REFERENCE_BATCH = 500       # candidate ids per reference lookup
+LOGO_ID_MIGRATION = 'design_logo_ids'   # marker _id in the migrations collection
+
+_LOGO_ID_RE = re.compile(r'/api/logos/([0-9a-f-]{36})')
+# Design fields that may point at an uploaded logo or a stored asset
+_DESIGN_REFERENCE_FIELDS = ('logo_asset', 'preview_asset', 'logo_url', 'logo_preview')
+
+
+def logo_id_from_url(url: Optional[str]) -> Optional[str]:
+    match = _LOGO_ID_RE.search(url) if url else None
+    return match.group(1) if match else None
+
+
+def _chunks(values: Set[str]) -> Iterator[List[str]]:
+    ordered = sorted(values)
+    for start in range(0, len(ordered), REFERENCE_BATCH):
+        yield ordered[start:start + REFERENCE_BATCH]
+
+
+def _designs(doc: dict) -> Iterator[dict]:
+    return (item['design'] for item in doc.get('items', []) if item.get('design'))
+
+
+def retention_seconds(days: float) -> int:
+    return int(days * DAY_SECONDS)
+
+
+def payment_expiry(now: Optional[datetime] = None) -> datetime:
+    """expires_at for a new transaction that has not been paid yet"""
+    return (now or datetime.now(timezone.utc)) + timedelta(days=PAYMENT_RETENTION_DAYS)
+
+
+def payment_state_update(state: str, fields: dict) -> dict:
+    """$set the new payment state; settled payments lose their expiry and are kept"""
+    update = {'$set': {'payment_status': state, **fields}}
+    if state not in EXPIRABLE_PAYMENT_STATES:
+        update['$unset'] = {'expires_at': ''}
+    return update
+
+
+def _iso_to_date(field: str) -> dict:
+    # Unparseable legacy values count as new, so they get a full retention window
+    return {'$dateFromString': {'dateString': f'${field}', 'onError': '$$NOW', 'onNull': '$$NOW'}}
+
+
+def design_references(designs: Iterable[dict]) -> Tuple[Set[str], Set[str]]:
+    """(asset hashes, logo ids) referenced by the given designs"""
+    hashes: Set[str] = set()
+    logo_ids: Set[str] = set()
+    for design in designs:
+        for key in _DESIGN_REFERENCE_FIELDS:
+            value = design.get(key)
+            if not isinstance(value, str) or value.startswith('data:'):
+                continue
+            if key.endswith('_asset'):
+                hashes.add(value)
+                continue
+            sha256 = asset_hash_from_url(value)
+            if sha256:
+                hashes.add(sha256)
+            logo_ids.update(_LOGO_ID_RE.findall(value))
+    return hashes, logo_ids
+
+
+class RetentionSweeper:
+    def __init__(self, db, blobs, interval: float = RETENTION_SWEEP_INTERVAL,
+                 retention_days: float = LOGO_RETENTION_DAYS, dry_run: bool = RETENTION_DRY_RUN):
+        self.db = db
+        self.blobs = blobs
+        self.interval = interval
+        self.retention_days = retention_days
+        self.dry_run = dry_run
+        self._token = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.skipped = 0
+        self.deleted_bytes = 0
+        self.last_report: Optional[dict] = None
+
+    async def migrate_dates(self) -> dict:
+        """Turn ISO-string dates written before TTL expiry into real Dates; idempotent"""
+        carts = await self.db.carts.update_many(
+            {'updated_at': {'$type': 'string'}},
+            [{'$set': {'updated_at': _iso_to_date('updated_at')}}],
+        )
+        webhooks = await self.db.webhook_inbox.update_many(
+            {'processed_at': {'$type': 'string'}},
+            [{'$set': {'processed_at': _iso_to_date('processed_at')}}],
+        )
+        payments = await self.db.payment_transactions.update_many(
+            {'payment_status': {'$in': list(EXPIRABLE_PAYMENT_STATES)}, 'expires_at': {'$exists': False}},
+            [{'$set': {'expires_at': {'$add': [
+                _iso_to_date('created_at'), retention_seconds(PAYMENT_RETENTION_DAYS) * 1000,
+            ]}}}],
+        )
+        return {
+            'carts': carts.modified_count,
+            'webhook_inbox': webhooks.modified_count,
+            'payment_transactions': payments.modified_count,
+        }
+
+    async def backfill_logo_ids(self) -> Optional[dict]:
+        """Set design.logo_id on legacy cart/order lines once per database; None if already done or running"""
+        # Scans every cart and order, so only the process that inserts the marker runs it
+        try:
+            await self.db.migrations.insert_one(
+                {'_id': LOGO_ID_MIGRATION, 'started_at': datetime.now(timezone.utc).isoformat()}
+            )
+        except DuplicateKeyError:
+            return None
+        try:
+            migrated = await self._backfill_logo_ids()
+        except BaseException:
+            # Let the next startup try again
+            await self.db.migrations.delete_one({'_id': LOGO_ID_MIGRATION})
+            raise
+        await self.db.migrations.update_one(
+            {'_id': LOGO_ID_MIGRATION},
+            {'$set': {'finished_at': datetime.now(timezone.utc).isoformat(), 'result': migrated}},
+        )
+        return migrated
+
+    async def _backfill_logo_ids(self) -> dict:
+        urls = {'$concat': [{'$ifNull': ['$$i.design.logo_url', '']}, ' ',
+                            {'$ifNull': ['$$i.design.logo_preview', '']}]}
+        logo_id = {'$let': {
+            'vars': {'m': {'$regexFind': {'input': urls, 'regex': _LOGO_ID_RE.pattern}}},
+            'in': {'$arrayElemAt': ['$$m.captures', 0]},
+        }}
+        items = {'$map': {'input': '$items', 'as': 'i', 'in': {'$cond': [
+            {'$eq': [{'$type': '$$i.design'}, 'object']},
+            {'$mergeObjects': ['$$i', {'design': {'$mergeObjects': ['$$i.design', {'logo_id': logo_id}]}}]},
+            '$$i',
+        ]}}}
+        legacy = {'items.design.logo_id': {'$exists': False}, '$or': [
+            {'items.design.logo_url': {'$regex': '/api/logos/'}},
+            {'items.design.logo_preview': {'$regex': '/api/logos/'}},
+        ]}
+        migrated = {}
+        for collection in (self.db.carts, self.db.orders):
+            result = await collection.update_many(legacy, [{'$set': {'items': items}}])
+            migrated[collection.name] = result.modified_count
+        return migrated
+
+    async def _references(self, hashes: Set[str], logo_ids: Set[str]) -> Tuple[Set[str], Set[str]]:
+        """The subset of the candidate hashes and logo ids still referenced anywhere"""
+        found_hashes: Set[str] = set()
+        found_logos: Set[str] = set()
+        for collection in (self.db.carts, self.db.orders):
+            # Indexed lookups for the candidates only (see indexes.py), never a scan of every cart/order
+            for chunk in _chunks(hashes):
+                query = {'$or': [{'items.design.logo_asset': {'$in': chunk}},
+                                 {'items.design.preview_asset': {'$in': chunk}}]}
+                projection = {'_id': 0, 'items.design.logo_asset': 1, 'items.design.preview_asset': 1}
+                async for doc in collection.find(query, projection):
+                    for design in _designs(doc):
+                        found_hashes.update(h for h in (design.get('logo_asset'), design.get('preview_asset'))
+                                            if h in hashes)
+            for chunk in _chunks(logo_ids):
+                async for doc in collection.find({'items.design.logo_id': {'$in': chunk}},
+                                                 {'_id': 0, 'items.design.logo_id': 1}):
+                    found_logos.update(d.get('logo_id') for d in _designs(doc) if d.get('logo_id') in logo_ids)
+        # Quote requests carry a single logo_url, which may point at an uploaded logo
+        async for quote in self.db.quotes.find({'logo_url': {'$regex': '/api/(logos|design-assets)/'}},
+                                               {'_id': 0, 'logo_url': 1}):
+            quoted_hashes, quoted_logos = design_references([quote])
+            found_hashes |= quoted_hashes & hashes
+            found_logos |= quoted_logos & logo_ids
+        return found_hashes, found_logos
+
+    async def _blob_in_use(self, sha256: str, logo_ids: Set[str], asset_ids: Set[str]) -> bool:
+        """True if a logo or asset that survives this sweep still stores these bytes"""
+        logo = await self.db.logos.find_one({'sha256': sha256, 'id': {'$nin': list(logo_ids)}}, {'_id': 1})
+        if logo is not None:
+            return True
+        if sha256 in asset_ids:
+            return False
+        return await self.db.design_assets.find_one({'_id': sha256}, {'_id': 1}) is not None
+
+    async def _delete_unused(self, collection, key: str, docs: List[dict], unused: dict) -> List[dict]:
+        # Conditional on last_used_at: a logo or asset used again since it was listed is kept
+        deleted = []
+        for doc in docs:
+            result = await collection.delete_one({key: doc[key], **unused})
+            if result.deleted_count:
+                deleted.append(doc)
+        return deleted
+
+    async def sweep(self, dry_run: Optional[bool] = None) -> dict:
+        """Delete unreferenced logos and design assets older than the retention window"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        started = time.perf_counter()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).isoformat()
+        unused = {'created_at': {'$lt': cutoff}, 'last_used_at': {'$not': {'$gte': cutoff}}}
+
+        logos = await self.db.logos.find(unused, {'_id': 0, 'id': 1, 'sha256': 1, 'size': 1}).to_list(None)
+        assets = await self.db.design_assets.find(unused, {'size': 1}).to_list(None)
+        hashes, referenced_logos = await self._references(
+            {logo['sha256'] for logo in logos if logo.get('sha256')} | {asset['_id'] for asset in assets},
+            {logo['id'] for logo in logos},
+        )
+        logos = [logo for logo in logos if logo['id'] not in referenced_logos and logo.get('sha256') not in hashes]
+        assets = [asset for asset in assets if asset['_id'] not in hashes]
+        if not dry_run:
+            # Documents first: a crash in between leaves stray blobs, never a logo without bytes
+            logos = await self._delete_unused(self.db.logos, 'id', logos, unused)
+            assets = await self._delete_unused(self.db.design_assets, '_id', assets, unused)
+
+        logo_ids = {logo['id'] for logo in logos}
+        asset_ids = {asset['_id'] for asset in assets}
+        candidates = {logo['sha256'] for logo in logos if logo.get('sha256')} | asset_ids
+        blobs = [sha256 for sha256 in candidates if not await self._blob_in_use(sha256, logo_ids, asset_ids)]
+
+        derivatives = await self.db.logo_derivatives.find(
+            {'_id': {'$in': blobs}}, {'variants.sha256': 1, 'variants.bytes': 1}
+        ).to_list(None)
+        variants = [v for d in derivatives for v in d.get('variants', [])]
+        sizes = {logo['sha256']: logo.get('size', 0) for logo in logos if logo.get('sha256')}
+        sizes.update({asset['_id']: asset.get('size', 0) for asset in assets})
+        freed = sum(sizes.get(sha256, 0) for sha256 in blobs) + sum(v.get('bytes', 0) for v in variants)
+
+        if not dry_run:
+            await asyncio.gather(
+                self.db.logo_derivatives.delete_many({'_id': {'$in': blobs}}),
+                self.db.logo_analysis.delete_many({'_id': {'$in': blobs}}),
+            )
+            for sha256 in [*blobs, *(v['sha256'] for v in variants)]:
+                await self.blobs.delete(sha256)
+            self.deleted_bytes += freed
+
+        report = {
+            'dry_run': dry_run,
+            'cutoff': cutoff,
+            'referenced_assets': len(hashes),
+            'referenced_logos': len(referenced_logos),
+            'logos': len(logos),
+            'design_assets': len(assets),
+            'blobs': len(blobs),
+            'derivative_blobs': len(variants),
+            'bytes': freed,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        self.sweeps += 1
+        self.last_report = report
+        logger.info(f"Retention sweep{' (dry run)' if dry_run else ''}: {report['logos']} logos, "
+                    f"{report['design_assets']} assets, {report['blobs'] + report['derivative_blobs']} blobs, "
+                    f"{freed} bytes")
+        return report
+
+    async def _acquire(self) -> bool:
+        """Take the sweep lease for one interval; False if another process holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.retention.find_one_and_update(
+                {'_id': 'sweeper', '$or': [
+                    {'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now.isoformat()}},
+                ]},
+                {'$set': {'lease_until': (now + timedelta(seconds=self.interval * 0.9)).isoformat(),
+                          'holder': self._token}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            # First sweep one interval after startup, never during a deploy
+            await asyncio.sleep(self.interval)
+            try:
+                if await self._acquire():
+                    await self.sweep()
+                else:
+                    self.skipped += 1
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'dry_run': self.dry_run,
+            'retention_days': self.retention_days,
+            'sweeps': self.sweeps,
+            'skipped': self.skipped,
+            'deleted_bytes': self.deleted_bytes,
+            'last': self.last_report,
+        }
@@ -0,0 +1,205 @@
+"""
+Employee roster import
+Business customers upload a CSV or XLSX list of employees (product, colour,
+size, name, optional quantity). Rows are read one at a time from the spooled
+upload, validated against the catalog snapshot and folded into one aggregate
+per product/colour/size (personalised or not). Memory therefore grows with
+the number of distinct cart lines plus one short name entry per row, which
+ROSTER_MAX_ROWS and MAX_NAME_LENGTH bound, never with the raw file. Bad rows are collected in a
+capped error report instead of failing the import.
+"""
+import codecs
+import csv
+import io
+import itertools
+import os
+from dataclasses import dataclass, field
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+ROSTER_MAX_BYTES = int(os.environ.get('ROSTER_MAX_BYTES', str(5 * 1024 * 1024)))
+ROSTER_MAX_ROWS = int(os.environ.get('ROSTER_MAX_ROWS', '20000'))
+ROSTER_MAX_ERRORS = 200      # errors beyond this are only counted
+MAX_NAME_LENGTH = 30
+MAX_ROW_QUANTITY = 1000
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+# Accepted header names per field, Norwegian first
+COLUMN_ALIASES = {
+    'product': ('produkt', 'plagg', 'artikkel', 'product', 'garment'),
+    'color': ('farge', 'color', 'colour'),
+    'size': ('størrelse', 'storrelse', 'str', 'size'),
+    'name': ('navn', 'name'),
+    'quantity': ('antall', 'quantity', 'qty'),
+}
+REQUIRED_COLUMNS = ('product', 'color', 'size')
+
+
+class RosterError(ValueError):
+    """The file as a whole cannot be imported (message is shown to the customer)"""
+
+
+@dataclass
+class RosterLine:
+    product_id: str
+    variant_color: str
+    size: str
+    personalized: bool
+    quantity: int = 0
+    personalization: List[dict] = field(default_factory=list)  # one {name, quantity} per roster row
+
+
+def _detect_encoding(fileobj: IO[bytes]) -> str:
+    """UTF-8 unless the start of the file says otherwise (Excel on Windows writes cp1252)"""
+    sample = fileobj.read(ENCODING_SAMPLE_BYTES)
+    fileobj.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def iter_csv_rows(fileobj: IO[bytes]) -> Iterator[List[str]]:
+    text = io.TextIOWrapper(fileobj, encoding=_detect_encoding(fileobj), newline='')
+    try:
+        first = text.readline()
+        # Norwegian Excel exports separate with semicolons
+        delimiter = ';' if first.count(';') > first.count(',') else ','
+        yield from csv.reader(itertools.chain([first], text), delimiter=delimiter)
+    except UnicodeDecodeError:
+        raise RosterError("Filen har ukjent tegnkoding. Lagre den som CSV (UTF-8).")
+    except csv.Error as e:
+        raise RosterError(f"Kunne ikke lese CSV-filen: {e}")
+    finally:
+        text.detach()  # leave the upload open for its owner
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # numeric sizes such as 38
+    return str(value)
+
+
+def iter_xlsx_rows(fileobj: IO[bytes]) -> Iterator[List[str]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RosterError("Import av Excel-filer er ikke tilgjengelig. Lagre filen som CSV.")
+    try:
+        # read_only streams rows from the sheet XML instead of building the whole workbook
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        raise RosterError("Kunne ikke lese Excel-filen")
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield [_cell(v) for v in row]
+    finally:
+        workbook.close()
+
+
+def roster_kind(filename: Optional[str], content_type: Optional[str]) -> str:
+    name = (filename or '').lower()
+    if name.endswith('.xlsx') or content_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
+        return 'xlsx'
+    if name.endswith('.csv') or content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    raise RosterError("Ugyldig filtype. Bruk CSV eller XLSX.")
+
+
+def _columns(header: List[str]) -> Dict[str, int]:
+    normalised = [h.strip().lower() for h in header]
+    columns = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        for index, title in enumerate(normalised):
+            if title in aliases:
+                columns[key] = index
+                break
+    missing = [COLUMN_ALIASES[key][0] for key in REQUIRED_COLUMNS if key not in columns]
+    if missing:
+        raise RosterError(f"Mangler kolonne{'r' if len(missing) > 1 else ''}: {', '.join(missing)}")
+    return columns
+
+
+class RosterImport:
+    def __init__(self, snapshot, max_rows: int = ROSTER_MAX_ROWS):
+        self.snapshot = snapshot
+        self.max_rows = max_rows
+        self.lines: Dict[Tuple[str, str, str, bool], RosterLine] = {}
+        self.rows = 0
+        self.imported_rows = 0
+        self.errors: List[dict] = []
+        self.error_count = 0
+        self._by_name: Optional[Dict[str, dict]] = None
+
+    def _error(self, row_number: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < ROSTER_MAX_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def _product(self, reference: str) -> Optional[dict]:
+        product = self.snapshot.get_by_slug(reference) or self.snapshot.get_by_id(reference)
+        if product is None:
+            if self._by_name is None:
+                self._by_name = {p['name'].strip().lower(): p for p in self.snapshot.products}
+            product = self._by_name.get(reference.lower())
+        return product
+
+    def add(self, row_number: int, product_ref: str, color: str, size: str, name: str, quantity: str) -> None:
+        if not product_ref:
+            return self._error(row_number, "Produkt mangler")
+        product = self._product(product_ref)
+        if product is None:
+            return self._error(row_number, f"Fant ikke produktet «{product_ref}»")
+        variant = next((v for v in product.get('variants', []) if v['color'].lower() == color.lower()), None)
+        if variant is None:
+            return self._error(row_number, f"Fargen «{color}» finnes ikke for {product['name']}")
+        canonical_size = next((s for s in variant['sizes'] if s.lower() == size.lower()), None)
+        if canonical_size is None:
+            return self._error(row_number, f"Størrelse «{size}» finnes ikke i fargen {variant['color']}")
+        try:
+            count = int(quantity) if quantity else 1
+        except ValueError:
+            return self._error(row_number, f"Ugyldig antall «{quantity}»")
+        if not 1 <= count <= MAX_ROW_QUANTITY:
+            return self._error(row_number, f"Antall må være mellom 1 og {MAX_ROW_QUANTITY}")
+        if len(name) > MAX_NAME_LENGTH:
+            return self._error(row_number, f"Navnet er for langt (maks {MAX_NAME_LENGTH} tegn)")
+
+        key = (product['id'], variant['color'], canonical_size, bool(name))
+        line = self.lines.get(key)
+        if line is None:
+            line = self.lines[key] = RosterLine(*key)
+        line.quantity += count
+        if name:
+            line.personalization.append({'name': name, 'quantity': count})
+        self.imported_rows += 1
+
+    def read(self, fileobj: IO[bytes], kind: str) -> 'RosterImport':
+        """Consume the whole file; blocking, so run it in an executor"""
+        source = iter_xlsx_rows(fileobj) if kind == 'xlsx' else iter_csv_rows(fileobj)
+        try:
+            self._consume(enumerate(source, start=1))
+        finally:
+            source.close()  # release the reader while the upload is still open
+        return self
+
+    def _consume(self, rows: Iterator[Tuple[int, List[str]]]) -> None:
+        header = next((r for _, r in rows if any(c.strip() for c in r)), None)
+        if header is None:
+            raise RosterError("Filen er tom")
+        columns = _columns(header)
+
+        def value(row: List[str], key: str) -> str:
+            index = columns.get(key)
+            return row[index].strip() if index is not None and index < len(row) else ''
+
+        for row_number, row in rows:
+            if not any(c.strip() for c in row):
+                continue
+            self.rows += 1
+            if self.rows > self.max_rows:
+                raise RosterError(f"Filen har for mange rader (maks {self.max_rows})")
+            self.add(row_number, value(row, 'product'), value(row, 'color'), value(row, 'size'),
+                     value(row, 'name'), value(row, 'quantity'))
@@ -0,0 +1,242 @@
+"""
+Full-text product search
+Inverted index over the catalog snapshot with Norwegian-aware tokenization
+(æ/ø/å kept as letters and transliterated to ae/oe/aa so "klaer" finds
+"klær"), light Norwegian suffix stemming, prefix matching and BM25 ranking
+with per-field weights. User input is never treated as a pattern.
+"""
+import bisect
+import functools
+import html
+import math
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+SEARCH_LATENCY_BUDGET_MS = float(os.environ.get('SEARCH_LATENCY_BUDGET_MS', '25'))
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_TERMS = 8
+
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'brand': 2.0,
+    'colors': 1.5,
+    'best_for': 1.5,
+    'materials': 1.0,
+    'description': 1.0,
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+PREFIX_WEIGHT = 0.6
+MIN_PREFIX_LENGTH = 2
+SNIPPET_CHARS = 160
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_TRANSLIT = str.maketrans({'æ': 'ae', 'ø': 'oe', 'å': 'aa', 'ä': 'ae', 'ö': 'oe'})
+
+# Norwegian inflectional suffixes (transliterated), longest match wins
+_SUFFIXES = sorted([
+    'hetenes', 'hetene', 'hetens', 'heten', 'heter', 'endes', 'edes', 'ende', 'ande',
+    'erne', 'enes', 'ere', 'ene', 'ane', 'ens', 'ers', 'ets', 'het', 'ast', 'en', 'ar',
+    'er', 'as', 'es', 'et', 'a', 'e',
+], key=len, reverse=True)
+_MIN_STEM = 3
+
+
+@functools.lru_cache(maxsize=65536)
+def fold(word: str) -> str:
+    """Casefold, transliterate æ/ø/å and strip remaining diacritics"""
+    word = unicodedata.normalize('NFKC', word).casefold().translate(_TRANSLIT)
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Light Norwegian stemmer for folded words (genser/gensere/genserne -> gens)"""
+    if word.isdigit():
+        return word
+    if word.endswith('ert') and len(word) - 1 >= _MIN_STEM:
+        return word[:-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            word = word[:-len(suffix)]
+            break
+    else:
+        if word.endswith('s') and not word.endswith('ss') and len(word) - 1 >= _MIN_STEM:
+            word = word[:-1]
+    if word.endswith(('dt', 'vt')) and len(word) - 1 >= _MIN_STEM:
+        word = word[:-1]
+    return word
+
+
+def term_for(word: str) -> str:
+    """Index term for a raw word (folded and stemmed)"""
+    return stem(fold(word))
+
+
+def tokenize(text: str) -> List[str]:
+    return [fold(m.group()) for m in _WORD_RE.finditer(text or '')]
+
+
+def analyze(text: str) -> List[str]:
+    return [stem(word) for word in tokenize(text)]
+
+
+def product_fields(product: dict) -> Dict[str, str]:
+    return {
+        'name': product.get('name', ''),
+        'brand': product.get('brand') or '',
+        'colors': ' '.join(v.get('color', '') for v in product.get('variants', [])),
+        'best_for': ' '.join(product.get('best_for', [])),
+        'materials': ' '.join(product.get('materials', [])),
+        'description': product.get('description', ''),
+    }
+
+
+class SearchHit:
+    __slots__ = ('pos', 'score', 'terms')
+
+    def __init__(self, pos: int, score: float, terms: Set[str]):
+        self.pos = pos
+        self.score = score
+        self.terms = terms
+
+
+class SearchIndex:
+    def __init__(self, products: List[dict]):
+        self.products = products
+        # term -> {position: BM25 contribution}, precomputed per snapshot
+        self.postings: Dict[str, Dict[int, float]] = {}
+        doc_lengths: List[float] = []
+        surface: Dict[str, str] = {}
+
+        for pos, product in enumerate(products):
+            length = 0.0
+            for field, text in product_fields(product).items():
+                weight = FIELD_WEIGHTS[field]
+                for word in tokenize(text):
+                    term = stem(word)
+                    surface[word] = term
+                    bucket = self.postings.setdefault(term, {})
+                    bucket[pos] = bucket.get(pos, 0.0) + weight
+                    length += weight
+            doc_lengths.append(length)
+
+        n = len(products)
+        avg_length = (sum(doc_lengths) / n) if n else 0.0
+        for term, docs in self.postings.items():
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for pos, tf in docs.items():
+                norm = 1 - B + B * (doc_lengths[pos] / avg_length if avg_length else 1)
+                docs[pos] = idf * tf * (K1 + 1) / (tf + K1 * norm)
+
+        # Sorted surface vocabulary for prefix lookups
+        self._words = sorted(surface)
+        self._word_terms = [surface[w] for w in self._words]
+
+    def _prefix_terms(self, prefix: str) -> Set[str]:
+        lo = bisect.bisect_left(self._words, prefix)
+        hi = bisect.bisect_left(self._words, prefix + '\uffff')
+        return set(self._word_terms[lo:hi])
+
+    def search(self, query: str, allowed: Optional[Iterable[int]] = None) -> List[SearchHit]:
+        """Ranked hits where every query word matches (exactly or as a prefix)"""
+        words = tokenize(query[:MAX_QUERY_LENGTH])[:MAX_QUERY_TERMS]
+        # Rarest words first keeps the candidate set small
+        words.sort(key=lambda w: len(self.postings.get(stem(w), ())))
+        if not words:
+            return []
+        allowed_set = None if allowed is None else set(allowed)
+
+        scores: Optional[Dict[int, float]] = None
+        matched: Dict[int, Set[str]] = {}
+        for word in words:
+            exact = stem(word)
+            candidates: Dict[str, float] = {}
+            if exact in self.postings:
+                candidates[exact] = 1.0
+            if len(word) >= MIN_PREFIX_LENGTH:
+                for term in self._prefix_terms(word):
+                    candidates.setdefault(term, PREFIX_WEIGHT)
+
+            word_scores: Dict[int, float] = {}
+            word_terms: Dict[int, Set[str]] = {}
+            for term, weight in candidates.items():
+                postings = self.postings[term]
+                if scores is not None and len(scores) < len(postings):
+                    # Later words only need to probe the surviving candidates
+                    entries = [(pos, postings[pos]) for pos in scores if pos in postings]
+                else:
+                    entries = postings.items()
+                for pos, bm25 in entries:
+                    if allowed_set is not None and pos not in allowed_set:
+                        continue
+                    if scores is not None and pos not in scores:
+                        continue
+                    score = weight * bm25
+                    if score > word_scores.get(pos, 0.0):
+                        word_scores[pos] = score
+                    word_terms.setdefault(pos, set()).add(term)
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {pos: scores[pos] + s for pos, s in word_scores.items()}
+            for pos, terms in word_terms.items():
+                matched.setdefault(pos, set()).update(terms)
+            if not scores:
+                return []
+
+        hits = [SearchHit(pos, score, matched[pos]) for pos, score in scores.items()]
+        # Highest score first, catalog order breaks ties
+        hits.sort(key=lambda h: (-h.score, h.pos))
+        return hits
+
+    def highlight(self, hit: SearchHit) -> Dict[str, str]:
+        """HTML-escaped name and description snippet with <mark> around matched words"""
+        product = self.products[hit.pos]
+        return {
+            'name': _mark(product.get('name', ''), hit),
+            'description': _mark(_snippet(product.get('description', ''), hit), hit),
+        }
+
+
+def _word_matches(word: str, hit: SearchHit) -> bool:
+    return term_for(word) in hit.terms
+
+
+def _mark(text: str, hit: SearchHit) -> str:
+    out: List[str] = []
+    last = 0
+    for m in _WORD_RE.finditer(text):
+        if _word_matches(m.group(), hit):
+            out.append(html.escape(text[last:m.start()]))
+            out.append(f"<mark>{html.escape(m.group())}</mark>")
+            last = m.end()
+    out.append(html.escape(text[last:]))
+    return ''.join(out)
+
+
+def _snippet(text: str, hit: SearchHit) -> str:
+    if len(text) <= SNIPPET_CHARS:
+        return text
+    start = 0
+    for m in _WORD_RE.finditer(text):
+        if _word_matches(m.group(), hit):
+            start = max(0, m.start() - SNIPPET_CHARS // 4)
+            break
+    # Snap to word boundaries
+    if start > 0:
+        space = text.rfind(' ', 0, start)
+        start = space + 1 if space != -1 else start
+    end = start + SNIPPET_CHARS
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(text) else ''
+    return f"{prefix}{text[start:end].strip()}{suffix}"
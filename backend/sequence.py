@@ -0,0 +1,92 @@
+"""
+Order number sequence
+Monthly counters in the `counters` collection are advanced with a single
+atomic findOneAndUpdate($inc). Each API process reserves a block of
+ORDER_SEQUENCE_BLOCK numbers at a time and hands them out locally, so most
+checkouts never touch the counter. Numbers left in a block when a process
+stops are skipped (gaps are fine, duplicates are not - the unique
+orders.order_number index is the backstop).
+"""
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ORDER_SEQUENCE_BLOCK = int(os.environ.get('ORDER_SEQUENCE_BLOCK', '20'))
+ORDER_NUMBER_DIGITS = 4
+
+
+@dataclass
+class _Block:
+    next: int
+    end: int  # inclusive
+
+
+class OrderSequence:
+    def __init__(self, db, block_size: int = ORDER_SEQUENCE_BLOCK, name: str = 'orders'):
+        self.counters = db.counters
+        self.orders = db.orders
+        self.block_size = max(1, block_size)
+        self.name = name
+        self._blocks: Dict[str, _Block] = {}
+        self._seeded = set()
+        self._lock = asyncio.Lock()
+        self.issued = 0
+        self.blocks_reserved = 0
+
+    def _key(self, prefix: str) -> str:
+        return f"{self.name}:{prefix}"
+
+    async def _seed(self, prefix: str) -> None:
+        """Start a month's counter above any number issued by the old count_documents() scheme"""
+        highest = 0
+        pattern = re.compile(f"^{re.escape(prefix)}\\d+$")
+        async for order in self.orders.find({'order_number': pattern}, {'_id': 0, 'order_number': 1}):
+            highest = max(highest, int(order['order_number'][len(prefix):]))
+        try:
+            await self.counters.update_one({'_id': self._key(prefix)}, {'$max': {'value': highest}}, upsert=True)
+        except DuplicateKeyError:
+            # Another process created the counter first; apply $max to the existing document
+            await self.counters.update_one({'_id': self._key(prefix)}, {'$max': {'value': highest}})
+        self._seeded.add(prefix)
+
+    async def _reserve(self, prefix: str) -> _Block:
+        if prefix not in self._seeded:
+            await self._seed(prefix)
+        counter = await self.counters.find_one_and_update(
+            {'_id': self._key(prefix)},
+            {'$inc': {'value': self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.blocks_reserved += 1
+        return _Block(next=counter['value'] - self.block_size + 1, end=counter['value'])
+
+    async def next_value(self, prefix: str) -> int:
+        async with self._lock:
+            block = self._blocks.get(prefix)
+            if block is None or block.next > block.end:
+                # Blocks for previous months are dropped when a new prefix shows up
+                self._blocks = {prefix: await self._reserve(prefix)}
+                block = self._blocks[prefix]
+            value = block.next
+            block.next += 1
+            self.issued += 1
+            return value
+
+    async def next_number(self, prefix: str) -> str:
+        return f"{prefix}{await self.next_value(prefix):0{ORDER_NUMBER_DIGITS}d}"
+
+    def stats(self) -> dict:
+        return {
+            'block_size': self.block_size,
+            'issued': self.issued,
+            'blocks_reserved': self.blocks_reserved,
+        }
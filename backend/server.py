@@ -1,25 +1,60 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import os
+import json
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 import jwt
-import bcrypt
+import orjson
 import base64
 
+from password_hashing import PasswordHasher, PasswordHasherBusy
+from ttl_cache import TTLCache
+from catalog import CatalogEngine
+from metrics import LatencyStats
+from search_index import SEARCH_LATENCY_BUDGET_MS, MAX_QUERY_LENGTH
+from indexes import apply_indexes, audit_queries
+from http_cache import (
+    CACHE_POLICIES, RangeNotSatisfiable, conditional, etag_matches, if_range_allows, make_etag, parse_range,
+    query_token, raw_json,
+)
+from cart_updates import cart_line_id, upsert_lines_pipeline, remove_line_pipeline
+from design_assets import DesignAssetStore, InvalidAsset, is_asset_hash
+from blob_store import BlobTooLarge, create_blob_store, single_chunk
+from image_pool import ImageWorkerPool
+from logo_derivatives import (
+    FORMAT_CONTENT_TYPES, STATUS_FAILED, STATUS_PENDING, STATUS_READY, LogoDerivatives, best_variant,
+)
+from logo_analysis import LogoAnalyzer, design_warnings, estimate_stitches
+from sequence import OrderSequence
+from vipps import VippsClient, create_token_store
+from roster_import import ROSTER_MAX_BYTES, RosterError, RosterImport, roster_kind
+from upload_stream import MULTIPART_OVERHEAD_BYTES, MultipartStream, UploadError, UploadTooLarge, spool
+from stripe_gateway import StripeGateway, create_stripe_gateway
+from webhook_inbox import WebhookInbox
+from order_pipeline import CheckoutStats, OrderWriter
+from checkout_status import CheckoutStatusCache
+from retention import RetentionSweeper, logo_id_from_url, payment_expiry, payment_state_update
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: TTL dates (carts.updated_at etc.) come back as aware datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -27,6 +62,23 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'firmaprint-secret-key-2024')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
+# Authenticated user cache (per worker)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+USER_CACHE_NEGATIVE_TTL = float(os.environ.get('USER_CACHE_NEGATIVE_TTL', '10'))
+
+# Session cart cache (per worker); short TTLs because another worker may write the same cart
+CART_CACHE_SIZE = int(os.environ.get('CART_CACHE_SIZE', '5000'))
+CART_CACHE_TTL = float(os.environ.get('CART_CACHE_TTL', '5'))
+CART_CACHE_NEGATIVE_TTL = float(os.environ.get('CART_CACHE_NEGATIVE_TTL', '2'))
+CART_CACHE_MAX_BYTES = int(os.environ.get('CART_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# How long adding to the cart waits for a new logo's analysis before keeping the client's values
+DESIGN_ANALYSIS_WAIT = float(os.environ.get('DESIGN_ANALYSIS_WAIT', '2'))
+# Stripe status polls: unsettled answers are reused this long, paid/expired ones longer
+CHECKOUT_STATUS_TTL = float(os.environ.get('CHECKOUT_STATUS_TTL', '3'))
+CHECKOUT_STATUS_FINAL_TTL = float(os.environ.get('CHECKOUT_STATUS_FINAL_TTL', '300'))
+CHECKOUT_STATUS_CACHE_SIZE = int(os.environ.get('CHECKOUT_STATUS_CACHE_SIZE', '2000'))
+
 # Create the main app
 app = FastAPI(title="Firmaprint.no API", version="1.0.0")
 
@@ -106,6 +158,21 @@ class Product(BaseModel):
     active: bool = True
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+class ProductPage(BaseModel):
+    items: List[Product]
+    next_cursor: Optional[str] = None
+
+class SearchResult(BaseModel):
+    product: Product
+    score: float
+    highlights: Dict[str, str]
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    took_ms: float
+    results: List[SearchResult]
+
 class ProductCreate(BaseModel):
     name: str
     slug: str
@@ -127,6 +194,9 @@ class ProductCreate(BaseModel):
 class DesignObject(BaseModel):
     logo_url: str
     logo_preview: str
+    logo_asset: Optional[str] = None  # sha256 in design_assets when logo_url is a stored asset
+    logo_id: Optional[str] = None  # logos.id when the design links to an uploaded logo (/api/logos/...)
+    preview_asset: Optional[str] = None
     position_x: float
     position_y: float
     scale: float
@@ -139,8 +209,14 @@ class DesignObject(BaseModel):
     colors: List[str] = []
     complexity: str = "normal"  # simple, normal, detailed
     warnings: List[str] = []
+    stitch_estimate: Optional[int] = None  # embroidery only
+
+class Personalization(BaseModel):
+    name: str
+    quantity: int = 1
 
 class CartItem(BaseModel):
+    line_id: str = ""
     product_id: str
     product_name: str
     variant_color: str
@@ -149,6 +225,7 @@ class CartItem(BaseModel):
     base_price: float
     design: Optional[DesignObject] = None
     design_price: float = 0
+    personalization: List[Personalization] = []  # names printed per garment (roster import)
     total_price: float
 
 class Cart(BaseModel):
@@ -160,7 +237,7 @@ class Cart(BaseModel):
     design_total: float = 0
     shipping: float = 0
     total: float = 0
-    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class AddToCartRequest(BaseModel):
     product_id: str
@@ -169,6 +246,16 @@ class AddToCartRequest(BaseModel):
     quantity: int
     design: Optional[DesignObject] = None
 
+class SizeMatrixRow(BaseModel):
+    variant_color: str
+    quantities: Dict[str, int]  # size -> quantity; zeros are skipped
+
+class AddSizeMatrixRequest(BaseModel):
+    """One product and design in several sizes (and colours) in a single cart update"""
+    product_id: str
+    rows: List[SizeMatrixRow]
+    design: Optional[DesignObject] = None
+
 # Order Models
 class ShippingAddress(BaseModel):
     name: str
@@ -248,11 +335,28 @@ class ContactMessageCreate(BaseModel):
 
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+password_hasher = PasswordHasher()
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Serveren er opptatt, prøv igjen om litt", headers={'Retry-After': '1'})
+
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Serveren er opptatt, prøv igjen om litt", headers={'Retry-After': '1'})
+
+async def rehash_password(user_id: str, password: str):
+    """Upgrade a stored hash to the current work factor after a successful login"""
+    try:
+        new_hash = await password_hasher.hash(password)
+        await update_user(user_id, {'password_hash': new_hash})
+        password_hasher.rehashed += 1
+    except Exception as e:
+        logger.warning(f"Password rehash failed for {user_id}: {e}")
 
 def create_token(user_id: str) -> str:
     payload = {
@@ -262,13 +366,34 @@ def create_token(user_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, negative_ttl=USER_CACHE_NEGATIVE_TTL)
+
+async def load_user(user_id: str) -> Optional[dict]:
+    """Fetch a user by id through the per-worker cache (unknown ids are cached too)"""
+    found, user = user_cache.get(user_id)
+    if not found:
+        user = await db.users.find_one({'id': user_id}, {'_id': 0, 'password_hash': 0})
+        if user:
+            user_cache.set(user_id, user)
+        else:
+            user_cache.set_missing(user_id)
+    return dict(user) if user else None
+
+def invalidate_user(user_id: str):
+    """Drop a cached user - call after every write to a user document"""
+    user_cache.invalidate(user_id)
+
+async def update_user(user_id: str, fields: Dict[str, Any]):
+    result = await db.users.update_one({'id': user_id}, {'$set': fields})
+    invalidate_user(user_id)
+    return result
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if not credentials:
         return None
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0})
-        return user
+        return await load_user(payload['user_id'])
     except:
         return None
 
@@ -283,6 +408,7 @@ async def require_user(credentials: HTTPAuthorizationCredentials = Depends(secur
 PRINT_PRICE_SMALL = 59.0  # Små trykk (bryst, erme)
 PRINT_PRICE_LARGE = 79.0  # Store trykk (rygg)
 EMBROIDERY_PRICE = 89.0   # Brodering
+PERSONALIZATION_PRICE = float(os.environ.get('PERSONALIZATION_PRICE', '49'))  # Navnetrykk per plagg
 SHIPPING_COST = 99.0      # Frakt
 FREE_SHIPPING_THRESHOLD = 2000.0  # Gratis frakt over dette beløpet
 
@@ -323,7 +449,7 @@ async def register(user_data: UserCreate):
     user = {
         'id': user_id,
         'email': user_data.email,
-        'password_hash': hash_password(user_data.password),
+        'password_hash': await hash_password(user_data.password),
         'name': user_data.name,
         'company_name': user_data.company_name,
         'org_number': user_data.org_number,
@@ -333,6 +459,7 @@ async def register(user_data: UserCreate):
     }
     
     await db.users.insert_one(user)
+    invalidate_user(user_id)
     
     token = create_token(user_id)
     user_response = UserResponse(
@@ -349,11 +476,15 @@ async def register(user_data: UserCreate):
     return TokenResponse(access_token=token, user=user_response)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, background_tasks: BackgroundTasks):
     user = await db.users.find_one({'email': credentials.email}, {'_id': 0})
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not user or not await verify_password(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Ugyldig e-post eller passord")
     
+    # Work factor changed since this hash was created - upgrade after responding
+    if password_hasher.needs_rehash(user['password_hash']):
+        background_tasks.add_task(rehash_password, user['id'], credentials.password)
+    
     token = create_token(user['id'])
     user_response = UserResponse(
         id=user['id'],
@@ -383,8 +514,18 @@ async def get_me(user = Depends(require_user)):
 
 # ==================== PRODUCT ENDPOINTS ====================
 
-@api_router.get("/products", response_model=List[Product])
+def product_json(product: dict) -> bytes:
+    """Canonical JSON for one product, validated through the response model once per catalog version"""
+    return Product.model_validate(product).model_dump_json().encode('utf-8')
+
+# In-memory product catalog, refreshed from the catalog version counter
+catalog = CatalogEngine(db, serializer=product_json)
+MAX_PRODUCT_LIMIT = 1000  # products per listing response
+
+@api_router.get("/products", response_model=Union[List[Product], ProductPage])
 async def get_products(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     brand: Optional[str] = None,
     print_method: Optional[str] = None,
@@ -392,76 +533,241 @@ async def get_products(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     search: Optional[str] = None,
-    limit: int = 50,
-    skip: int = 0
+    limit: int = Query(50, ge=1, le=MAX_PRODUCT_LIMIT),
+    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = None
 ):
-    query = {'active': True}
-    
-    if category:
-        query['category'] = category
-    if brand:
-        query['brand'] = brand
-    if print_method:
-        query['print_methods'] = {'$in': [print_method]}
-    if featured is not None:
-        query['featured'] = featured
-    if min_price is not None:
-        query['base_price'] = {'$gte': min_price}
-    if max_price is not None:
-        query.setdefault('base_price', {})['$lte'] = max_price
+    """List products. Pass cursor (empty for the first page) to get {items, next_cursor} pages in listing order
+    (featured first, then price); skip/limit keeps returning a plain list in database order"""
+    snapshot = await catalog.get()
+    not_modified = conditional(request, response, make_etag('products', snapshot.fingerprint, query_token(request)), 'products')
+    if not_modified:
+        return not_modified
+    filters = dict(
+        category=category,
+        brand=brand,
+        print_method=print_method,
+        featured=featured,
+        min_price=min_price,
+        max_price=max_price,
+    )
+    if cursor is not None:
+        return raw_json(product_page_json(snapshot, cursor, limit, search=search, **filters), response)
+    positions = snapshot.query_positions(search=search, skip=skip, limit=limit, load_order=True, **filters)
+    return raw_json(snapshot.list_json(positions), response)
+
+def product_page_json(snapshot, cursor: str, limit: int, search: Optional[str] = None, **filters) -> bytes:
     if search:
-        query['$or'] = [
-            {'name': {'$regex': search, '$options': 'i'}},
-            {'description': {'$regex': search, '$options': 'i'}}
-        ]
+        raise HTTPException(status_code=400, detail="cursor kan ikke kombineres med søk")
+    try:
+        positions, next_cursor = snapshot.page_positions(cursor, limit=limit, **filters)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig cursor")
+    return b'{"items":' + snapshot.list_json(positions) + b',"next_cursor":' + orjson.dumps(next_cursor) + b'}'
+
+search_latency = LatencyStats()
+
+@api_router.get("/products/search", response_model=SearchResponse)
+async def search_products(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_QUERY_LENGTH),
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    print_method: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    limit: int = 20,
+    skip: int = 0
+):
+    """Ranked full-text search with highlighted snippets"""
+    snapshot = await catalog.get()
+    started = time.perf_counter()
+    hits = snapshot.search(
+        q,
+        category=category,
+        brand=brand,
+        print_method=print_method,
+        min_price=min_price,
+        max_price=max_price,
+    )
+    results = [
+        b'{"product":' + snapshot.product_json(hit.pos)
+        + b',"score":' + orjson.dumps(round(hit.score, 4))
+        + b',"highlights":' + orjson.dumps(snapshot.search_index.highlight(hit)) + b'}'
+        for hit in hits[skip:skip + limit]
+    ]
+    took_ms = (time.perf_counter() - started) * 1000
+    search_latency.observe(took_ms)
+    if took_ms > SEARCH_LATENCY_BUDGET_MS:
+        logger.warning(f"Search for {q!r} took {took_ms:.1f} ms (budget {SEARCH_LATENCY_BUDGET_MS} ms)")
     
-    products = await db.products.find(query, {'_id': 0}).skip(skip).limit(limit).to_list(limit)
-    return products
+    head = orjson.dumps({'query': q, 'total': len(hits), 'took_ms': round(took_ms, 2)})
+    return raw_json(head[:-1] + b',"results":[' + b','.join(results) + b']}', response)
 
 @api_router.get("/products/{slug}", response_model=Product)
-async def get_product(slug: str):
-    product = await db.products.find_one({'slug': slug, 'active': True}, {'_id': 0})
-    if not product:
+async def get_product(slug: str, request: Request, response: Response):
+    snapshot = await catalog.get()
+    pos = snapshot.by_slug.get(slug)
+    if pos is None:
         raise HTTPException(status_code=404, detail="Produkt ikke funnet")
-    return product
+    not_modified = conditional(request, response, make_etag('product', snapshot.fingerprint, slug), 'product')
+    if not_modified:
+        return not_modified
+    return raw_json(snapshot.product_json(pos), response)
+
+CATEGORIES = [
+    {"id": "caps", "name": "Capser", "slug": "caps", "icon": "cap"},
+    {"id": "tshirts", "name": "T-skjorter", "slug": "t-skjorter", "icon": "shirt"},
+    {"id": "hoodies", "name": "Gensere & Hoodies", "slug": "gensere-hoodies", "icon": "hoodie"},
+    {"id": "jackets", "name": "Jakker", "slug": "jakker", "icon": "jacket"},
+    {"id": "workwear", "name": "Arbeidsklær", "slug": "arbeidsklaer", "icon": "hardhat"},
+    {"id": "accessories", "name": "Tilbehør", "slug": "tilbehor", "icon": "bag"}
+]
+CATEGORIES_ETAG = make_etag('categories', json.dumps(CATEGORIES, sort_keys=True))
 
 @api_router.get("/categories")
-async def get_categories():
-    categories = [
-        {"id": "caps", "name": "Capser", "slug": "caps", "icon": "cap"},
-        {"id": "tshirts", "name": "T-skjorter", "slug": "t-skjorter", "icon": "shirt"},
-        {"id": "hoodies", "name": "Gensere & Hoodies", "slug": "gensere-hoodies", "icon": "hoodie"},
-        {"id": "jackets", "name": "Jakker", "slug": "jakker", "icon": "jacket"},
-        {"id": "workwear", "name": "Arbeidsklær", "slug": "arbeidsklaer", "icon": "hardhat"},
-        {"id": "accessories", "name": "Tilbehør", "slug": "tilbehor", "icon": "bag"}
-    ]
-    return categories
-
-@api_router.get("/products/category/{category}", response_model=List[Product])
-async def get_products_by_category(category: str, limit: int = 50, skip: int = 0):
-    products = await db.products.find(
-        {'category': category, 'active': True}, 
-        {'_id': 0}
-    ).skip(skip).limit(limit).to_list(limit)
-    return products
+async def get_categories(request: Request, response: Response):
+    not_modified = conditional(request, response, CATEGORIES_ETAG, 'categories')
+    if not_modified:
+        return not_modified
+    return CATEGORIES
+
+@api_router.get("/products/category/{category}", response_model=Union[List[Product], ProductPage])
+async def get_products_by_category(
+    category: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PRODUCT_LIMIT),
+    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = None
+):
+    snapshot = await catalog.get()
+    etag = make_etag('products', snapshot.fingerprint, category, query_token(request))
+    not_modified = conditional(request, response, etag, 'products')
+    if not_modified:
+        return not_modified
+    if cursor is not None:
+        return raw_json(product_page_json(snapshot, cursor, limit, category=category), response)
+    return raw_json(snapshot.list_json(snapshot.query_positions(category=category, skip=skip, limit=limit, load_order=True)), response)
 
 # ==================== CART ENDPOINTS ====================
 
+blob_store = create_blob_store(db)
+design_assets = DesignAssetStore(db, blob_store)
+# Carts as last written or read by this worker; a cached None is a cart that does not exist yet
+cart_cache = TTLCache(
+    maxsize=CART_CACHE_SIZE, ttl=CART_CACHE_TTL, negative_ttl=CART_CACHE_NEGATIVE_TTL,
+    max_bytes=CART_CACHE_MAX_BYTES, sizeof=lambda cart: len(orjson.dumps(cart)),
+)
+
+async def touch_logo(url: Optional[str]) -> Optional[str]:
+    """Id of the uploaded logo a URL links to, marked as used so the retention sweep keeps it"""
+    logo_id = logo_id_from_url(url)
+    if logo_id:
+        await db.logos.update_one({'id': logo_id}, {'$set': {'last_used_at': datetime.now(timezone.utc).isoformat()}})
+    return logo_id
+
+async def intern_design(design: DesignObject) -> DesignObject:
+    """Move embedded logo data URLs into the asset store; the design keeps only references"""
+    try:
+        logo_url, logo_asset = await design_assets.intern(design.logo_url)
+        logo_preview, preview_asset = await design_assets.intern(design.logo_preview)
+    except InvalidAsset:
+        raise HTTPException(
+            status_code=400, detail="Ugyldig logo. Bruk et PNG-, JPG-, WebP- eller GIF-bilde på maks 10MB."
+        )
+    return design.model_copy(update={
+        'logo_url': logo_url,
+        'logo_asset': logo_asset,
+        'logo_preview': logo_preview,
+        'preview_asset': preview_asset,
+        'logo_id': await touch_logo(logo_url) or await touch_logo(logo_preview),
+    })
+
+async def design_logo_hash(design: DesignObject) -> Optional[str]:
+    """Blob hash of the design's logo: an embedded asset, or the uploaded logo it links to"""
+    if design.logo_asset:
+        return design.logo_asset
+    if design.logo_id:
+        try:
+            return (await load_logo_blob(design.logo_id))['sha256']
+        except HTTPException:
+            return None
+    return None
+
+async def analyze_design(design: DesignObject) -> DesignObject:
+    """Replace client-reported colours/complexity/warnings with the server-side logo analysis"""
+    sha256 = await design_logo_hash(design)
+    if not sha256:
+        return design
+    analysis = await logo_analyzer.analyze(sha256, wait=DESIGN_ANALYSIS_WAIT)
+    if analysis is None:
+        return design
+    embroidery = design.print_method == "embroidery"
+    return design.model_copy(update={
+        'colors': analysis['colors'],
+        'complexity': analysis['complexity'],
+        'warnings': design_warnings(analysis, design.print_method),
+        'stitch_estimate': estimate_stitches(analysis, design.width_cm, design.height_cm) if embroidery else None,
+    })
+
+CART_ID_NAMESPACE = uuid.UUID('5b0f2c1e-8d7a-4f3e-9c61-2a4e7d9b8f10')
+
+def session_cart_id(session_id: str) -> str:
+    """Cart id for a session: the same for the virtual (empty) cart and the document the first add creates"""
+    return str(uuid.uuid5(CART_ID_NAMESPACE, session_id))
+
+async def upsert_cart_lines(session_id: str, lines: List[dict]) -> dict:
+    """Add or replace cart lines and recompute totals in one atomic update"""
+    pipeline = upsert_lines_pipeline(
+        lines,
+        new_cart_id=session_cart_id(session_id),
+        now=datetime.now(timezone.utc),
+        shipping_cost=SHIPPING_COST,
+        free_shipping_threshold=FREE_SHIPPING_THRESHOLD,
+    )
+    try:
+        cart = await db.carts.find_one_and_update(
+            {'session_id': session_id}, pipeline,
+            projection={'_id': 0}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race for a brand-new cart - the document exists now
+        cart = await db.carts.find_one_and_update(
+            {'session_id': session_id}, pipeline,
+            projection={'_id': 0}, return_document=ReturnDocument.AFTER
+        )
+    cart_cache.set(session_id, cart)
+    return cart
+
+async def backfill_line_ids(cart: dict) -> dict:
+    """Give items stored before line ids existed their id (one-time write per cart)"""
+    for item in cart['items']:
+        if not item.get('line_id'):
+            design = item.get('design')
+            design_json = DesignObject(**design).model_dump_json() if design else None
+            item['line_id'] = cart_line_id(item['product_id'], item['variant_color'], item['size'], design_json)
+    await db.carts.update_one({'session_id': cart['session_id']}, {'$set': {'items': cart['items']}})
+    return cart
+
 @api_router.get("/cart/{session_id}", response_model=Cart)
 async def get_cart(session_id: str):
-    cart = await db.carts.find_one({'session_id': session_id}, {'_id': 0})
-    if not cart:
-        cart = Cart(session_id=session_id).model_dump()
-        await db.carts.insert_one(cart)
+    found, cart = cart_cache.get(session_id)
+    if not found:
+        cart = await db.carts.find_one({'session_id': session_id}, {'_id': 0})
+        if cart and any(not item.get('line_id') for item in cart.get('items', [])):
+            cart = await backfill_line_ids(cart)
+        if cart:
+            cart_cache.set(session_id, cart)
+        else:
+            cart_cache.set_missing(session_id)
+    if cart is None:
+        # Empty carts are virtual; the document is created by the first add
+        return Cart(id=session_cart_id(session_id), session_id=session_id)
     return cart
 
 @api_router.post("/cart/{session_id}/add", response_model=Cart)
 async def add_to_cart(session_id: str, item: AddToCartRequest):
-    # Get or create cart
-    cart = await db.carts.find_one({'session_id': session_id}, {'_id': 0})
-    if not cart:
-        cart = Cart(session_id=session_id).model_dump()
-    
     # Get product
     product = await db.products.find_one({'id': item.product_id}, {'_id': 0})
     if not product:
@@ -469,111 +775,235 @@ async def add_to_cart(session_id: str, item: AddToCartRequest):
     
     # Calculate design price if design exists
     design_price = 0
+    design = None
+    design_json = None
     if item.design:
         design_price = calculate_design_price(item.design, item.quantity)
+        design = await intern_design(item.design)
+        # The line id comes from the design as sent, so it does not depend on whether the analysis finished in time
+        design_json = design.model_dump_json()
+        design = await analyze_design(design)
     
     # Create cart item
     cart_item = CartItem(
+        line_id=cart_line_id(item.product_id, item.variant_color, item.size, design_json),
         product_id=item.product_id,
         product_name=product['name'],
         variant_color=item.variant_color,
         size=item.size,
         quantity=item.quantity,
         base_price=product['base_price'],
-        design=item.design,
+        design=design,
         design_price=design_price,
         total_price=(product['base_price'] * item.quantity) + (design_price * item.quantity)
     )
     
-    # Add or update item
-    items = cart.get('items', [])
-    existing_idx = None
-    for i, existing in enumerate(items):
-        if (existing['product_id'] == item.product_id and 
-            existing['variant_color'] == item.variant_color and 
-            existing['size'] == item.size):
-            existing_idx = i
-            break
-    
-    if existing_idx is not None:
-        items[existing_idx] = cart_item.model_dump()
-    else:
-        items.append(cart_item.model_dump())
-    
-    # Recalculate totals
-    subtotal = sum(i['base_price'] * i['quantity'] for i in items)
-    design_total = sum(i['design_price'] * i['quantity'] for i in items)
-    shipping = calculate_shipping(subtotal + design_total)
-    total = subtotal + design_total + shipping
+    # Add or replace the line and recalculate totals atomically
+    return await upsert_cart_lines(session_id, [cart_item.model_dump()])
+
+@api_router.post("/cart/{session_id}/add-matrix", response_model=Cart)
+async def add_size_matrix_to_cart(session_id: str, request: AddSizeMatrixRequest):
+    product = await db.products.find_one({'id': request.product_id}, {'_id': 0})
+    if not product:
+        raise HTTPException(status_code=404, detail="Produkt ikke funnet")
     
-    # Update cart
-    updated_cart = {
-        'id': cart.get('id', str(uuid.uuid4())),
-        'user_id': cart.get('user_id'),
-        'session_id': session_id,
-        'items': items,
-        'subtotal': round(subtotal, 2),
-        'design_total': round(design_total, 2),
-        'shipping': round(shipping, 2),
-        'total': round(total, 2),
-        'updated_at': datetime.now(timezone.utc).isoformat()
-    }
+    # Validate the whole matrix before doing any work; repeated colours are added together
+    sizes_by_color = {v['color']: v['sizes'] for v in product.get('variants', [])}
+    matrix: Dict[str, Dict[str, int]] = {}
+    for row in request.rows:
+        if row.variant_color not in sizes_by_color:
+            raise HTTPException(status_code=400, detail=f"Fargen {row.variant_color} finnes ikke for dette produktet")
+        for size, quantity in row.quantities.items():
+            if size not in sizes_by_color[row.variant_color]:
+                raise HTTPException(
+                    status_code=400, detail=f"Størrelse {size} finnes ikke i fargen {row.variant_color}"
+                )
+            if quantity < 0:
+                raise HTTPException(status_code=400, detail="Antall kan ikke være negativt")
+            if quantity:
+                sizes = matrix.setdefault(row.variant_color, {})
+                sizes[size] = sizes.get(size, 0) + quantity
+    if not matrix:
+        raise HTTPException(status_code=400, detail="Velg antall for minst én størrelse")
     
-    await db.carts.update_one(
-        {'session_id': session_id},
-        {'$set': updated_cart},
-        upsert=True
-    )
+    # The logo is interned and analysed once for every line
+    design = None
+    design_json = None
+    if request.design:
+        design = await intern_design(request.design)
+        design_json = design.model_dump_json()  # before analysis, as in add_to_cart
+        design = await analyze_design(design)
     
-    return updated_cart
-
-@api_router.delete("/cart/{session_id}/item/{item_index}")
-async def remove_from_cart(session_id: str, item_index: int):
-    cart = await db.carts.find_one({'session_id': session_id}, {'_id': 0})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Handlekurv ikke funnet")
+    lines = []
+    for color in sizes_by_color:
+        # Lines follow the product's colour and size order, not the request's
+        for size in sizes_by_color[color]:
+            quantity = matrix.get(color, {}).get(size)
+            if not quantity:
+                continue
+            design_price = calculate_design_price(request.design, quantity) if request.design else 0
+            lines.append(CartItem(
+                line_id=cart_line_id(request.product_id, color, size, design_json),
+                product_id=request.product_id,
+                product_name=product['name'],
+                variant_color=color,
+                size=size,
+                quantity=quantity,
+                base_price=product['base_price'],
+                design=design,
+                design_price=design_price,
+                total_price=(product['base_price'] + design_price) * quantity
+            ).model_dump())
     
-    items = cart.get('items', [])
-    if item_index < 0 or item_index >= len(items):
-        raise HTTPException(status_code=400, detail="Ugyldig vareindeks")
+    return await upsert_cart_lines(session_id, lines)
+
+@api_router.post("/cart/{session_id}/import-roster")
+async def import_roster(session_id: str, request: Request, dry_run: bool = False):
+    """Add an employee roster (multipart "file", CSV or XLSX, optional "design" JSON) as cart lines"""
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > ROSTER_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail="Filen er for stor. Maks 5MB.")
     
-    items.pop(item_index)
+    # The body is parsed as it arrives and cut off at the limit, whatever Content-Length claims;
+    # the file is spooled to a temporary file and rows are then read from it one at a time
+    try:
+        upload = MultipartStream(request, max_bytes=ROSTER_MAX_BYTES + MULTIPART_OVERHEAD_BYTES)
+        file = await upload.open_file()
+        if file is None:
+            raise HTTPException(status_code=422, detail="Ingen fil mottatt")
+        spooled = await spool(upload.file_chunks(), max_bytes=ROSTER_MAX_BYTES)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Filen er for stor. Maks 5MB.")
+    except UploadError:
+        raise HTTPException(status_code=400, detail="Ugyldig opplasting")
+    try:
+        try:
+            fields = await upload.finish()
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="Filen er for stor. Maks 5MB.")
+        except UploadError:
+            raise HTTPException(status_code=400, detail="Ugyldig opplasting")
+        design = None
+        if fields.get('design'):
+            try:
+                design = DesignObject.model_validate_json(fields['design'])
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Ugyldig design")
+        snapshot = await catalog.get()
+        try:
+            roster = RosterImport(snapshot)
+            await asyncio.get_running_loop().run_in_executor(
+                None, roster.read, spooled, roster_kind(file.filename, file.content_type)
+            )
+        except RosterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spooled.close()
     
-    # Recalculate
-    subtotal = sum(i['base_price'] * i['quantity'] for i in items)
-    design_total = sum(i['design_price'] * i['quantity'] for i in items)
-    shipping = calculate_shipping(subtotal + design_total)
-    total = subtotal + design_total + shipping
+    stored_design = None
+    design_json = None
+    if design and roster.lines:
+        stored_design = await intern_design(design)
+        design_json = stored_design.model_dump_json()  # before analysis, as in add_to_cart
+        stored_design = await analyze_design(stored_design)
     
-    cart['items'] = items
-    cart['subtotal'] = round(subtotal, 2)
-    cart['design_total'] = round(design_total, 2)
-    cart['shipping'] = round(shipping, 2)
-    cart['total'] = round(total, 2)
-    cart['updated_at'] = datetime.now(timezone.utc).isoformat()
+    lines = []
+    for line in roster.lines.values():
+        product = snapshot.get_by_id(line.product_id)
+        design_price = calculate_design_price(design, line.quantity) if design else 0
+        if line.personalized:
+            design_price += PERSONALIZATION_PRICE
+        lines.append(CartItem(
+            line_id=cart_line_id(line.product_id, line.variant_color, line.size, design_json, line.personalized),
+            product_id=line.product_id,
+            product_name=product['name'],
+            variant_color=line.variant_color,
+            size=line.size,
+            quantity=line.quantity,
+            base_price=product['base_price'],
+            design=stored_design,
+            design_price=design_price,
+            personalization=line.personalization,
+            total_price=(product['base_price'] + design_price) * line.quantity
+        ).model_dump())
     
-    await db.carts.update_one({'session_id': session_id}, {'$set': cart})
+    # Valid rows are imported even when others fail; the report lists what was skipped
+    cart = None
+    if lines and not dry_run:
+        cart = await upsert_cart_lines(session_id, lines)
+    return {
+        "cart": cart,
+        "rows": roster.rows,
+        "imported_rows": roster.imported_rows,
+        "lines": len(lines),
+        "error_count": roster.error_count,
+        "errors": roster.errors,
+        "dry_run": dry_run,
+    }
+
+@api_router.delete("/cart/{session_id}/item/{line_id}")
+async def remove_from_cart(session_id: str, line_id: str):
+    pipeline = remove_line_pipeline(
+        line_id,
+        now=datetime.now(timezone.utc),
+        shipping_cost=SHIPPING_COST,
+        free_shipping_threshold=FREE_SHIPPING_THRESHOLD,
+    )
+    cart = await db.carts.find_one_and_update(
+        {'session_id': session_id, 'items.line_id': line_id}, pipeline,
+        projection={'_id': 0}, return_document=ReturnDocument.AFTER
+    )
+    if not cart:
+        if not await db.carts.find_one({'session_id': session_id}, {'_id': 1}):
+            raise HTTPException(status_code=404, detail="Handlekurv ikke funnet")
+        raise HTTPException(status_code=404, detail="Varen finnes ikke i handlekurven")
     
+    cart_cache.set(session_id, cart)
     return cart
 
 @api_router.delete("/cart/{session_id}")
 async def clear_cart(session_id: str):
     await db.carts.delete_one({'session_id': session_id})
+    cart_cache.set_missing(session_id)
     return {"message": "Handlekurv tømt"}
 
 # ==================== ORDER ENDPOINTS ====================
 
+order_sequence = OrderSequence(db)
+stripe_gateway = create_stripe_gateway()
+webhook_inbox = WebhookInbox(db)
+order_writer = OrderWriter(client, db)
+checkout_stats = CheckoutStats()
+checkout_status_cache = CheckoutStatusCache(
+    db, ttl=CHECKOUT_STATUS_TTL, final_ttl=CHECKOUT_STATUS_FINAL_TTL, maxsize=CHECKOUT_STATUS_CACHE_SIZE,
+)
+
+def get_stripe_gateway() -> StripeGateway:
+    return stripe_gateway
+
+async def prefetch_payment(payment_method: str) -> None:
+    """Warm the payment provider's credentials while the cart is being read"""
+    if payment_method == "vipps" and vipps.settings.configured:
+        try:
+            await vipps.tokens.get_access_token()
+        except HTTPException:
+            pass  # create_payment reports the same error
+
 @api_router.post("/orders/create")
-async def create_order(request: CreateOrderRequest, http_request: Request):
-    # Get cart
-    cart = await db.carts.find_one({'session_id': request.cart_session_id}, {'_id': 0})
+async def create_order(request: CreateOrderRequest, http_request: Request,
+                       gateway: StripeGateway = Depends(get_stripe_gateway)):
+    timer = checkout_stats.timer()
+    
+    # Cart, order number and payment credentials do not depend on each other
+    cart, order_number, _ = await asyncio.gather(
+        db.carts.find_one({'session_id': request.cart_session_id}, {'_id': 0}),
+        order_sequence.next_number(f"FP{datetime.now().strftime('%Y%m')}"),
+        prefetch_payment(request.payment_method),
+    )
+    timer.mark('reads')
     if not cart or not cart.get('items'):
         raise HTTPException(status_code=400, detail="Handlekurven er tom")
     
-    # Generate order number
-    order_count = await db.orders.count_documents({})
-    order_number = f"FP{datetime.now().strftime('%Y%m')}{order_count + 1:04d}"
-    
     # Calculate shipping
     subtotal = cart.get('subtotal', 0)
     design_total = cart.get('design_total', 0)
@@ -593,37 +1023,35 @@ async def create_order(request: CreateOrderRequest, http_request: Request):
         notes=request.notes
     )
     
+    transaction = None
+    response = {}
+    
     if request.payment_method == "stripe":
         # Create Stripe checkout session
-        from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionRequest
-        
-        api_key = os.environ.get('STRIPE_API_KEY')
         host_url = str(http_request.base_url).rstrip('/')
         webhook_url = f"{host_url}/api/webhook/stripe"
         
-        stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-        
         # Get origin from request headers
         origin = http_request.headers.get('origin', host_url)
         success_url = f"{origin}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}&method=stripe"
         cancel_url = f"{origin}/checkout/cancel"
         
-        checkout_request = CheckoutSessionRequest(
+        metadata = {
+            "order_id": order.id,
+            "order_number": order_number
+        }
+        
+        session = await gateway.create_checkout_session(
             amount=float(order.total),
             currency="nok",
             success_url=success_url,
             cancel_url=cancel_url,
-            metadata={
-                "order_id": order.id,
-                "order_number": order_number
-            }
+            metadata=metadata,
+            webhook_url=webhook_url
         )
-        
-        session = await stripe_checkout.create_checkout_session(checkout_request)
         order.stripe_session_id = session.session_id
         
-        # Save payment transaction
-        await db.payment_transactions.insert_one({
+        transaction = {
             'id': str(uuid.uuid4()),
             'order_id': order.id,
             'session_id': session.session_id,
@@ -631,109 +1059,73 @@ async def create_order(request: CreateOrderRequest, http_request: Request):
             'currency': 'nok',
             'payment_method': 'stripe',
             'payment_status': 'pending',
-            'metadata': checkout_request.metadata,
-            'created_at': datetime.now(timezone.utc).isoformat()
-        })
-        
-        # Save order
-        order_dict = order.model_dump()
-        await db.orders.insert_one(order_dict)
-        
-        # Clear cart
-        await db.carts.delete_one({'session_id': request.cart_session_id})
-        
-        return {"order": order_dict, "checkout_url": session.url}
+            'metadata': metadata,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'expires_at': payment_expiry(),
+        }
+        response["checkout_url"] = session.url
     
     elif request.payment_method == "vipps":
         # Create Vipps payment
         origin = http_request.headers.get('origin', str(http_request.base_url).rstrip('/'))
         return_url = f"{origin}/checkout/success?order_id={order.id}&method=vipps"
+        reference = f"fp-{order_number}-{uuid.uuid4().hex[:6]}"
+        
+        payment_payload = {
+            "amount": {
+                "currency": "NOK",
+                "value": int(order.total * 100)  # Convert to øre
+            },
+            "paymentMethod": {
+                "type": "WALLET"
+            },
+            "reference": reference,
+            "returnUrl": return_url,
+            "userFlow": "WEB_REDIRECT",
+            "paymentDescription": f"Firmaprint ordre {order_number}"
+        }
         
         # Initiate Vipps payment
         try:
-            access_token = await vipps_token_manager.get_access_token()
-            vipps_api_url = os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no')
-            vipps_subscription_key = os.environ.get('VIPPS_SUBSCRIPTION_KEY')
-            vipps_msn = os.environ.get('VIPPS_MSN')
-            
-            reference = f"fp-{order_number}-{uuid.uuid4().hex[:6]}"
-            
-            payment_payload = {
-                "amount": {
-                    "currency": "NOK",
-                    "value": int(order.total * 100)  # Convert to øre
-                },
-                "paymentMethod": {
-                    "type": "WALLET"
-                },
-                "reference": reference,
-                "returnUrl": return_url,
-                "userFlow": "WEB_REDIRECT",
-                "paymentDescription": f"Firmaprint ordre {order_number}"
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{vipps_api_url}/epayment/v1/payments",
-                    json=payment_payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {access_token}",
-                        "Ocp-Apim-Subscription-Key": vipps_subscription_key,
-                        "Merchant-Serial-Number": vipps_msn,
-                        "Idempotency-Key": str(uuid.uuid4()),
-                        "Vipps-System-Name": "Firmaprint",
-                        "Vipps-System-Version": "1.0.0",
-                    },
-                )
-                
-                if response.status_code != 201:
-                    logger.error(f"Vipps error: {response.text}")
-                    raise HTTPException(status_code=400, detail="Kunne ikke opprette Vipps-betaling")
-                
-                payment_data = response.json()
-            
-            order.vipps_reference = reference
-            
-            # Save payment transaction
-            await db.payment_transactions.insert_one({
-                'id': str(uuid.uuid4()),
-                'order_id': order.id,
-                'reference': reference,
-                'amount': int(order.total * 100),
-                'currency': 'NOK',
-                'payment_method': 'vipps',
-                'payment_status': 'CREATED',
-                'created_at': datetime.now(timezone.utc).isoformat()
-            })
-            
-            # Save order
-            order_dict = order.model_dump()
-            await db.orders.insert_one(order_dict)
-            
-            # Clear cart
-            await db.carts.delete_one({'session_id': request.cart_session_id})
-            
-            return {"order": order_dict, "checkout_url": payment_data["redirectUrl"]}
-            
+            vipps_response = await vipps.create_payment(payment_payload)
+            if vipps_response.status_code != 201:
+                logger.error(f"Vipps error: {vipps_response.text}")
+                raise HTTPException(status_code=400, detail="Kunne ikke opprette Vipps-betaling")
+            payment_data = vipps_response.json()
         except HTTPException:
             raise
         except Exception as e:
             logger.error(f"Vipps error: {e}")
             raise HTTPException(status_code=500, detail="Vipps-betaling feilet")
+        
+        order.vipps_reference = reference
+        
+        transaction = {
+            'id': str(uuid.uuid4()),
+            'order_id': order.id,
+            'reference': reference,
+            'amount': int(order.total * 100),
+            'currency': 'NOK',
+            'payment_method': 'vipps',
+            'payment_status': 'CREATED',
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'expires_at': payment_expiry(),
+        }
+        response["checkout_url"] = payment_data["redirectUrl"]
     
     else:  # Invoice
         order.payment_status = "awaiting_invoice"
         order.status = "awaiting_payment"
-        
-        order_dict = order.model_dump()
-        await db.orders.insert_one(order_dict)
-        
-        # Clear cart
-        await db.carts.delete_one({'session_id': request.cart_session_id})
-        
-        return {"order": order_dict}
-
+    timer.mark('payment')
+    
+    # Order, payment transaction and cart removal commit together
+    order_dict = order.model_dump()
+    await order_writer.commit(order_dict, transaction, request.cart_session_id)
+    cart_cache.set_missing(request.cart_session_id)
+    timer.mark('commit')
+    timer.finish(f"{order_number} method={request.payment_method}")
+    
+    return {"order": order_dict, **response}
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str):
@@ -750,60 +1142,31 @@ async def get_order_by_number(order_number: str):
     return order
 
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
-    from emergentintegrations.payments.stripe.checkout import StripeCheckout
-    
-    api_key = os.environ.get('STRIPE_API_KEY')
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url="")
-    
-    status = await stripe_checkout.get_checkout_status(session_id)
-    
-    # Update order and transaction if paid
-    if status.payment_status == "paid":
-        await db.payment_transactions.update_one(
-            {'session_id': session_id},
-            {'$set': {'payment_status': 'paid', 'updated_at': datetime.now(timezone.utc).isoformat()}}
-        )
-        await db.orders.update_one(
-            {'stripe_session_id': session_id},
-            {'$set': {'payment_status': 'paid', 'status': 'processing'}}
-        )
-    
-    return status
+async def get_checkout_status(session_id: str, gateway: StripeGateway = Depends(get_stripe_gateway)):
+    # Coalesced and cached per session; marks the order and transaction paid on the first paid answer
+    return await checkout_status_cache.get(session_id, gateway)
 
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request):
-    from emergentintegrations.payments.stripe.checkout import StripeCheckout
-    
+async def stripe_webhook(request: Request, gateway: StripeGateway = Depends(get_stripe_gateway)):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    api_key = os.environ.get('STRIPE_API_KEY')
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url="")
-    
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            await db.payment_transactions.update_one(
-                {'session_id': webhook_response.session_id},
-                {'$set': {'payment_status': 'paid', 'updated_at': datetime.now(timezone.utc).isoformat()}}
-            )
-            await db.orders.update_one(
-                {'stripe_session_id': webhook_response.session_id},
-                {'$set': {'payment_status': 'paid', 'status': 'processing'}}
-            )
-        
-        return {"status": "ok"}
+        webhook_response = await gateway.handle_webhook(body, signature)
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         return {"status": "error"}
+    
+    # Order updates happen in the inbox worker; if this write fails Stripe gets a 500 and retries
+    await webhook_inbox.record('stripe', webhook_response)
+    return {"status": "ok"}
 
 # ==================== QUOTE ENDPOINTS ====================
 
 @api_router.post("/quotes", response_model=QuoteRequest)
 async def create_quote(quote: QuoteRequestCreate):
     quote_obj = QuoteRequest(**quote.model_dump())
+    await touch_logo(quote_obj.logo_url)
     await db.quotes.insert_one(quote_obj.model_dump())
     return quote_obj
 
@@ -824,74 +1187,236 @@ async def send_contact_message(message: ContactMessageCreate):
 
 # ==================== FILE UPLOAD ENDPOINT ====================
 
+image_pool = ImageWorkerPool()
+logo_derivatives = LogoDerivatives(db, blob_store, image_pool)
+logo_analyzer = LogoAnalyzer(db, blob_store, image_pool)
+# Deletes unreferenced logos and design assets past LOGO_RETENTION_DAYS; one worker at a time
+retention = RetentionSweeper(db, blob_store)
+
+ALLOWED_LOGO_TYPES = ['image/png', 'image/jpeg', 'image/svg+xml', 'application/pdf']
+MAX_LOGO_BYTES = 10 * 1024 * 1024
+
 @api_router.post("/upload/logo")
-async def upload_logo(file: UploadFile = File(...)):
-    """Upload logo file and return base64 encoded data"""
-    allowed_types = ['image/png', 'image/jpeg', 'image/svg+xml', 'application/pdf']
-    
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Ugyldig filtype. Bruk PNG, JPG, SVG eller PDF.")
-    
-    # Read file content
-    content = await file.read()
-    
-    # Check file size (max 10MB)
-    if len(content) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Filen er for stor. Maks 10MB.")
+async def upload_logo(request: Request, background_tasks: BackgroundTasks):
+    """Stream an uploaded logo (multipart field "file") into the blob store as it arrives"""
+    # Reject declared oversized uploads before the body is read
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > MAX_LOGO_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail="Filen er for stor. Maks 10MB.")
     
-    # Encode to base64
-    encoded = base64.b64encode(content).decode('utf-8')
+    # The body is parsed and hashed as it arrives and cut off at the limit, whatever Content-Length claims
+    try:
+        upload = MultipartStream(request, max_bytes=MAX_LOGO_BYTES + MULTIPART_OVERHEAD_BYTES)
+        file = await upload.open_file()
+        if file is None:
+            raise HTTPException(status_code=422, detail="Ingen fil mottatt")
+        if file.content_type not in ALLOWED_LOGO_TYPES:
+            raise HTTPException(status_code=400, detail="Ugyldig filtype. Bruk PNG, JPG, SVG eller PDF.")
+        blob = await blob_store.put(upload.file_chunks(), max_bytes=MAX_LOGO_BYTES)
+    except (BlobTooLarge, UploadTooLarge):
+        raise HTTPException(status_code=413, detail="Filen er for stor. Maks 10MB.")
+    except UploadError:
+        raise HTTPException(status_code=400, detail="Ugyldig opplasting")
     
-    # Save to database
     logo_id = str(uuid.uuid4())
     logo_doc = {
         'id': logo_id,
         'filename': file.filename,
         'content_type': file.content_type,
-        'size': len(content),
-        'data': encoded,
+        'size': blob.size,
+        'sha256': blob.sha256,
+        'storage': blob_store.backend,
         'created_at': datetime.now(timezone.utc).isoformat()
     }
     
     await db.logos.insert_one(logo_doc)
+    await logo_derivatives.enqueue(blob.sha256, file.content_type)
+    background_tasks.add_task(logo_analyzer.analyze, blob.sha256)
     
     return {
         'id': logo_id,
         'filename': file.filename,
         'content_type': file.content_type,
-        'size': len(content),
-        'data_url': f"data:{file.content_type};base64,{encoded[:50]}..."  # Preview only
+        'size': blob.size,
+        'sha256': blob.sha256,
+        'preview_url': f"/api/logos/{logo_id}/preview",
+    }
+
+INLINE_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/webp', 'image/gif')
+
+def content_safety_headers(content_type: str) -> Dict[str, str]:
+    """Uploaded bytes are served from our origin: never sniffed, SVG sandboxed, anything else not raster downloaded"""
+    headers = {'X-Content-Type-Options': 'nosniff'}
+    if content_type == 'image/svg+xml':
+        headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    elif content_type not in INLINE_CONTENT_TYPES:
+        headers['Content-Disposition'] = 'attachment'
+    return headers
+
+async def blob_response(request: Request, sha256: str, size: int, content_type: str, policy: str) -> Response:
+    """Raw blob bytes with a hash ETag, immutable caching and single-range (206) support"""
+    etag = f'"{sha256}"'
+    headers = {
+        'ETag': etag, 'Cache-Control': CACHE_POLICIES[policy], 'Accept-Ranges': 'bytes',
+        **content_safety_headers(content_type),
     }
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    if if_range_allows(request, etag):
+        try:
+            byte_range = parse_range(request.headers.get('range'), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+    
+    if byte_range is None:
+        path = blob_store.local_path(sha256)
+        if path:
+            # Zero-copy (pathsend) where the server supports it
+            return FileResponse(path, media_type=content_type, headers=headers)
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(blob_store.stream(sha256), media_type=content_type, headers=headers)
+    
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        blob_store.stream(sha256, start, end + 1), status_code=206, media_type=content_type, headers=headers
+    )
+
+async def read_logo_bytes(logo: dict) -> Optional[bytes]:
+    if 'data' in logo:  # stored inline as base64 before the blob store existed
+        return base64.b64decode(logo['data'])
+    return await blob_store.read(logo['sha256'])
 
 @api_router.get("/logos/{logo_id}")
 async def get_logo(logo_id: str):
     logo = await db.logos.find_one({'id': logo_id}, {'_id': 0})
-    if not logo:
+    data = await read_logo_bytes(logo) if logo else None
+    if data is None:
         raise HTTPException(status_code=404, detail="Logo ikke funnet")
     
     return {
         'id': logo['id'],
         'filename': logo['filename'],
         'content_type': logo['content_type'],
-        'data_url': f"data:{logo['content_type']};base64,{logo['data']}"
+        'data_url': f"data:{logo['content_type']};base64,{base64.b64encode(data).decode('utf-8')}"
     }
 
+async def load_logo_blob(logo_id: str) -> dict:
+    """Logo document whose bytes are in the blob store; legacy inline logos are moved on first use"""
+    logo = await db.logos.find_one({'id': logo_id}, {'_id': 0})
+    if not logo:
+        raise HTTPException(status_code=404, detail="Logo ikke funnet")
+    
+    if 'data' in logo:
+        blob = await blob_store.put(single_chunk(base64.b64decode(logo['data'])))
+        logo.update(sha256=blob.sha256, size=blob.size, storage=blob_store.backend)
+        await db.logos.update_one(
+            {'id': logo_id},
+            {'$set': {'sha256': blob.sha256, 'size': blob.size, 'storage': blob_store.backend}, '$unset': {'data': ''}}
+        )
+    elif not await blob_store.exists(logo['sha256']):
+        raise HTTPException(status_code=404, detail="Logo ikke funnet")
+    return logo
+
+@api_router.get("/logos/{logo_id}/raw")
+async def get_logo_raw(logo_id: str, request: Request):
+    """Logo file bytes, cacheable forever (the ETag is the content hash)"""
+    logo = await load_logo_blob(logo_id)
+    return await blob_response(request, logo['sha256'], logo['size'], logo['content_type'], 'logo')
+
+@api_router.get("/logos/{logo_id}/analysis")
+async def get_logo_analysis(
+    logo_id: str,
+    print_method: str = "print",
+    width_cm: Optional[float] = Query(None, gt=0, le=100),
+    height_cm: Optional[float] = Query(None, gt=0, le=100)
+):
+    """Dominant colours, complexity and production warnings (plus a stitch estimate for a print size)"""
+    logo = await load_logo_blob(logo_id)
+    analysis = await logo_analyzer.analyze(logo['sha256'])
+    if analysis is None:
+        raise HTTPException(status_code=422, detail="Logoen kan ikke analyseres")
+    
+    result = {
+        key: analysis[key]
+        for key in ('width', 'height', 'colors', 'color_shares', 'coverage', 'edge_density', 'complexity', 'photographic')
+    }
+    result['warnings'] = design_warnings(analysis, print_method)
+    if width_cm and height_cm:
+        result['stitch_estimate'] = estimate_stitches(analysis, width_cm, height_cm)
+    return result
+
+@api_router.get("/logos/{logo_id}/preview")
+async def get_logo_preview(
+    logo_id: str,
+    request: Request,
+    size: int = Query(512, ge=16, le=4096),
+    format: Optional[str] = Query(None, pattern="^(png|webp)$")
+):
+    """Best pre-rendered preview for the requested size (202 while it is being rendered)"""
+    logo = await load_logo_blob(logo_id)
+    derivatives = await logo_derivatives.get(logo['sha256'])
+    if derivatives is None or derivatives['status'] == STATUS_FAILED:
+        # Unknown, or a failure past its retry_after: (re)queue the render
+        if await logo_derivatives.enqueue(logo['sha256'], logo['content_type']) or derivatives is None:
+            derivatives = {'status': STATUS_PENDING}
+    if derivatives['status'] == STATUS_PENDING:
+        return Response(
+            content=orjson.dumps({'status': STATUS_PENDING}), status_code=202,
+            media_type='application/json', headers={'Retry-After': '2'}
+        )
+    if derivatives['status'] != STATUS_READY:
+        raise HTTPException(status_code=404, detail="Forhåndsvisning ikke tilgjengelig")
+    
+    negotiated = format is None
+    if negotiated:
+        format = 'webp' if 'image/webp' in request.headers.get('accept', '') else 'png'
+    variant = best_variant(derivatives['variants'], size, format)
+    if variant is None:
+        raise HTTPException(status_code=404, detail="Forhåndsvisning ikke tilgjengelig")
+    response = await blob_response(
+        request, variant['sha256'], variant['bytes'], FORMAT_CONTENT_TYPES[variant['format']], 'logo'
+    )
+    if negotiated:
+        response.headers['Vary'] = 'Accept'
+    return response
+
+@api_router.get("/design-assets/{asset_hash}")
+async def get_design_asset(asset_hash: str, request: Request):
+    """Raw bytes of a stored design asset; content-addressed, so cacheable forever"""
+    if not is_asset_hash(asset_hash):
+        raise HTTPException(status_code=404, detail="Logo ikke funnet")
+    asset = await design_assets.get(asset_hash)
+    if not asset or not await blob_store.exists(asset_hash):
+        raise HTTPException(status_code=404, detail="Logo ikke funnet")
+    return await blob_response(request, asset_hash, asset['size'], asset['content_type'], 'design_asset')
+
 # ==================== PRICING ENDPOINT ====================
 
+PRICING_INFO = {
+    "print_small": PRINT_PRICE_SMALL,
+    "print_large": PRINT_PRICE_LARGE,
+    "embroidery": EMBROIDERY_PRICE,
+    "personalization": PERSONALIZATION_PRICE,
+    "shipping": SHIPPING_COST,
+    "free_shipping_threshold": FREE_SHIPPING_THRESHOLD,
+    "large_print_areas": LARGE_PRINT_AREAS,
+    "currency": "NOK",
+    "vat_rate": 0.25,
+    "prices_exclude_vat": True
+}
+PRICING_ETAG = make_etag('pricing', json.dumps(PRICING_INFO, sort_keys=True))
+
 @api_router.get("/pricing/info")
-async def get_pricing_info():
+async def get_pricing_info(request: Request, response: Response):
     """Get current pricing information"""
-    return {
-        "print_small": PRINT_PRICE_SMALL,
-        "print_large": PRINT_PRICE_LARGE,
-        "embroidery": EMBROIDERY_PRICE,
-        "shipping": SHIPPING_COST,
-        "free_shipping_threshold": FREE_SHIPPING_THRESHOLD,
-        "large_print_areas": LARGE_PRINT_AREAS,
-        "currency": "NOK",
-        "vat_rate": 0.25,
-        "prices_exclude_vat": True
-    }
+    not_modified = conditional(request, response, PRICING_ETAG, 'pricing')
+    if not_modified:
+        return not_modified
+    return PRICING_INFO
 
 @api_router.post("/pricing/calculate")
 async def calculate_pricing(
@@ -920,57 +1445,7 @@ async def calculate_pricing(
 
 # ==================== VIPPS PAYMENT ENDPOINTS ====================
 
-import httpx
-import time
-
-# Vipps Token Manager
-class VippsTokenManager:
-    def __init__(self):
-        self.access_token: Optional[str] = None
-        self.token_expires_at: float = 0
-    
-    async def get_access_token(self) -> str:
-        """Get a valid access token, requesting a new one if expired."""
-        current_time = time.time()
-        
-        # Return cached token if still valid (with 60-second buffer)
-        if self.access_token and current_time < (self.token_expires_at - 60):
-            return self.access_token
-        
-        vipps_client_id = os.environ.get('VIPPS_CLIENT_ID')
-        vipps_client_secret = os.environ.get('VIPPS_CLIENT_SECRET')
-        vipps_subscription_key = os.environ.get('VIPPS_SUBSCRIPTION_KEY')
-        vipps_msn = os.environ.get('VIPPS_MSN')
-        vipps_api_url = os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no')
-        
-        if not all([vipps_client_id, vipps_client_secret, vipps_subscription_key, vipps_msn]):
-            raise HTTPException(status_code=500, detail="Vipps er ikke konfigurert")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{vipps_api_url}/accesstoken/get",
-                headers={
-                    "Content-Type": "application/json",
-                    "client_id": vipps_client_id,
-                    "client_secret": vipps_client_secret,
-                    "Ocp-Apim-Subscription-Key": vipps_subscription_key,
-                    "Merchant-Serial-Number": vipps_msn,
-                    "Vipps-System-Name": "Firmaprint",
-                    "Vipps-System-Version": "1.0.0",
-                },
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Vipps token error: {response.text}")
-                raise HTTPException(status_code=500, detail="Kunne ikke koble til Vipps")
-            
-            token_data = response.json()
-            self.access_token = token_data["access_token"]
-            self.token_expires_at = current_time + token_data["expires_in"]
-            
-            return self.access_token
-
-vipps_token_manager = VippsTokenManager()
+vipps = VippsClient(token_store=create_token_store(db))
 
 class VippsPaymentRequest(BaseModel):
     order_id: str
@@ -982,11 +1457,6 @@ class VippsPaymentRequest(BaseModel):
 async def initiate_vipps_payment(request: VippsPaymentRequest):
     """Initiate a Vipps payment"""
     try:
-        access_token = await vipps_token_manager.get_access_token()
-        vipps_api_url = os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no')
-        vipps_subscription_key = os.environ.get('VIPPS_SUBSCRIPTION_KEY')
-        vipps_msn = os.environ.get('VIPPS_MSN')
-        
         # Generate unique reference
         reference = f"fp-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
         
@@ -1004,43 +1474,30 @@ async def initiate_vipps_payment(request: VippsPaymentRequest):
             "paymentDescription": request.description
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{vipps_api_url}/epayment/v1/payments",
-                json=payment_payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {access_token}",
-                    "Ocp-Apim-Subscription-Key": vipps_subscription_key,
-                    "Merchant-Serial-Number": vipps_msn,
-                    "Idempotency-Key": str(uuid.uuid4()),
-                    "Vipps-System-Name": "Firmaprint",
-                    "Vipps-System-Version": "1.0.0",
-                },
-            )
-            
-            if response.status_code != 201:
-                logger.error(f"Vipps payment error: {response.text}")
-                raise HTTPException(status_code=400, detail="Kunne ikke opprette Vipps-betaling")
-            
-            payment_data = response.json()
-            
-            # Store payment info
-            await db.payment_transactions.insert_one({
-                'id': str(uuid.uuid4()),
-                'order_id': request.order_id,
-                'reference': reference,
-                'amount': request.amount,
-                'currency': 'NOK',
-                'payment_method': 'vipps',
-                'payment_status': 'CREATED',
-                'created_at': datetime.now(timezone.utc).isoformat()
-            })
-            
-            return {
-                "redirect_url": payment_data["redirectUrl"],
-                "payment_reference": reference
-            }
+        response = await vipps.create_payment(payment_payload)
+        if response.status_code != 201:
+            logger.error(f"Vipps payment error: {response.text}")
+            raise HTTPException(status_code=400, detail="Kunne ikke opprette Vipps-betaling")
+        
+        payment_data = response.json()
+        
+        # Store payment info
+        await db.payment_transactions.insert_one({
+            'id': str(uuid.uuid4()),
+            'order_id': request.order_id,
+            'reference': reference,
+            'amount': request.amount,
+            'currency': 'NOK',
+            'payment_method': 'vipps',
+            'payment_status': 'CREATED',
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'expires_at': payment_expiry(),
+        })
+        
+        return {
+            "redirect_url": payment_data["redirectUrl"],
+            "payment_reference": reference
+        }
     
     except HTTPException:
         raise
@@ -1052,42 +1509,23 @@ async def initiate_vipps_payment(request: VippsPaymentRequest):
 async def get_vipps_payment_status(reference: str):
     """Check the status of a Vipps payment"""
     try:
-        access_token = await vipps_token_manager.get_access_token()
-        vipps_api_url = os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no')
-        vipps_subscription_key = os.environ.get('VIPPS_SUBSCRIPTION_KEY')
-        vipps_msn = os.environ.get('VIPPS_MSN')
+        response = await vipps.get_payment(reference)
+        if response.status_code != 200:
+            raise HTTPException(status_code=404, detail="Betaling ikke funnet")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{vipps_api_url}/epayment/v1/payments/{reference}",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Ocp-Apim-Subscription-Key": vipps_subscription_key,
-                    "Merchant-Serial-Number": vipps_msn,
-                    "Vipps-System-Name": "Firmaprint",
-                    "Vipps-System-Version": "1.0.0",
-                },
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Betaling ikke funnet")
-            
-            payment_data = response.json()
-            
-            # Update payment status in DB
-            await db.payment_transactions.update_one(
-                {'reference': reference},
-                {'$set': {
-                    'payment_status': payment_data["state"],
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            return {
-                "status": payment_data["state"],
-                "authorized_amount": payment_data.get("aggregate", {}).get("authorizedAmount"),
-                "captured_amount": payment_data.get("aggregate", {}).get("capturedAmount"),
-            }
+        payment_data = response.json()
+        
+        # Update payment status in DB
+        await db.payment_transactions.update_one(
+            {'reference': reference},
+            payment_state_update(payment_data["state"], {'updated_at': datetime.now(timezone.utc).isoformat()})
+        )
+        
+        return {
+            "status": payment_data["state"],
+            "authorized_amount": payment_data.get("aggregate", {}).get("authorizedAmount"),
+            "captured_amount": payment_data.get("aggregate", {}).get("capturedAmount"),
+        }
     
     except HTTPException:
         raise
@@ -1104,11 +1542,6 @@ async def capture_vipps_payment(reference: str):
         if not payment:
             raise HTTPException(status_code=404, detail="Betaling ikke funnet")
         
-        access_token = await vipps_token_manager.get_access_token()
-        vipps_api_url = os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no')
-        vipps_subscription_key = os.environ.get('VIPPS_SUBSCRIPTION_KEY')
-        vipps_msn = os.environ.get('VIPPS_MSN')
-        
         capture_payload = {
             "modificationAmount": {
                 "currency": "NOK",
@@ -1116,44 +1549,29 @@ async def capture_vipps_payment(reference: str):
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{vipps_api_url}/epayment/v1/payments/{reference}/capture",
-                json=capture_payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {access_token}",
-                    "Ocp-Apim-Subscription-Key": vipps_subscription_key,
-                    "Merchant-Serial-Number": vipps_msn,
-                    "Idempotency-Key": str(uuid.uuid4()),
-                    "Vipps-System-Name": "Firmaprint",
-                    "Vipps-System-Version": "1.0.0",
-                },
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Vipps capture error: {response.text}")
-                raise HTTPException(status_code=400, detail="Kunne ikke fullføre betaling")
-            
-            capture_data = response.json()
-            
-            # Update payment status
-            await db.payment_transactions.update_one(
-                {'reference': reference},
-                {'$set': {
-                    'payment_status': 'CAPTURED',
-                    'captured_amount': capture_data["aggregate"]["capturedAmount"]["value"],
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            # Update order status
-            await db.orders.update_one(
-                {'vipps_reference': reference},
-                {'$set': {'payment_status': 'paid', 'status': 'processing'}}
-            )
-            
-            return {"success": True, "captured_amount": capture_data["aggregate"]["capturedAmount"]}
+        response = await vipps.capture_payment(reference, capture_payload)
+        if response.status_code != 200:
+            logger.error(f"Vipps capture error: {response.text}")
+            raise HTTPException(status_code=400, detail="Kunne ikke fullføre betaling")
+        
+        capture_data = response.json()
+        
+        # Update payment status
+        await db.payment_transactions.update_one(
+            {'reference': reference},
+            payment_state_update('CAPTURED', {
+                'captured_amount': capture_data["aggregate"]["capturedAmount"]["value"],
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            })
+        )
+        
+        # Update order status
+        await db.orders.update_one(
+            {'vipps_reference': reference},
+            {'$set': {'payment_status': 'paid', 'status': 'processing'}}
+        )
+        
+        return {"success": True, "captured_amount": capture_data["aggregate"]["capturedAmount"]}
     
     except HTTPException:
         raise
@@ -1161,6 +1579,81 @@ async def capture_vipps_payment(reference: str):
         logger.error(f"Vipps capture error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ==================== ADMIN ENDPOINTS ====================
+
+@api_router.get("/admin/metrics")
+async def get_metrics(user = Depends(require_user)):
+    """In-process metrics for this worker"""
+    if not user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Ikke tilgang")
+    return {
+        "password_hashing": password_hasher.stats(),
+        "user_cache": user_cache.stats(),
+        "cart_cache": cart_cache.stats(),
+        "catalog": catalog.stats(),
+        "search": search_latency.snapshot(),
+        "design_assets": design_assets.stats(),
+        "image_pool": image_pool.stats(),
+        "logo_derivatives": logo_derivatives.stats(),
+        "logo_analysis": logo_analyzer.stats(),
+        "order_sequence": order_sequence.stats(),
+        "checkout": {"stages": checkout_stats.stats(), "writer": order_writer.stats()},
+        "vipps": vipps.stats(),
+        "stripe": stripe_gateway.stats(),
+        "checkout_status": checkout_status_cache.stats(),
+        "webhook_inbox": webhook_inbox.stats(),
+        "retention": retention.stats(),
+    }
+
+@api_router.post("/admin/retention/sweep")
+async def run_retention_sweep(dry_run: bool = True, user = Depends(require_user)):
+    """Report (or with dry_run=false delete) unreferenced logos and design assets past retention"""
+    if not user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Ikke tilgang")
+    return await retention.sweep(dry_run=dry_run)
+
+@api_router.get("/admin/indexes/audit")
+async def audit_indexes(user = Depends(require_user)):
+    """Explain every known query shape and flag collection scans"""
+    if not user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Ikke tilgang")
+    report = await audit_queries(db)
+    return {"collscans": sum(1 for r in report if r['collscan']), "queries": report}
+
+@api_router.get("/admin/orders/{order_id}/designs")
+async def get_order_designs(order_id: str, user = Depends(require_user)):
+    """Order lines with their logo pixels resolved, for production"""
+    if not user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Ikke tilgang")
+    order = await db.orders.find_one({'id': order_id}, {'_id': 0, 'order_number': 1, 'items': 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Ordre ikke funnet")
+    
+    lines = [item for item in order['items'] if item.get('design')]
+    hashes = {h for item in lines for h in (item['design'].get('logo_asset'), item['design'].get('preview_asset')) if h}
+    resolved = {h: await design_assets.resolve_data_url(h) for h in hashes}
+    for item in lines:
+        design = item['design']
+        if design.get('logo_asset'):
+            design['logo_url'] = resolved[design['logo_asset']] or design['logo_url']
+        if design.get('preview_asset'):
+            design['logo_preview'] = resolved[design['preview_asset']] or design['logo_preview']
+    return {"order_number": order['order_number'], "items": lines}
+
+class DiscountTierUpdate(BaseModel):
+    discount_tier: int = Field(ge=0)
+
+@api_router.put("/admin/users/{user_id}/discount-tier", response_model=UserResponse)
+async def set_discount_tier(user_id: str, update: DiscountTierUpdate, user = Depends(require_user)):
+    """Change a customer's discount tier"""
+    if not user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Ikke tilgang")
+    result = await update_user(user_id, {'discount_tier': update.discount_tier})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Bruker ikke funnet")
+    updated = await load_user(user_id)
+    return UserResponse(**updated)
+
 # ==================== SEED DATA ====================
 
 @api_router.post("/seed")
@@ -1181,6 +1674,9 @@ async def seed_database():
     
     await db.products.insert_many(products_with_ids)
     
+    # Tell every worker to reload its catalog snapshot
+    await catalog.bump_version()
+    
     return {"message": f"Lagt til {len(products_with_ids)} Tracker-produkter", "count": len(products_with_ids)}
 
 # Root endpoint
@@ -1200,6 +1696,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_workers():
+    password_hasher.start()
+    try:
+        await apply_indexes(db)
+    except Exception as e:
+        logger.error(f"Index setup failed: {e}")
+    try:
+        migrated = await retention.migrate_dates()
+        if any(migrated.values()):
+            logger.info(f"Converted legacy dates for TTL expiry: {migrated}")
+        backfilled = await retention.backfill_logo_ids()
+        if backfilled and any(backfilled.values()):
+            logger.info(f"Recorded logo ids on legacy cart/order lines: {backfilled}")
+    except Exception as e:
+        logger.error(f"Retention migration failed: {e}")
+    retention.start()
+    try:
+        await catalog.load()
+    except Exception as e:
+        logger.error(f"Catalog load failed, will retry on first request: {e}")
+    catalog.start()
+    await vipps.start()
+    await stripe_gateway.start()
+    webhook_inbox.start()
+    logo_derivatives.start()
+    try:
+        resumed = await logo_derivatives.resume()
+        if resumed:
+            logger.info(f"Resumed {resumed} pending logo derivative jobs")
+    except Exception as e:
+        logger.error(f"Could not resume logo derivative jobs: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await catalog.stop()
+    await logo_derivatives.stop()
+    await vipps.close()
+    await stripe_gateway.close()
+    await webhook_inbox.stop()
+    await retention.stop()
+    image_pool.shutdown()
+    password_hasher.shutdown()
     client.close()
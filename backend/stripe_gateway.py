@@ -0,0 +1,232 @@
+"""
+Stripe checkout gateway
+One gateway is created at import, warmed up at app startup (the
+emergentintegrations/stripe imports, the SDK's pooled HTTP client and the
+checkout client itself) and injected into the checkout handlers with
+Depends(get_stripe_gateway). STRIPE_GATEWAY=fake swaps in an in-memory
+gateway for local runs and benchmarks; tests can also use
+app.dependency_overrides.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutSession(BaseModel):
+    session_id: str
+    url: str
+
+
+class CheckoutStatus(BaseModel):
+    # Extra fields from the provider are passed through to the API response unchanged
+    model_config = ConfigDict(extra='allow')
+
+    status: Optional[str] = None
+    payment_status: Optional[str] = None
+    amount_total: Optional[int] = None  # minor units (øre), as Stripe reports it
+    currency: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+
+class WebhookEvent(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    event_type: Optional[str] = None
+    event_id: Optional[str] = None
+    session_id: Optional[str] = None
+    payment_status: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+
+def _as_dict(result: Any) -> dict:
+    return result.model_dump() if hasattr(result, 'model_dump') else dict(vars(result))
+
+
+class StripeGateway(ABC):
+    """Interface used by the checkout handlers; subclasses implement the _-prefixed calls"""
+
+    name = 'base'
+
+    def __init__(self):
+        self._latency: Dict[str, LatencyStats] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def _timed(self, op: str, call):
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            self._latency.setdefault(op, LatencyStats()).observe((time.perf_counter() - started) * 1000)
+
+    async def create_checkout_session(self, amount: float, currency: str, success_url: str, cancel_url: str,
+                                      metadata: Dict[str, str], webhook_url: str = '') -> CheckoutSession:
+        return await self._timed('create_checkout_session', self._create_checkout_session(
+            amount, currency, success_url, cancel_url, metadata, webhook_url
+        ))
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        return await self._timed('get_checkout_status', self._get_checkout_status(session_id))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        return await self._timed('handle_webhook', self._handle_webhook(body, signature))
+
+    @abstractmethod
+    async def _create_checkout_session(self, amount, currency, success_url, cancel_url, metadata,
+                                       webhook_url) -> CheckoutSession:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _handle_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {
+            'gateway': self.name,
+            'requests': {op: stats.snapshot() for op, stats in self._latency.items()},
+        }
+
+
+class EmergentStripeGateway(StripeGateway):
+    """Stripe Checkout through emergentintegrations, with clients reused across requests"""
+
+    name = 'stripe'
+
+    def __init__(self, api_key: Optional[str]):
+        super().__init__()
+        self.api_key = api_key
+        self._checkout = None
+        self._clients: Dict[str, Any] = {}
+
+    def _module(self):
+        if self._checkout is None:
+            try:
+                from emergentintegrations.payments.stripe import checkout
+            except ImportError as e:
+                logger.error(f"Stripe integration unavailable: {e}")
+                raise HTTPException(status_code=500, detail="Kortbetaling er ikke tilgjengelig")
+            self._checkout = checkout
+            _pool_stripe_connections()
+        return self._checkout
+
+    def _client(self, webhook_url: str = ''):
+        # The webhook URL only varies with the public host, so in practice there are one or two clients
+        client = self._clients.get(webhook_url)
+        if client is None:
+            client = self._module().StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+            self._clients[webhook_url] = client
+        return client
+
+    async def start(self) -> None:
+        """Pay the import and client setup cost at startup instead of on the first checkout"""
+        try:
+            self._client()
+        except HTTPException:
+            pass  # logged in _module(); checkouts will fail with the same error
+
+    async def _create_checkout_session(self, amount, currency, success_url, cancel_url, metadata,
+                                       webhook_url) -> CheckoutSession:
+        client = self._client(webhook_url)
+        request = self._module().CheckoutSessionRequest(
+            amount=amount, currency=currency, success_url=success_url, cancel_url=cancel_url, metadata=metadata,
+        )
+        session = await client.create_checkout_session(request)
+        return CheckoutSession(session_id=session.session_id, url=session.url)
+
+    async def _get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        return CheckoutStatus(**_as_dict(await self._client().get_checkout_status(session_id)))
+
+    async def _handle_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        return WebhookEvent(**_as_dict(await self._client().handle_webhook(body, signature)))
+
+
+def _pool_stripe_connections() -> None:
+    """Create the stripe SDK's module-level HTTP client now so every call reuses its keep-alive session"""
+    try:
+        import stripe
+        if getattr(stripe, 'default_http_client', None) is None:
+            stripe.default_http_client = stripe.RequestsClient()
+    except Exception as e:
+        logger.warning(f"Could not set up pooled Stripe HTTP client: {e}")
+
+
+class FakeStripeGateway(StripeGateway):
+    """In-memory stand-in: sessions redirect straight to the success URL and are paid via webhook or mark_paid()"""
+
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.0, auto_pay: bool = False):
+        super().__init__()
+        self.latency = latency
+        self.auto_pay = auto_pay
+        self.sessions: Dict[str, dict] = {}
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def mark_paid(self, session_id: str) -> None:
+        self.sessions[session_id]['payment_status'] = 'paid'
+
+    async def _create_checkout_session(self, amount, currency, success_url, cancel_url, metadata,
+                                       webhook_url) -> CheckoutSession:
+        await self._delay()
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            'amount_total': round(amount * 100),
+            'currency': currency,
+            'metadata': dict(metadata),
+            'payment_status': 'paid' if self.auto_pay else 'unpaid',
+        }
+        return CheckoutSession(session_id=session_id, url=success_url.replace('{CHECKOUT_SESSION_ID}', session_id))
+
+    async def _get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        await self._delay()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Betalingsøkt ikke funnet")
+        status = 'complete' if session['payment_status'] == 'paid' else 'open'
+        return CheckoutStatus(status=status, **session)
+
+    async def _handle_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        """Accepts unsigned Stripe-shaped events: {"id", "type", "data": {"object": {"id", ...}}}"""
+        event = json.loads(body)
+        session = event['data']['object']
+        if event['type'] == 'checkout.session.completed' and session['id'] in self.sessions:
+            self.mark_paid(session['id'])
+        return WebhookEvent(
+            event_type=event['type'],
+            event_id=event['id'],
+            session_id=session['id'],
+            payment_status=session.get('payment_status'),
+            metadata=session.get('metadata') or {},
+        )
+
+
+def create_stripe_gateway(kind: Optional[str] = None) -> StripeGateway:
+    kind = kind or os.environ.get('STRIPE_GATEWAY', 'stripe')
+    if kind == 'fake':
+        return FakeStripeGateway(latency=float(os.environ.get('STRIPE_FAKE_LATENCY', '0')))
+    if kind == 'stripe':
+        return EmergentStripeGateway(os.environ.get('STRIPE_API_KEY'))
+    raise ValueError(f"Unknown STRIPE_GATEWAY: {kind}")
@@ -0,0 +1,89 @@
+"""
+Bounded in-process TTL/LRU cache
+Per-worker cache with expiry, least-recently-used eviction, negative
+caching of unknown keys and hit/miss counters. With max_bytes and a sizeof
+function the cache is also bounded by the approximate size of its values.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value); a negatively cached key is found with value None."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(key)
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, value
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof and value is not None else 0
+        self._pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # never worth evicting everything else for
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, size)
+        self.bytes += size
+        while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def set_missing(self, key: Hashable) -> None:
+        self.set(key, None, ttl=self.negative_ttl)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._pop(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
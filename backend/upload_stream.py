@@ -0,0 +1,179 @@
+"""
+Streaming multipart uploads
+Parses a multipart/form-data body with python-multipart's push parser as it
+arrives from request.stream(), instead of letting Starlette spool the whole
+body first. The size limit is enforced on the bytes actually received (a
+missing or false Content-Length changes nothing), and the file part is
+handed on chunk by chunk so it can be hashed and stored while it uploads.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Dict, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_FIELD_BYTES = 64 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries, part headers and small text fields
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadError(Exception):
+    """Malformed or unexpected multipart body"""
+
+
+@dataclass
+class FilePart:
+    filename: str
+    content_type: str
+
+
+class MultipartStream:
+    """
+    One multipart request body, read once. open_file() reads up to the file
+    part's headers, file_chunks() yields its bytes and finish() reads the rest;
+    text fields seen on the way are collected in .fields.
+    """
+
+    def __init__(self, request, max_bytes: int, file_field: str = 'file', max_fields: int = 10):
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or not params.get(b'boundary'):
+            raise UploadError("expected multipart/form-data with a boundary")
+        self.max_bytes = max_bytes
+        self.file_field = file_field
+        self.max_fields = max_fields
+        self.received = 0
+        self.fields: Dict[str, str] = {}
+        self.file: Optional[FilePart] = None
+        self._body = request.stream().__aiter__()
+        self._chunks: deque = deque()
+        self._in_file = False
+        self._file_done = False
+        self._ended = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._field_name: Optional[str] = None
+        self._field_value = bytearray()
+        self._parser = MultipartParser(params[b'boundary'], callbacks={
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+            'on_end': self._on_end,
+        })
+
+    # ---- parser callbacks ----
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b''
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        name = options.get(b'name', b'').decode('utf-8', 'replace')
+        if b'filename' in options:
+            if name != self.file_field or self.file is not None:
+                raise UploadError("unexpected file part")
+            content_type, _ = parse_options_header(self._headers.get(b'content-type', b''))
+            self.file = FilePart(options[b'filename'].decode('utf-8', 'replace'), content_type.decode('latin-1'))
+            self._in_file = True
+            return
+        if len(self.fields) >= self.max_fields:
+            raise UploadError("too many form fields")
+        self._field_name = name
+        self._field_value = bytearray()
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._chunks.append(bytes(data[start:end]))
+            return
+        self._field_value += data[start:end]
+        if len(self._field_value) > MAX_FIELD_BYTES:
+            raise UploadTooLarge(f"form field exceeds {MAX_FIELD_BYTES} bytes")
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+        elif self._field_name is not None:
+            self.fields[self._field_name] = self._field_value.decode('utf-8', 'replace')
+            self._field_name = None
+
+    def _on_end(self) -> None:
+        self._ended = True
+
+    # ---- reading ----
+
+    async def _feed(self) -> bool:
+        """Parse the next piece of the body; False once it is exhausted"""
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            if not self._ended:
+                raise UploadError("incomplete multipart body")
+            return False
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            raise UploadTooLarge(f"request body exceeds {self.max_bytes} bytes")
+        if chunk:
+            self._parser.write(chunk)
+        return True
+
+    async def open_file(self) -> Optional[FilePart]:
+        """Read until the file part's headers; None if the body has no file part"""
+        while self.file is None and await self._feed():
+            pass
+        return self.file
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        """The file part's bytes as they arrive (call open_file() first)"""
+        while True:
+            while self._chunks:
+                yield self._chunks.popleft()
+            if self._file_done or not await self._feed():
+                return
+
+    async def finish(self) -> Dict[str, str]:
+        """Read (and discard any file bytes in) the rest of the body; returns the text fields"""
+        while await self._feed():
+            self._chunks.clear()
+        return self.fields
+
+
+async def spool(chunks: AsyncIterator[bytes], max_bytes: int) -> SpooledTemporaryFile:
+    """Collect chunks into a temporary file (in memory up to 1MB), rewound for reading"""
+    loop = asyncio.get_running_loop()
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"file exceeds {max_bytes} bytes")
+            await loop.run_in_executor(None, spooled.write, chunk)
+        spooled.seek(0)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled
@@ -0,0 +1,359 @@
+"""
+Vipps ePayment client
+Settings are read from the environment once, headers are prebuilt, and all
+calls share one pooled keep-alive httpx client (HTTP/2 when VIPPS_HTTP2 is
+set and h2 is installed) that the app opens at startup and closes at
+shutdown.
+
+The access token is fetched single-flight (concurrent callers await one
+request) and refreshed in the background before it expires. With
+VIPPS_TOKEN_STORE=mongo or =file the token is shared between API processes,
+so a deployment with several uvicorn workers fetches it roughly once.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+import orjson
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# A cached token is not handed out in its last TOKEN_EXPIRY_MARGIN seconds
+TOKEN_EXPIRY_MARGIN = 60
+DEFAULT_TOKEN_FILE = str(Path(tempfile.gettempdir()) / 'firmaprint-vipps-token.json')
+TOKEN_RETRY_DELAY = 30.0
+
+
+@dataclass(frozen=True)
+class VippsSettings:
+    client_id: Optional[str]
+    client_secret: Optional[str]
+    subscription_key: Optional[str]
+    msn: Optional[str]
+    api_url: str = 'https://apitest.vipps.no'
+    http2: bool = False
+    connect_timeout: float = 3.0
+    read_timeout: float = 10.0
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 30.0
+    token_store: str = ''  # '', mongo or file
+    token_file: str = DEFAULT_TOKEN_FILE
+    # The background refresh runs this long (plus jitter) before expiry
+    token_refresh_ahead: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> 'VippsSettings':
+        return cls(
+            client_id=os.environ.get('VIPPS_CLIENT_ID'),
+            client_secret=os.environ.get('VIPPS_CLIENT_SECRET'),
+            subscription_key=os.environ.get('VIPPS_SUBSCRIPTION_KEY'),
+            msn=os.environ.get('VIPPS_MSN'),
+            api_url=os.environ.get('VIPPS_API_URL', 'https://apitest.vipps.no'),
+            http2=os.environ.get('VIPPS_HTTP2', '').lower() in ('1', 'true', 'yes'),
+            connect_timeout=float(os.environ.get('VIPPS_CONNECT_TIMEOUT', '3')),
+            read_timeout=float(os.environ.get('VIPPS_READ_TIMEOUT', '10')),
+            max_connections=int(os.environ.get('VIPPS_MAX_CONNECTIONS', '20')),
+            max_keepalive=int(os.environ.get('VIPPS_MAX_KEEPALIVE', '10')),
+            keepalive_expiry=float(os.environ.get('VIPPS_KEEPALIVE_EXPIRY', '30')),
+            token_store=os.environ.get('VIPPS_TOKEN_STORE', ''),
+            token_file=os.environ.get('VIPPS_TOKEN_FILE', DEFAULT_TOKEN_FILE),
+            token_refresh_ahead=float(os.environ.get('VIPPS_TOKEN_REFRESH_AHEAD', '300')),
+        )
+
+    @property
+    def configured(self) -> bool:
+        return all([self.client_id, self.client_secret, self.subscription_key, self.msn])
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class MongoTokenStore:
+    """Token shared by all API processes through one document"""
+
+    def __init__(self, db, key: str = 'vipps_access_token'):
+        self.collection = db.service_tokens
+        self.key = key
+
+    async def load(self) -> Optional[Tuple[str, float]]:
+        doc = await self.collection.find_one({'_id': self.key})
+        return (doc['token'], doc['expires_at']) if doc else None
+
+    async def save(self, token: str, expires_at: float) -> None:
+        # Never replace a token with one that expires sooner
+        try:
+            await self.collection.update_one(
+                {'_id': self.key, 'expires_at': {'$lt': expires_at}},
+                {'$set': {'token': token, 'expires_at': expires_at}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass  # the stored token is newer
+
+
+class FileTokenStore:
+    """Token shared by the workers on one host through a private file"""
+
+    def __init__(self, path: str = DEFAULT_TOKEN_FILE):
+        self.path = Path(path)
+
+    async def load(self) -> Optional[Tuple[str, float]]:
+        try:
+            data = json.loads(self.path.read_text())
+            return data['token'], float(data['expires_at'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    async def save(self, token: str, expires_at: float) -> None:
+        current = await self.load()
+        if current and current[1] >= expires_at:
+            return
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix='.vipps-token-')
+        with os.fdopen(fd, 'w') as fh:  # mkstemp creates the file with mode 0600
+            json.dump({'token': token, 'expires_at': expires_at}, fh)
+        os.replace(tmp_name, self.path)
+
+
+def create_token_store(db, settings: Optional[VippsSettings] = None):
+    settings = settings or VippsSettings.from_env()
+    if settings.token_store == 'mongo':
+        return MongoTokenStore(db)
+    if settings.token_store == 'file':
+        return FileTokenStore(settings.token_file)
+    if settings.token_store:
+        raise ValueError(f"Unknown VIPPS_TOKEN_STORE: {settings.token_store}")
+    return None
+
+
+class VippsTokenManager:
+    def __init__(self, vipps: 'VippsClient', store=None):
+        self.vipps = vipps
+        self.store = store
+        self.refresh_ahead = vipps.settings.token_refresh_ahead
+        self.access_token: Optional[str] = None
+        self.token_expires_at: float = 0
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self._token_changed = asyncio.Event()
+        self._fetched_at: Deque[float] = deque()
+        self.fetches = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def _valid(self, margin: float = TOKEN_EXPIRY_MARGIN) -> bool:
+        return bool(self.access_token) and time.time() < self.token_expires_at - margin
+
+    async def get_access_token(self) -> str:
+        """Get a valid access token; concurrent callers share one fetch."""
+        if self._valid():
+            return self.access_token
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._obtain())
+            self._inflight.add_done_callback(self._clear_inflight)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, task: asyncio.Task) -> None:
+        if self._inflight is task:
+            self._inflight = None
+
+    async def _obtain(self, margin: float = TOKEN_EXPIRY_MARGIN) -> str:
+        # Another process may already have refreshed it
+        if self.store is not None:
+            shared = await self.store.load()
+            if shared and shared[1] - margin > max(time.time(), self.token_expires_at - margin):
+                self.access_token, self.token_expires_at = shared
+                self.shared_hits += 1
+                self._token_changed.set()
+                return self.access_token
+        return await self._fetch()
+
+    async def _fetch(self) -> str:
+        if not self.vipps.settings.configured:
+            raise HTTPException(status_code=500, detail="Vipps er ikke konfigurert")
+
+        current_time = time.time()
+        response = await self.vipps.client.post('/accesstoken/get', headers=self.vipps.token_headers)
+        if response.status_code != 200:
+            logger.error(f"Vipps token error: {response.text}")
+            raise HTTPException(status_code=500, detail="Kunne ikke koble til Vipps")
+
+        token_data = response.json()
+        self.access_token = token_data["access_token"]
+        self.token_expires_at = current_time + token_data["expires_in"]
+        self.fetches += 1
+        self._fetched_at.append(current_time)
+        self._token_changed.set()
+        if self.store is not None:
+            try:
+                await self.store.save(self.access_token, self.token_expires_at)
+            except Exception as e:
+                logger.warning(f"Could not share Vipps token: {e}")
+        return self.access_token
+
+    def _refresh_delay(self) -> Optional[float]:
+        if not self.access_token:
+            return None  # nothing to refresh until the first payment call
+        lifetime_left = self.token_expires_at - time.time()
+        ahead = min(self.refresh_ahead, lifetime_left / 2)
+        # Jitter so several workers sharing a store do not all refresh at once
+        return max(lifetime_left - ahead - random.uniform(0, ahead / 5), 0.0)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                # A new token (fetched on demand or adopted from the store) reschedules the refresh
+                await asyncio.wait_for(self._token_changed.wait(), timeout=self._refresh_delay())
+                self._token_changed.clear()
+                continue
+            except asyncio.TimeoutError:
+                pass
+            try:
+                if self._inflight is None:
+                    # Anything that would not outlive the refresh window counts as stale
+                    self._inflight = asyncio.ensure_future(self._obtain(margin=self.refresh_ahead / 2))
+                    self._inflight.add_done_callback(self._clear_inflight)
+                await asyncio.shield(self._inflight)
+            except Exception as e:
+                logger.warning(f"Proactive Vipps token refresh failed: {e}")
+                await asyncio.sleep(TOKEN_RETRY_DELAY)
+
+    def start(self) -> None:
+        if self._refresher is None and self.vipps.settings.configured:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def fetches_last_hour(self) -> int:
+        cutoff = time.time() - 3600
+        while self._fetched_at and self._fetched_at[0] < cutoff:
+            self._fetched_at.popleft()
+        return len(self._fetched_at)
+
+    def stats(self) -> dict:
+        return {
+            'fetches': self.fetches,
+            'fetches_last_hour': self.fetches_last_hour(),
+            'coalesced': self.coalesced,
+            'shared_hits': self.shared_hits,
+            'expires_in': max(int(self.token_expires_at - time.time()), 0) if self.access_token else None,
+            'store': type(self.store).__name__ if self.store is not None else None,
+        }
+
+
+class VippsClient:
+    def __init__(self, settings: Optional[VippsSettings] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, token_store=None):
+        self.settings = settings or VippsSettings.from_env()
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        system_headers = {
+            "Ocp-Apim-Subscription-Key": self.settings.subscription_key or '',
+            "Merchant-Serial-Number": self.settings.msn or '',
+            "Vipps-System-Name": "Firmaprint",
+            "Vipps-System-Version": "1.0.0",
+        }
+        self.token_headers: Dict[str, str] = {
+            **system_headers,
+            "Content-Type": "application/json",
+            "client_id": self.settings.client_id or '',
+            "client_secret": self.settings.client_secret or '',
+        }
+        self._api_headers: Dict[str, str] = system_headers
+        self._json_headers: Dict[str, str] = {**system_headers, "Content-Type": "application/json"}
+        self.tokens = VippsTokenManager(self, token_store)
+        self._latency: Dict[str, LatencyStats] = {}
+
+    async def start(self) -> None:
+        """Open the connection pool and start the token refresher (called at app startup)"""
+        _ = self.client
+        self.tokens.start()
+
+    async def close(self) -> None:
+        await self.tokens.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client; opened at app startup, or lazily outside the lifespan (scripts, tests)"""
+        if self._client is None:
+            http2 = self.settings.http2 and _http2_available()
+            if self.settings.http2 and not http2:
+                logger.warning("VIPPS_HTTP2 is set but h2 is not installed; using HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                base_url=self.settings.api_url,
+                http2=http2,
+                timeout=httpx.Timeout(self.settings.read_timeout, connect=self.settings.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.settings.max_connections,
+                    max_keepalive_connections=self.settings.max_keepalive,
+                    keepalive_expiry=self.settings.keepalive_expiry,
+                ),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def request(self, op: str, method: str, path: str, payload: Optional[dict] = None,
+                      idempotent: bool = False) -> httpx.Response:
+        """Authorised ePayment API call; the caller checks the status code"""
+        access_token = await self.tokens.get_access_token()
+        headers = dict(self._json_headers if payload is not None else self._api_headers)
+        headers["Authorization"] = f"Bearer {access_token}"
+        if idempotent:
+            headers["Idempotency-Key"] = str(uuid.uuid4())
+        started = time.perf_counter()
+        try:
+            return await self.client.request(
+                method, path, headers=headers,
+                content=orjson.dumps(payload) if payload is not None else None,
+            )
+        finally:
+            self._latency.setdefault(op, LatencyStats()).observe((time.perf_counter() - started) * 1000)
+
+    async def create_payment(self, payload: dict) -> httpx.Response:
+        return await self.request('create_payment', 'POST', '/epayment/v1/payments', payload, idempotent=True)
+
+    async def get_payment(self, reference: str) -> httpx.Response:
+        return await self.request('get_payment', 'GET', f'/epayment/v1/payments/{reference}')
+
+    async def capture_payment(self, reference: str, payload: dict) -> httpx.Response:
+        return await self.request(
+            'capture_payment', 'POST', f'/epayment/v1/payments/{reference}/capture', payload, idempotent=True
+        )
+
+    def stats(self) -> dict:
+        return {
+            'http2': bool(self._client and self.settings.http2 and _http2_available()),
+            'requests': {op: stats.snapshot() for op, stats in self._latency.items()},
+            'token': self.tokens.stats(),
+        }
@@ -0,0 +1,196 @@
+"""
+Payment webhook inbox
+Verified webhook events are appended to webhook_inbox keyed by the
+provider's event id and acknowledged straight away; retries of the same
+event hit the primary key and are dropped. A background worker leases
+pending events in batches and applies the resulting payment_transactions /
+orders updates with one bulk_write per collection. Updates only move
+documents that are not already paid, so replays never touch an order twice.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '100'))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', '5'))
+WEBHOOK_LEASE_SECONDS = 60
+WEBHOOK_MAX_ATTEMPTS = 5
+
+STATUS_PENDING = 'pending'
+STATUS_PROCESSED = 'processed'
+STATUS_FAILED = 'failed'
+
+
+class WebhookInbox:
+    def __init__(self, db, batch_size: int = WEBHOOK_BATCH_SIZE, poll_interval: float = WEBHOOK_POLL_INTERVAL):
+        self.collection = db.webhook_inbox
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed = 0
+        self.depth = 0
+        self.oldest_pending_seconds = 0.0
+        self._lag = LatencyStats()
+
+    async def record(self, provider: str, event) -> bool:
+        """Durably store a verified event; False if it was already received"""
+        event_id = event.event_id or f"{event.event_type}:{event.session_id}:{event.payment_status}"
+        try:
+            await self.collection.insert_one({
+                '_id': f"{provider}:{event_id}",
+                'provider': provider,
+                'event_type': event.event_type,
+                'session_id': event.session_id,
+                'payment_status': event.payment_status,
+                'status': STATUS_PENDING,
+                'attempts': 0,
+                'received_at': datetime.now(timezone.utc).isoformat(),
+            })
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.received += 1
+        self._wakeup.set()
+        return True
+
+    async def _claim(self) -> List[dict]:
+        """Lease a batch of pending events so other API processes skip them"""
+        now = datetime.now(timezone.utc)
+        unleased = {'status': STATUS_PENDING, '$or': [
+            {'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now.isoformat()}},
+        ]}
+        candidates = await self.collection.find(unleased, {'_id': 1}).sort('received_at', 1) \
+            .limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {**unleased, '_id': {'$in': [c['_id'] for c in candidates]}},
+            {'$set': {'lease_until': (now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)).isoformat(),
+                      'claimed_by': token}},
+        )
+        return await self.collection.find({'claimed_by': token, 'status': STATUS_PENDING}).to_list(self.batch_size)
+
+    async def _apply(self, events: List[dict]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        # One update per checkout session however many times its events were delivered
+        paid_sessions = list(dict.fromkeys(
+            e['session_id'] for e in events if e['provider'] == 'stripe' and e['payment_status'] == 'paid'
+            and e['session_id']
+        ))
+        if not paid_sessions:
+            return
+        transactions = [
+            UpdateOne({'session_id': sid, 'payment_status': {'$ne': 'paid'}},
+                      {'$set': {'payment_status': 'paid', 'updated_at': now}, '$unset': {'expires_at': ''}})
+            for sid in paid_sessions
+        ]
+        orders = [
+            UpdateOne({'stripe_session_id': sid, 'payment_status': {'$ne': 'paid'}},
+                      {'$set': {'payment_status': 'paid', 'status': 'processing'}})
+            for sid in paid_sessions
+        ]
+        await asyncio.gather(
+            self.db.payment_transactions.bulk_write(transactions, ordered=False),
+            self.db.orders.bulk_write(orders, ordered=False),
+        )
+
+    async def process_batch(self) -> int:
+        """Apply one batch of pending events; returns the number of events handled"""
+        events = await self._claim()
+        if not events:
+            return 0
+        ids = [e['_id'] for e in events]
+        try:
+            await self._apply(events)
+        except Exception as e:
+            logger.error(f"Webhook batch of {len(events)} failed: {e}")
+            # The lease is left to expire, which spaces out the retries
+            await self.collection.update_many(
+                {'_id': {'$in': ids}},
+                {'$inc': {'attempts': 1}, '$set': {'error': str(e) or type(e).__name__},
+                 '$unset': {'claimed_by': ''}},
+            )
+            result = await self.collection.update_many(
+                {'_id': {'$in': ids}, 'attempts': {'$gte': WEBHOOK_MAX_ATTEMPTS}},
+                {'$set': {'status': STATUS_FAILED}},
+            )
+            self.failed += result.modified_count
+            return len(events)
+        processed_at = datetime.now(timezone.utc)
+        await self.collection.update_many(
+            {'_id': {'$in': ids}},
+            # A real Date: the TTL index on processed_at drops applied events after WEBHOOK_RETENTION_DAYS
+            {'$set': {'status': STATUS_PROCESSED, 'processed_at': processed_at},
+             '$unset': {'lease_until': '', 'claimed_by': ''}},
+        )
+        for e in events:
+            self._lag.observe((processed_at - datetime.fromisoformat(e['received_at'])).total_seconds() * 1000)
+        self.processed += len(events)
+        self.batches += 1
+        return len(events)
+
+    async def _measure_backlog(self) -> None:
+        self.depth = await self.collection.count_documents({'status': STATUS_PENDING})
+        oldest = await self.collection.find_one({'status': STATUS_PENDING}, {'received_at': 1},
+                                                sort=[('received_at', 1)])
+        self.oldest_pending_seconds = round(
+            (datetime.now(timezone.utc) - datetime.fromisoformat(oldest['received_at'])).total_seconds(), 1
+        ) if oldest else 0.0
+
+    async def _work(self) -> None:
+        while True:
+            # Cleared before the batch so events recorded meanwhile wake the next round
+            self._wakeup.clear()
+            handled = 0
+            try:
+                handled = await self.process_batch()
+                await self._measure_backlog()
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            if handled < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'oldest_pending_seconds': self.oldest_pending_seconds,
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'processed': self.processed,
+            'batches': self.batches,
+            'failed': self.failed,
+            'lag': self._lag.snapshot(),
+        }
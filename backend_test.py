@@ -3,6 +3,7 @@
 import requests
 import sys
 import json
+import base64
 from datetime import datetime
 import uuid
 
@@ -88,6 +89,10 @@ class FirmaprintAPITester:
         """Test get specific product by slug"""
         return self.run_test("Get Product by Slug", "GET", "products/premium-t-skjorte", 200)
 
+    def test_product_search(self):
+        """Test full-text product search"""
+        return self.run_test("Product Search", "GET", "products/search?q=hoodie", 200)
+
     def test_user_registration(self):
         """Test user registration"""
         test_user_data = {
@@ -157,6 +162,12 @@ class FirmaprintAPITester:
         # This should return 404 since product doesn't exist, but tests the endpoint
         self.run_test("Add to Cart (Expected 404)", "POST", f"cart/{self.session_id}/add", 404, add_item_data)
         
+        matrix_data = {
+            "product_id": "test-product-id",
+            "rows": [{"variant_color": "Sort", "quantities": {"S": 10, "M": 20, "L": 0}}]
+        }
+        self.run_test("Add Size Matrix to Cart (Expected 404)", "POST", f"cart/{self.session_id}/add-matrix", 404, matrix_data)
+        
         return True, {}
 
     def test_contact_form(self):
@@ -216,6 +227,73 @@ class FirmaprintAPITester:
         self.tests_run += 1
         return True, {}
 
+    def test_logo_raw_download(self):
+        """Test raw logo download with Range support"""
+        print("\n🔍 Testing Raw Logo Download...")
+        png = base64.b64decode(
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+        )
+        try:
+            upload = requests.post(
+                f"{self.base_url}/upload/logo", files={'file': ('logo.png', png, 'image/png')}, timeout=30
+            )
+            logo_id = upload.json()['id']
+            url = f"{self.base_url}/logos/{logo_id}/raw"
+            full = requests.get(url, timeout=30)
+            partial = requests.get(url, headers={'Range': 'bytes=0-3'}, timeout=30)
+            cached = requests.get(url, headers={'If-None-Match': full.headers.get('ETag', '')}, timeout=30)
+            if (full.status_code == 200 and full.content == png
+                    and partial.status_code == 206 and partial.content == png[:4]
+                    and cached.status_code == 304):
+                print("✅ Raw logo download supports Range and ETag")
+                self.tests_passed += 1
+            else:
+                print(f"❌ Unexpected responses: {full.status_code}, {partial.status_code}, {cached.status_code}")
+                self.failed_tests.append({
+                    'name': 'Raw Logo Download',
+                    'expected': (200, 206, 304),
+                    'actual': (full.status_code, partial.status_code, cached.status_code)
+                })
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            self.failed_tests.append({
+                'name': 'Raw Logo Download',
+                'error': str(e)
+            })
+        
+        self.tests_run += 1
+        return True, {}
+
+    def test_roster_import(self):
+        """Test employee roster import (dry run, unknown product is reported per row)"""
+        print("\n🔍 Testing Roster Import...")
+        roster = "Produkt;Farge;Størrelse;Navn\nfinnes-ikke;Sort;M;Kari Nordmann\n".encode('utf-8')
+        try:
+            response = requests.post(
+                f"{self.base_url}/cart/{self.session_id}/import-roster?dry_run=true",
+                files={'file': ('ansatte.csv', roster, 'text/csv')}, timeout=30
+            )
+            result = response.json()
+            if response.status_code == 200 and result.get('error_count') == 1 and result['errors'][0]['row'] == 2:
+                print("✅ Roster import reports invalid rows")
+                self.tests_passed += 1
+            else:
+                print(f"❌ Unexpected response: {response.status_code} {result}")
+                self.failed_tests.append({
+                    'name': 'Roster Import',
+                    'expected': 200,
+                    'actual': response.status_code
+                })
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            self.failed_tests.append({
+                'name': 'Roster Import',
+                'error': str(e)
+            })
+        
+        self.tests_run += 1
+        return True, {}
+
     def test_pricing_calculation(self):
         """Test pricing calculation"""
         return self.run_test(
@@ -237,6 +315,7 @@ class FirmaprintAPITester:
         self.test_get_products()
         self.test_get_featured_products()
         self.test_get_product_by_slug()
+        self.test_product_search()
         
         # Test authentication
         self.test_user_registration()
@@ -252,6 +331,8 @@ class FirmaprintAPITester:
         
         # Test file upload
         self.test_logo_upload()
+        self.test_logo_raw_download()
+        self.test_roster_import()
         
         # Test pricing
         self.test_pricing_calculation()
@@ -103,8 +103,23 @@ export const CartProvider = ({ children }) => {
     return res.data;
   };
 
-  const removeFromCart = async (index) => {
-    const res = await axios.delete(`${API}/cart/${sessionId}/item/${index}`);
+  const addMatrixToCart = async (matrix) => {
+    const res = await axios.post(`${API}/cart/${sessionId}/add-matrix`, matrix);
+    setCart(res.data);
+    return res.data;
+  };
+
+  const importRoster = async (file, design, dryRun = false) => {
+    const form = new FormData();
+    form.append('file', file);
+    if (design) form.append('design', JSON.stringify(design));
+    const res = await axios.post(`${API}/cart/${sessionId}/import-roster`, form, { params: { dry_run: dryRun } });
+    if (res.data.cart) setCart(res.data.cart);
+    return res.data;
+  };
+
+  const removeFromCart = async (lineId) => {
+    const res = await axios.delete(`${API}/cart/${sessionId}/item/${lineId}`);
     setCart(res.data);
     return res.data;
   };
@@ -117,7 +132,7 @@ export const CartProvider = ({ children }) => {
   const itemCount = cart.items?.reduce((sum, item) => sum + item.quantity, 0) || 0;
 
   return (
-    <CartContext.Provider value={{ cart, sessionId, loading, addToCart, removeFromCart, clearCart, fetchCart, itemCount }}>
+    <CartContext.Provider value={{ cart, sessionId, loading, addToCart, addMatrixToCart, importRoster, removeFromCart, clearCart, fetchCart, itemCount }}>
       {children}
     </CartContext.Provider>
   );
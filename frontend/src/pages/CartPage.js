@@ -7,13 +7,18 @@ import { Layout } from '../components/Layout';
 import { useCart } from '../context/AppContext';
 import { toast } from 'sonner';
 
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+
+// Design assets are stored server-side and referenced by a relative API path
+const assetSrc = (url) => (url?.startsWith('/api/') ? `${BACKEND_URL}${url}` : url);
+
 export const CartPage = () => {
   const { cart, removeFromCart, loading } = useCart();
   const navigate = useNavigate();
 
-  const handleRemove = async (index) => {
+  const handleRemove = async (lineId) => {
     try {
-      await removeFromCart(index);
+      await removeFromCart(lineId);
       toast.success('Vare fjernet fra handlekurven');
     } catch {
       toast.error('Kunne ikke fjerne varen');
@@ -63,13 +68,13 @@ export const CartPage = () => {
             {/* Cart items */}
             <div className="lg:col-span-2 space-y-4">
               {cart.items.map((item, index) => (
-                <Card key={index} className="p-4" data-testid={`cart-item-${index}`}>
+                <Card key={item.line_id || index} className="p-4" data-testid={`cart-item-${index}`}>
                   <div className="flex gap-4">
                     {/* Product image or design preview */}
                     <div className="w-24 h-24 bg-slate-100 rounded-lg overflow-hidden flex-shrink-0">
                       {item.design?.logo_preview ? (
                         <div className="w-full h-full relative">
-                          <img src={item.design.logo_preview} alt="Design" className="w-full h-full object-contain p-2" />
+                          <img src={assetSrc(item.design.logo_preview)} alt="Design" className="w-full h-full object-contain p-2" />
                         </div>
                       ) : (
                         <div className="w-full h-full bg-slate-200" />
@@ -87,6 +92,11 @@ export const CartPage = () => {
                           {item.design.print_method === 'embroidery' ? 'Brodering' : 'Trykk'} på {item.design.print_area}
                         </p>
                       )}
+                      {item.personalization?.length > 0 && (
+                        <p className="text-sm text-slate-500 truncate" title={item.personalization.map((p) => p.name).join(', ')}>
+                          Navnetrykk: {item.personalization.map((p) => p.name).join(', ')}
+                        </p>
+                      )}
                       <div className="flex items-center justify-between mt-3">
                         <div className="flex items-center gap-2">
                           <span className="text-sm text-slate-500">Antall: {item.quantity}</span>
@@ -107,7 +117,7 @@ export const CartPage = () => {
                       variant="ghost"
                       size="icon"
                       className="text-slate-400 hover:text-red-600 flex-shrink-0"
-                      onClick={() => handleRemove(index)}
+                      onClick={() => handleRemove(item.line_id)}
                       data-testid={`remove-item-${index}`}
                     >
                       <Trash2 className="w-4 h-4" />
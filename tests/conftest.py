@@ -0,0 +1,21 @@
+"""
+Timing checks are opt-in: tests marked benchmark only run with
+RUN_BENCHMARKS=1 (e.g. RUN_BENCHMARKS=1 python -m pytest -s -m benchmark tests),
+so wall-clock budgets never fail the default suite on a loaded machine.
+"""
+import os
+
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: wall-clock timing check, runs only with RUN_BENCHMARKS=1')
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get('RUN_BENCHMARKS', '').lower() in ('1', 'true', 'yes'):
+        return
+    skip = pytest.mark.skip(reason="timing check; set RUN_BENCHMARKS=1 to run")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
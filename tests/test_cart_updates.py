@@ -0,0 +1,135 @@
+"""
+Cart update pipelines: adding a line that is already in the cart replaces it
+instead of duplicating it, concurrent adds are all kept, totals and the
+free-shipping threshold are recomputed from the quantities, and removing a
+line that is not in the cart changes nothing. Needs a reachable MongoDB
+(MONGO_URL); skipped otherwise. A session without a cart gets the same cart id
+on every read.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'firmaprint_cart_test')
+
+from fastapi.testclient import TestClient  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import ReturnDocument  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+import server  # noqa: E402
+from cart_updates import cart_line_id, remove_line_pipeline, upsert_lines_pipeline  # noqa: E402
+
+SHIPPING_COST = 99.0
+FREE_SHIPPING_THRESHOLD = 2000.0
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_cart_test_{uuid.uuid4().hex[:8]}"]
+
+
+def line(size: str, quantity: int, base_price: float = 100.0, design_price: float = 0.0) -> dict:
+    return {
+        'line_id': cart_line_id('p-1', 'black', size), 'product_id': 'p-1', 'variant_color': 'black',
+        'size': size, 'quantity': quantity, 'base_price': base_price, 'design_price': design_price,
+        'total_price': (base_price + design_price) * quantity,
+    }
+
+
+async def upsert(db, session_id: str, lines: list) -> dict:
+    return await db.carts.find_one_and_update(
+        {'session_id': session_id},
+        upsert_lines_pipeline(lines, new_cart_id=str(uuid.uuid4()), now=datetime.now(timezone.utc),
+                              shipping_cost=SHIPPING_COST, free_shipping_threshold=FREE_SHIPPING_THRESHOLD),
+        projection={'_id': 0}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+
+
+async def remove(db, session_id: str, line_id: str, only_if_present: bool = True) -> dict:
+    query = {'session_id': session_id, 'items.line_id': line_id} if only_if_present else {'session_id': session_id}
+    return await db.carts.find_one_and_update(
+        query,
+        remove_line_pipeline(line_id, now=datetime.now(timezone.utc),
+                             shipping_cost=SHIPPING_COST, free_shipping_threshold=FREE_SHIPPING_THRESHOLD),
+        projection={'_id': 0}, return_document=ReturnDocument.AFTER,
+    )
+
+
+async def mutate(db):
+    await db.carts.create_index('session_id', unique=True)
+    first = await upsert(db, 's', [line('M', 2)])
+    merged = await upsert(db, 's', [line('M', 5), line('L', 1)])
+    await asyncio.gather(*(upsert(db, 's', [line(f'X{n}', 1, base_price=1.0)]) for n in range(10)))
+    concurrent = await db.carts.find_one({'session_id': 's'}, {'_id': 0})
+
+    below = await upsert(db, 'threshold', [line('M', 19, base_price=99.0, design_price=5.0)])  # 1976 kr
+    at = await upsert(db, 'threshold', [line('M', 20, base_price=95.0, design_price=5.0)])     # 2000 kr
+
+    missing = await remove(db, 'threshold', cart_line_id('p-1', 'black', 'XXL'))
+    unfiltered = await remove(db, 'threshold', cart_line_id('p-1', 'black', 'XXL'), only_if_present=False)
+    emptied = await remove(db, 'threshold', line('M', 1)['line_id'])
+    return first, merged, concurrent, below, at, missing, unfiltered, emptied
+
+
+def test_cart_pipelines_merge_lines_and_recompute_totals():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            return await mutate(db)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    first, merged, concurrent, below, at, missing, unfiltered, emptied = result
+
+    assert [i['quantity'] for i in first['items']] == [2]
+    assert first['subtotal'] == 200.0 and first['shipping'] == SHIPPING_COST and first['total'] == 299.0
+
+    # Same line_id replaces the line in place (the new quantity, not the sum); new lines are appended
+    assert [(i['size'], i['quantity']) for i in merged['items']] == [('M', 5), ('L', 1)]
+    assert merged['id'] == first['id']
+    assert merged['subtotal'] == 600.0 and merged['total'] == 699.0
+
+    assert len(concurrent['items']) == 12
+    assert concurrent['subtotal'] == 610.0
+
+    assert below['subtotal'] == 1881.0 and below['design_total'] == 95.0
+    assert below['shipping'] == SHIPPING_COST and below['total'] == 2075.0
+    assert len(at['items']) == 1
+    assert at['subtotal'] + at['design_total'] == FREE_SHIPPING_THRESHOLD
+    assert at['shipping'] == 0.0 and at['total'] == FREE_SHIPPING_THRESHOLD
+
+    assert missing is None
+    assert unfiltered['items'] == at['items'] and unfiltered['total'] == at['total']
+    assert emptied['items'] == []
+    assert emptied['subtotal'] == 0 and emptied['design_total'] == 0
+
+
+def test_virtual_cart_keeps_its_id_between_reads():
+    server.cart_cache.set_missing('no-cart-yet')  # as if Mongo had just said there is no cart
+    client = TestClient(server.app)
+    first, second = (client.get('/api/cart/no-cart-yet').json() for _ in range(2))
+    server.cart_cache.set_missing('another-session')
+    other = client.get('/api/cart/another-session').json()
+
+    assert first['items'] == [] and first['id'] == second['id'] == server.session_cart_id('no-cart-yet')
+    assert other['id'] != first['id']
@@ -0,0 +1,115 @@
+"""
+Keyset pagination over the in-memory catalog: paging with next_cursor visits
+every product exactly once in listing order (featured first, then price, slug
+breaking ties), also within a category and across a reseed that removes the
+cursor's product; tampered cursors are a 400; and the legacy skip/limit
+listing keeps the order products were loaded from Mongo in
+"""
+import base64
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'firmaprint_pagination_test')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from catalog import CatalogSnapshot, decode_cursor, encode_cursor, listing_key  # noqa: E402
+
+CATEGORIES = ['gensere', 't-skjorter', 'jakker']
+
+
+def catalog(size: int = 60, seed: int = 7):
+    """Few distinct prices and a featured mix, so ties are decided by featured and slug"""
+    rng = random.Random(seed)
+    products = [
+        {
+            'id': f"p{i}", 'slug': f"produkt-{rng.randrange(10_000):04d}-{i}", 'name': f"Produkt {i}",
+            'category': CATEGORIES[i % len(CATEGORIES)], 'base_price': rng.choice([99.0, 149.0, 199.0, 249.0]),
+            'featured': rng.random() < 0.3, 'print_methods': ['print'], 'variants': [],
+        }
+        for i in range(size)
+    ]
+    rng.shuffle(products)  # the load order is not the listing order
+    return products
+
+
+def traverse(snapshot: CatalogSnapshot, limit: int, cursor=None, **filters):
+    slugs = []
+    while True:
+        page, cursor = snapshot.page(cursor, limit=limit, **filters)
+        slugs.extend(p['slug'] for p in page)
+        if cursor is None:
+            return slugs
+
+
+def listing(products, **match):
+    ordered = sorted(products, key=listing_key)
+    return [p['slug'] for p in ordered if all(p.get(k) == v for k, v in match.items())]
+
+
+@pytest.mark.parametrize('limit', [1, 7, 60, 100])
+def test_traversal_visits_every_product_once_in_listing_order(limit):
+    products = catalog()
+    assert traverse(CatalogSnapshot(products, version=1), limit) == listing(products)
+
+
+def test_traversal_within_a_category():
+    products = catalog()
+    snapshot = CatalogSnapshot(products, version=1)
+    for category in CATEGORIES:
+        assert traverse(snapshot, 4, category=category) == listing(products, category=category)
+
+
+def test_cursor_survives_a_reseed_without_its_product():
+    products = catalog()
+    first, cursor = CatalogSnapshot(products, version=1).page(None, limit=10)
+    assert decode_cursor(cursor) == listing_key(first[-1])
+    # The cursor's own product and one further on are gone after the reseed
+    gone = {first[-1]['slug'], listing(products)[30]}
+    reseeded = CatalogSnapshot([p for p in products if p['slug'] not in gone], version=2)
+
+    assert traverse(reseeded, 10, cursor=cursor) == [s for s in listing(products)[10:] if s not in gone]
+
+
+def test_tampered_cursors_are_rejected(monkeypatch):
+    monkeypatch.setattr(server.catalog, 'snapshot', CatalogSnapshot(catalog(), version=1))
+    monkeypatch.setattr(server.catalog, 'loaded', True)
+    client = TestClient(server.app)
+    valid = encode_cursor({'featured': True, 'base_price': 149.0, 'slug': 'produkt-0001-1'})
+    wrong_shape = base64.urlsafe_b64encode(json.dumps(['yes', 149.0, 'x']).encode()).decode().rstrip('=')
+
+    assert client.get('/api/products', params={'cursor': valid, 'limit': 5}).status_code == 200
+    for cursor in ('not-a-cursor!', valid[:-3], wrong_shape, base64.urlsafe_b64encode(b'[1,2]').decode()):
+        response = client.get('/api/products', params={'cursor': cursor, 'limit': 5})
+        assert response.status_code == 400, cursor
+        assert client.get('/api/products/category/gensere', params={'cursor': cursor}).status_code == 400
+
+
+def test_skip_limit_listing_keeps_the_load_order():
+    products = catalog()
+    snapshot = CatalogSnapshot(products, version=1)
+    loaded = [p['slug'] for p in products]
+
+    assert [p['slug'] for p in snapshot.query(limit=len(products), load_order=True)] == loaded
+    assert [p['slug'] for p in snapshot.query(skip=10, limit=5, load_order=True)] == loaded[10:15]
+    gensere = [p['slug'] for p in products if p['category'] == 'gensere']
+    assert [p['slug'] for p in snapshot.query(limit=100, category='gensere', load_order=True)] == gensere
+
+
+def test_listing_limit_and_skip_are_validated(monkeypatch):
+    monkeypatch.setattr(server.catalog, 'snapshot', CatalogSnapshot(catalog(), version=1))
+    monkeypatch.setattr(server.catalog, 'loaded', True)
+    client = TestClient(server.app)
+
+    for path in ('/api/products', '/api/products/category/gensere'):
+        for params in ({'limit': -1}, {'limit': 0}, {'limit': server.MAX_PRODUCT_LIMIT + 1}, {'skip': -1}):
+            assert client.get(path, params=params).status_code == 422, (path, params)
+        assert len(client.get(path, params={'limit': 3}).json()) == 3
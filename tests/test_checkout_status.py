@@ -0,0 +1,84 @@
+"""
+Checkout status polling: a burst of polls for one session costs one Stripe
+call, the paid transition is written once, and later polls are answered
+from Mongo. Needs a reachable MongoDB (MONGO_URL); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from checkout_status import CheckoutStatusCache  # noqa: E402
+from stripe_gateway import FakeStripeGateway  # noqa: E402
+
+POLLS = 200
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_status_test_{uuid.uuid4().hex[:8]}"]
+
+
+async def poll(db):
+    gateway = FakeStripeGateway(latency=0.05)
+    session = await gateway.create_checkout_session(
+        amount=499.0, currency='nok', success_url='https://shop.test/?session_id={CHECKOUT_SESSION_ID}',
+        cancel_url='https://shop.test/', metadata={'order_id': 'o-1'},
+    )
+    await db.payment_transactions.insert_one({'session_id': session.session_id, 'payment_status': 'pending',
+                                              'amount': 499.0, 'currency': 'nok', 'expires_at': 0})
+    await db.orders.insert_one({'id': 'o-1', 'stripe_session_id': session.session_id,
+                                'payment_status': 'pending', 'status': 'pending'})
+    statuses = CheckoutStatusCache(db, ttl=0.2, final_ttl=60, maxsize=100)
+
+    unpaid = await asyncio.gather(*(statuses.get(session.session_id, gateway) for _ in range(POLLS)))
+    upstream_while_unpaid = statuses.upstream_calls
+    gateway.mark_paid(session.session_id)
+    await asyncio.sleep(0.25)
+    paid = await asyncio.gather(*(statuses.get(session.session_id, gateway) for _ in range(POLLS)))
+    statuses.cache.clear()  # e.g. another worker: the paid transaction answers without Stripe
+    from_db = await statuses.get(session.session_id, gateway)
+
+    tx = await db.payment_transactions.find_one({'session_id': session.session_id})
+    order = await db.orders.find_one({'id': 'o-1'})
+    return unpaid, upstream_while_unpaid, paid, from_db, statuses, tx, order
+
+
+def test_status_polls_are_coalesced_and_answered_from_mongo_once_paid():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            return await poll(db)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    unpaid, upstream_while_unpaid, paid, from_db, statuses, tx, order = result
+
+    assert {s.payment_status for s in unpaid} == {'unpaid'}
+    assert upstream_while_unpaid == 1
+    assert {s.payment_status for s in paid} == {'paid'}
+    assert from_db.payment_status == 'paid' and from_db.amount_total == 49900
+    assert statuses.upstream_calls == 2 and statuses.db_answers == 1
+    assert statuses.stats()['saved_calls'] == 2 * POLLS - 1
+    assert tx['payment_status'] == 'paid' and 'expires_at' not in tx
+    assert order['status'] == 'processing'
@@ -0,0 +1,39 @@
+"""
+Design assets are served back from the shop's own origin, so only raster
+images are accepted from the customizer, and uploaded bytes are never
+sniffed, SVG is sandboxed and anything else is sent as a download
+"""
+import base64
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'firmaprint_design_assets_test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import server  # noqa: E402
+from design_assets import InvalidAsset, parse_data_url  # noqa: E402
+
+PIXEL = base64.b64encode(b'\x89PNG\r\n\x1a\n').decode('ascii')
+
+
+def test_only_raster_data_urls_are_accepted():
+    assert parse_data_url(f"data:image/png;base64,{PIXEL}") == ('image/png', b'\x89PNG\r\n\x1a\n')
+    assert parse_data_url(f"data:IMAGE/WEBP;base64,{PIXEL}")[0] == 'image/webp'
+    assert parse_data_url('/api/logos/abc') is None
+    for content_type in ('image/svg+xml', 'text/html', 'application/pdf'):
+        with pytest.raises(InvalidAsset):
+            parse_data_url(f"data:{content_type};base64,{PIXEL}")
+
+
+def test_served_blobs_are_not_sniffed_and_svg_is_sandboxed():
+    png = server.content_safety_headers('image/png')
+    svg = server.content_safety_headers('image/svg+xml')
+    html = server.content_safety_headers('text/html')
+
+    assert png == {'X-Content-Type-Options': 'nosniff'}
+    assert svg['X-Content-Type-Options'] == 'nosniff' and 'sandbox' in svg['Content-Security-Policy']
+    assert html['X-Content-Type-Options'] == 'nosniff' and html['Content-Disposition'] == 'attachment'
@@ -0,0 +1,76 @@
+"""
+Order commits: concurrent checkouts all land with their transaction and
+cleared cart, and on a replica set a failing write rolls the whole order
+back. Needs a reachable MongoDB (MONGO_URL); skipped otherwise. A
+standalone mongod exercises the ordered-write fallback.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import DuplicateKeyError, PyMongoError  # noqa: E402
+
+from order_pipeline import OrderWriter  # noqa: E402
+
+ORDERS = 200
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_orders_test_{uuid.uuid4().hex[:8]}"]
+
+
+def test_order_commits_are_all_or_nothing():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            # Collections must exist before they are written inside a transaction on older servers
+            await db.payment_transactions.create_index('id', unique=True)
+            await db.orders.create_index('id', unique=True)
+            await db.carts.create_index('session_id', unique=True)
+            await db.carts.insert_many([{'session_id': f"cart-{i}", 'items': [{}]} for i in range(ORDERS + 1)])
+            writer = OrderWriter(client, db)
+
+            await asyncio.gather(*(
+                writer.commit({'id': f"order-{i}"}, {'id': f"tx-{i}", 'order_id': f"order-{i}"}, f"cart-{i}")
+                for i in range(ORDERS)
+            ))
+            committed = (await db.orders.count_documents({}), await db.payment_transactions.count_documents({}),
+                         await db.carts.count_documents({}))
+
+            # Reusing a transaction id fails after the order insert
+            with pytest.raises(DuplicateKeyError):
+                await writer.commit({'id': 'order-broken'}, {'id': 'tx-0'}, f"cart-{ORDERS}")
+            broken_order = await db.orders.find_one({'id': 'order-broken'})
+            cart_left = await db.carts.find_one({'session_id': f"cart-{ORDERS}"})
+            return writer.transactions, committed, broken_order, cart_left
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    transactions, committed, broken_order, cart_left = result
+
+    assert committed == (ORDERS, ORDERS, 1)
+    assert cart_left is not None
+    if transactions:
+        assert broken_order is None  # rolled back with the failed transaction insert
+    else:
+        assert broken_order is not None  # standalone: order first, never a lone transaction
@@ -0,0 +1,73 @@
+"""
+Concurrency test for the order number sequence: thousands of parallel
+orders from several simulated API workers must get unique, gap-bounded
+numbers. Needs a reachable MongoDB (MONGO_URL); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from sequence import OrderSequence  # noqa: E402
+
+WORKERS = 8
+ORDERS = 4000
+BLOCK_SIZE = 20
+PREFIX = 'FP209912'
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_sequence_test_{uuid.uuid4().hex[:8]}"]
+
+
+def test_parallel_orders_get_unique_numbers():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            await db.orders.create_index('order_number', unique=True)
+            # A number issued by the old count_documents() scheme this month
+            await db.orders.insert_one({'id': 'legacy', 'order_number': f"{PREFIX}0042"})
+
+            workers = [OrderSequence(db, block_size=BLOCK_SIZE) for _ in range(WORKERS)]
+
+            async def place_order(i):
+                number = await workers[i % WORKERS].next_number(PREFIX)
+                await db.orders.insert_one({'id': str(i), 'order_number': number})
+                return number
+
+            numbers = await asyncio.gather(*(place_order(i) for i in range(ORDERS)))
+            reserved = sum(w.blocks_reserved for w in workers)
+            return numbers, reserved
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    numbers, reserved = result
+
+    assert len(set(numbers)) == ORDERS
+    values = sorted(int(n[len(PREFIX):]) for n in numbers)
+    assert values[0] > 42  # seeded above the legacy number
+    # At most one partially used block per worker
+    assert values[-1] - 42 <= ORDERS + WORKERS * BLOCK_SIZE
+    # Far fewer counter round trips than orders
+    assert reserved <= ORDERS // BLOCK_SIZE + WORKERS
@@ -0,0 +1,75 @@
+"""
+Requests/sec for a 1,000-product listing: Pydantic response_model vs the
+pre-serialized per-product JSON cache. Both must return the same JSON; the
+speed comparison is a benchmark (RUN_BENCHMARKS=1, see conftest.py)
+"""
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'firmaprint_benchmark')
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from catalog import CatalogSnapshot  # noqa: E402
+from tracker_products import tracker_products  # noqa: E402
+
+CATALOG_SIZE = 1000
+REQUESTS = 30
+
+
+def synthetic_catalog(size):
+    products = []
+    for i in range(size):
+        base = tracker_products[i % len(tracker_products)]
+        products.append(dict(base, id=f"p{i}", slug=f"{base['slug']}-{i}",
+                             created_at='2026-01-01T00:00:00+00:00'))
+    return products
+
+
+def requests_per_second(client, url):
+    client.get(url)  # warm-up (fills the JSON cache on the fast path)
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        response = client.get(url)
+        assert response.status_code == 200
+    return REQUESTS / (time.perf_counter() - started)
+
+
+def listing_apps(monkeypatch):
+    snapshot = CatalogSnapshot(synthetic_catalog(CATALOG_SIZE), version=1, serializer=server.product_json)
+    # Restored after the test, so later tests do not see the synthetic catalog
+    monkeypatch.setattr(server.catalog, 'snapshot', snapshot)
+    monkeypatch.setattr(server.catalog, 'loaded', True)
+
+    # The previous implementation: dicts validated and serialized through response_model
+    baseline = FastAPI()
+
+    @baseline.get("/api/products", response_model=List[server.Product])
+    async def get_products(limit: int = 50):
+        return snapshot.query(limit=limit, load_order=True)
+
+    return TestClient(baseline), TestClient(server.app), f"/api/products?limit={CATALOG_SIZE}"
+
+
+def test_preserialized_listing_matches_response_model(monkeypatch):
+    baseline, app, url = listing_apps(monkeypatch)
+    assert baseline.get(url).json() == app.get(url).json()
+
+
+@pytest.mark.benchmark
+def test_preserialized_listing_is_faster(monkeypatch):
+    baseline, app, url = listing_apps(monkeypatch)
+    before = requests_per_second(baseline, url)
+    after = requests_per_second(app, url)
+    print(f"\n{CATALOG_SIZE} products: response_model {before:.1f} req/s, cached JSON {after:.1f} req/s "
+          f"({after / before:.1f}x)")
+    assert after > before
@@ -0,0 +1,113 @@
+"""
+Retention: the sweep removes only logos and design assets that are past
+retention and referenced by no cart, order or quote (keeping bytes another logo
+still uses), and legacy ISO-string dates are migrated to Dates the TTL
+indexes can expire. Needs a reachable MongoDB (MONGO_URL); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from retention import RetentionSweeper  # noqa: E402
+
+ORPHAN, REFERENCED, YOUNG, SHARED, IN_ORDER = ('a' * 64, 'b' * 64, 'c' * 64, 'd' * 64, 'e' * 64)
+REFERENCED_LOGO = str(uuid.uuid4())
+QUOTED_LOGO = str(uuid.uuid4())
+REUSED = '9' * 64
+
+
+class RecordingBlobs:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete(self, sha256: str) -> int:
+        self.deleted.append(sha256)
+        return 1
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000, tz_aware=True)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_retention_test_{uuid.uuid4().hex[:8]}"]
+
+
+async def sweep_and_migrate(db):
+    old = (datetime.now(timezone.utc) - timedelta(days=90)).isoformat()
+    new = datetime.now(timezone.utc).isoformat()
+    await db.logos.insert_many([
+        {'id': str(uuid.uuid4()), 'sha256': ORPHAN, 'size': 10, 'created_at': old},
+        {'id': REFERENCED_LOGO, 'sha256': REFERENCED, 'size': 20, 'created_at': old},
+        {'id': str(uuid.uuid4()), 'sha256': YOUNG, 'size': 30, 'created_at': new},
+        {'id': str(uuid.uuid4()), 'sha256': SHARED, 'size': 40, 'created_at': new},
+        {'id': QUOTED_LOGO, 'sha256': 'q' * 64, 'size': 60, 'created_at': old},
+    ])
+    await db.design_assets.insert_many([
+        {'_id': SHARED, 'size': 40, 'created_at': old},
+        {'_id': IN_ORDER, 'size': 50, 'created_at': old, 'last_used_at': old},
+        {'_id': REUSED, 'size': 70, 'created_at': old, 'last_used_at': new},  # interned again recently
+    ])
+    await db.logo_derivatives.insert_one({'_id': ORPHAN, 'variants': [{'sha256': 'f' * 64, 'bytes': 5}]})
+    await db.carts.insert_one({'session_id': 'legacy', 'updated_at': old, 'items': [
+        {'design': {'logo_url': f"/api/logos/{REFERENCED_LOGO}/preview", 'logo_id': REFERENCED_LOGO}},
+    ]})
+    await db.orders.insert_one({'id': 'order', 'items': [{'design': None}, {'design': {'logo_asset': IN_ORDER}}]})
+    await db.quotes.insert_one({'id': 'quote', 'logo_url': f"/api/logos/{QUOTED_LOGO}"})
+    await db.payment_transactions.insert_many([
+        {'id': 'abandoned', 'payment_status': 'CREATED', 'created_at': old},
+        {'id': 'paid', 'payment_status': 'paid', 'created_at': old},
+    ])
+
+    blobs = RecordingBlobs()
+    sweeper = RetentionSweeper(db, blobs, retention_days=30)
+    preview = await sweeper.sweep(dry_run=True)
+    logos_after_preview = await db.logos.count_documents({})
+    report = await sweeper.sweep(dry_run=False)
+    migrated = await sweeper.migrate_dates()
+    cart = await db.carts.find_one({'session_id': 'legacy'})
+    abandoned = await db.payment_transactions.find_one({'id': 'abandoned'})
+    paid = await db.payment_transactions.find_one({'id': 'paid'})
+    remaining_assets = sorted(a['_id'] for a in await db.design_assets.find({}).to_list(None))
+    return preview, logos_after_preview, report, blobs.deleted, remaining_assets, migrated, cart, abandoned, paid
+
+
+def test_sweep_keeps_referenced_logos_and_migrates_dates():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            return await sweep_and_migrate(db)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    preview, logos_after_preview, report, deleted, remaining_assets, migrated, cart, abandoned, paid = result
+
+    assert logos_after_preview == 5
+    assert {k: v for k, v in preview.items() if k not in ('dry_run', 'cutoff', 'duration_ms')} == \
+        {k: v for k, v in report.items() if k not in ('dry_run', 'cutoff', 'duration_ms')}
+    assert report['logos'] == 1 and report['design_assets'] == 1
+    assert report['bytes'] == 15  # orphan logo plus its derivative; SHARED bytes still belong to a logo
+    assert sorted(deleted) == [ORPHAN, 'f' * 64]
+    assert remaining_assets == [REUSED, IN_ORDER]
+    assert migrated['carts'] == 1 and migrated['payment_transactions'] == 1
+    assert isinstance(cart['updated_at'], datetime)
+    assert isinstance(abandoned['expires_at'], datetime) and 'expires_at' not in paid
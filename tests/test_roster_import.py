@@ -0,0 +1,69 @@
+"""
+Memory and throughput of the roster import: a 10,000-row employee CSV is
+read from a spooled upload and folded into cart lines within a fixed memory
+budget, with bad rows reported instead of failing the import
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from catalog import CatalogSnapshot  # noqa: E402
+from roster_import import RosterImport  # noqa: E402
+
+ROWS = 10_000
+MEMORY_BUDGET = 4 * 1024 * 1024
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL', '3XL']
+
+PRODUCTS = [
+    {
+        'id': f"p{i}", 'slug': f"hoodie-{i}", 'name': f"Hoodie {i}", 'category': 'gensere', 'base_price': 399.0,
+        'variants': [
+            {'color': color, 'color_hex': '#000000', 'sizes': SIZES, 'images': []}
+            for color in ('Sort', 'Marine', 'Grå')
+        ],
+        'print_methods': ['print'],
+    }
+    for i in range(5)
+]
+
+
+def _roster(rows: int):
+    """Semicolon-separated, the way Norwegian Excel exports it, spooled like Starlette's UploadFile"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write('Produkt;Farge;Størrelse;Navn;Antall\n'.encode('utf-8'))
+    for i in range(rows):
+        if i % 1000 == 999:
+            line = f"hoodie-{i % 5};Rosa;M;Ansatt {i};\n"  # colour that does not exist
+        else:
+            line = f"hoodie-{i % 5};{('sort', 'Marine', 'Grå')[i % 3]};{SIZES[i % 7].lower()};Ansatt Ølstad {i};\n"
+        spooled.write(line.encode('utf-8'))
+    spooled.seek(0)
+    return spooled
+
+
+def test_ten_thousand_row_roster_within_memory_budget():
+    snapshot = CatalogSnapshot(PRODUCTS, version=1)
+    upload = _roster(ROWS)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    roster = RosterImport(snapshot).read(upload, 'csv')
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"\nRoster import: {ROWS} rows -> {len(roster.lines)} lines in {elapsed * 1000:.0f} ms, "
+          f"peak {peak / 1024:.0f} KiB")
+    assert roster.rows == ROWS
+    assert roster.error_count == ROWS // 1000
+    assert roster.errors[0] == {'row': 1001, 'error': 'Fargen «Rosa» finnes ikke for Hoodie 4'}
+    assert roster.imported_rows == ROWS - ROWS // 1000
+    assert len(roster.lines) <= 5 * 3 * len(SIZES)
+    assert sum(line.quantity for line in roster.lines.values()) == roster.imported_rows
+    assert all(line.personalized and line.variant_color in ('Sort', 'Marine', 'Grå')
+               for line in roster.lines.values())
+    assert peak < MEMORY_BUDGET
@@ -0,0 +1,77 @@
+"""
+Search index behaviour on a synthetic catalog; the latency budget check is
+a benchmark (RUN_BENCHMARKS=1, see conftest.py)
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from catalog import CatalogSnapshot  # noqa: E402
+from search_index import SEARCH_LATENCY_BUDGET_MS  # noqa: E402
+from tracker_products import tracker_products  # noqa: E402
+
+QUERIES = ['genser', 'hoodie', 'jakker', 'bomull', 'fleece jakke', 'sort t-skjorte',
+           'kongeblå', 'brod', 'arbeid', 'dunjakke', 'caps', 'klær', 'rød hoodie']
+
+
+def synthetic_catalog(size):
+    rng = random.Random(42)
+    products = []
+    for i in range(size):
+        base = tracker_products[i % len(tracker_products)]
+        product = dict(base)
+        product['id'] = f"p{i}"
+        product['slug'] = f"{base['slug']}-{i}"
+        product['name'] = f"{base['name']} {rng.choice(['Pro', 'Lite', 'Classic', 'Eco', ''])} {i}"
+        product['base_price'] = base['base_price'] + rng.randint(0, 200)
+        products.append(product)
+    return products
+
+
+def test_norwegian_tokens_and_prefixes():
+    products = [dict(p, id=str(i)) for i, p in enumerate(tracker_products)]
+    snapshot = CatalogSnapshot(products, version=1)
+
+    # Inflected forms stem to the same term
+    assert snapshot.search('jakker') and len(snapshot.search('jakker')) == len(snapshot.search('jakke'))
+    # ø survives tokenization and transliteration
+    assert snapshot.search('rød')
+    assert [h.pos for h in snapshot.search('rød')] == [h.pos for h in snapshot.search('roed')]
+    # Prefix match finds "bomullsmix" and the snippet marks it
+    hits = snapshot.search('bomull')
+    highlighted = [snapshot.search_index.highlight(h)['description'] for h in hits]
+    assert any('<mark>bomullsmix</mark>' in text for text in highlighted)
+    # Regex metacharacters are plain text
+    assert snapshot.search('(a+)+$') == []
+
+
+def test_large_catalog_search_and_highlight():
+    snapshot = CatalogSnapshot(synthetic_catalog(5000), version=1)
+    assert sum(1 for query in QUERIES if snapshot.search(query)) > len(QUERIES) // 2
+    for query in QUERIES:
+        hits = snapshot.search(query)
+        assert [h.pos for h in hits] == [h.pos for h in snapshot.search(query)]  # deterministic ranking
+        for hit in hits[:20]:
+            assert snapshot.search_index.highlight(hit)
+
+
+@pytest.mark.benchmark
+def test_search_latency_budget():
+    snapshot = CatalogSnapshot(synthetic_catalog(5000), version=1)
+    timings = []
+    for _ in range(10):
+        for query in QUERIES:
+            started = time.perf_counter()
+            hits = snapshot.search(query)
+            for hit in hits[:20]:
+                snapshot.search_index.highlight(hit)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95)]
+    print(f"\nsearch over {len(snapshot)} products: p50={timings[len(timings) // 2]:.2f} ms p95={p95:.2f} ms")
+    assert p95 <= SEARCH_LATENCY_BUDGET_MS
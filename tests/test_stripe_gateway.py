@@ -0,0 +1,52 @@
+"""
+Checkout flow against the in-memory Stripe gateway that stands in for
+Stripe in tests and benchmarks
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from stripe_gateway import FakeStripeGateway, StripeGateway, create_stripe_gateway  # noqa: E402
+
+
+def test_fake_gateway_checkout_flow():
+    async def scenario():
+        gateway = create_stripe_gateway('fake')
+        await gateway.start()
+        session = await gateway.create_checkout_session(
+            amount=499.0, currency='nok',
+            success_url='https://shop.test/checkout/success?session_id={CHECKOUT_SESSION_ID}&method=stripe',
+            cancel_url='https://shop.test/checkout/cancel',
+            metadata={'order_id': 'o-1', 'order_number': 'FP2099120001'},
+        )
+        before = await gateway.get_checkout_status(session.session_id)
+        event = await gateway.handle_webhook(json.dumps({
+            'id': 'evt_1', 'type': 'checkout.session.completed',
+            'data': {'object': {'id': session.session_id, 'payment_status': 'paid'}},
+        }).encode(), signature=None)
+        after = await gateway.get_checkout_status(session.session_id)
+        await gateway.close()
+        return gateway, session, before, event, after
+
+    gateway, session, before, event, after = asyncio.run(scenario())
+    assert isinstance(gateway, FakeStripeGateway)
+    assert session.url == f"https://shop.test/checkout/success?session_id={session.session_id}&method=stripe"
+    assert before.payment_status == 'unpaid'
+    assert event.session_id == session.session_id and event.payment_status == 'paid'
+    assert after.payment_status == 'paid' and after.metadata['order_id'] == 'o-1'
+    assert after.model_dump()['amount_total'] == 49900  # minor units, like Stripe
+    assert set(gateway.stats()['requests']) == {'create_checkout_session', 'get_checkout_status', 'handle_webhook'}
+
+
+def test_incomplete_gateway_fails_at_construction():
+    class StatusOnly(StripeGateway):
+        async def _get_checkout_status(self, session_id):
+            raise AssertionError
+
+    with pytest.raises(TypeError):
+        StatusOnly()
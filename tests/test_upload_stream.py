@@ -0,0 +1,89 @@
+"""
+Streaming multipart parsing: the file part is handed on in pieces with the
+text fields around it collected, and a body past the limit is cut off from
+the bytes received - chunked, without a Content-Length - rather than after
+it has all been read
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from upload_stream import MultipartStream, UploadError, UploadTooLarge, spool  # noqa: E402
+
+BOUNDARY = 'firmaprintboundary'
+
+
+class StreamedRequest:
+    """The two things MultipartStream reads from a Starlette Request"""
+
+    def __init__(self, body: bytes, chunk_size: int = 1000):
+        self.headers = {'content-type': f'multipart/form-data; boundary={BOUNDARY}'}
+        self.body = body
+        self.chunk_size = chunk_size
+        self.sent = 0
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start:start + self.chunk_size]
+            self.sent += len(chunk)
+            yield chunk
+        yield b''
+
+
+def multipart_body(file_bytes: bytes, design: str = '{"print_method": "print"}', files: int = 1) -> bytes:
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="note"\r\n\r\nfør\r\n'.encode('utf-8'),
+    ]
+    for _ in range(files):
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="logo.png"\r\n'
+                     f'Content-Type: image/png\r\n\r\n'.encode() + file_bytes + b'\r\n')
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="design"\r\n\r\n{design}\r\n'.encode())
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts)
+
+
+async def read_upload(request, max_bytes: int):
+    upload = MultipartStream(request, max_bytes=max_bytes)
+    file = await upload.open_file()
+    chunks = [chunk async for chunk in upload.file_chunks()]
+    fields = await upload.finish()
+    return file, chunks, fields
+
+
+def test_file_part_is_streamed_and_fields_are_collected():
+    data = bytes(range(256)) * 40
+    file, chunks, fields = asyncio.run(read_upload(StreamedRequest(multipart_body(data)), max_bytes=64 * 1024))
+
+    assert (file.filename, file.content_type) == ('logo.png', 'image/png')
+    assert b''.join(chunks) == data and len(chunks) > 1
+    assert fields == {'note': 'før', 'design': '{"print_method": "print"}'}
+
+
+def test_oversized_chunked_body_is_cut_off_at_the_limit():
+    request = StreamedRequest(multipart_body(b'x' * 1_000_000), chunk_size=16 * 1024)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(request, max_bytes=100 * 1024))
+    assert request.sent <= 100 * 1024 + 16 * 1024
+
+
+def test_spooled_file_is_limited_to_the_file_size():
+    async def spooled(limit: int):
+        upload = MultipartStream(StreamedRequest(multipart_body(b'y' * 5000)), max_bytes=64 * 1024)
+        await upload.open_file()
+        with await spool(upload.file_chunks(), max_bytes=limit) as fh:
+            return fh.read()
+
+    assert asyncio.run(spooled(5000)) == b'y' * 5000
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(spooled(4999))
+
+
+def test_malformed_bodies_are_rejected():
+    truncated = multipart_body(b'z' * 5000)[:3000]
+    for body in (truncated, multipart_body(b'z', files=2)):
+        with pytest.raises(UploadError):
+            asyncio.run(read_upload(StreamedRequest(body), max_bytes=64 * 1024))
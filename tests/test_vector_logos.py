@@ -0,0 +1,78 @@
+"""
+SVG and PDF logos through the image worker pool: both are rasterised into
+preview derivatives and analysed for colours and complexity. Each test is
+skipped only when its rasteriser (cairosvg / PyMuPDF) is not installed.
+"""
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from image_pool import ImageWorkerPool  # noqa: E402
+from logo_analysis import analyze_logo  # noqa: E402
+from logo_derivatives import render_derivatives  # noqa: E402
+
+SIZES = (128, 512)
+FORMATS = ('png', 'webp')
+
+
+def _require(module: str):
+    """Skip unless the rasteriser imports (cairosvg raises OSError without the cairo library)"""
+    try:
+        return __import__(module)
+    except (ImportError, OSError) as e:
+        pytest.skip(f"{module} is not available: {e}")
+
+
+SVG = b'''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="200" height="100" viewBox="0 0 200 100">
+  <rect x="10" y="10" width="80" height="80" fill="#d62828"/>
+  <circle cx="150" cy="50" r="40" fill="#003049"/>
+</svg>'''
+
+
+def _pdf() -> bytes:
+    fitz = _require('fitz')
+    with fitz.open() as doc:
+        page = doc.new_page(width=200, height=100)
+        page.draw_rect(fitz.Rect(10, 10, 90, 90), color=None, fill=(0.84, 0.16, 0.16))
+        page.draw_circle(fitz.Point(150, 50), 40, color=None, fill=(0.0, 0.19, 0.29))
+        return doc.tobytes()
+
+
+def render_and_analyze(data: bytes, content_type: str):
+    async def run():
+        pool = ImageWorkerPool(pool_size=1)
+        try:
+            variants = await pool.run(render_derivatives, data, content_type, SIZES, FORMATS)
+            analysis = await pool.run(analyze_logo, data)
+        finally:
+            pool.shutdown()
+        return variants, analysis
+
+    return asyncio.run(run())
+
+
+def assert_rendered(variants, analysis):
+    from PIL import Image
+
+    assert sorted((v['size'], v['format']) for v in variants) == sorted((s, f) for s in SIZES for f in FORMATS)
+    for variant in variants:
+        image = Image.open(io.BytesIO(variant['data']))
+        assert image.format == variant['format'].upper()
+        assert max(image.size) == variant['size'] and image.size[0] == 2 * image.size[1]
+    assert 2 <= len(analysis['colors']) <= 3
+    assert analysis['complexity'] in ('simple', 'normal')
+
+
+def test_svg_logo_is_rendered_and_analysed():
+    _require('cairosvg')
+    assert_rendered(*render_and_analyze(SVG, 'image/svg+xml'))
+
+
+def test_pdf_logo_is_rendered_and_analysed():
+    assert_rendered(*render_and_analyze(_pdf(), 'application/pdf'))
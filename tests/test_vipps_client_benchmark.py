@@ -0,0 +1,111 @@
+"""
+Latency of Vipps calls against a local stub server: a fresh
+httpx.AsyncClient per call (the previous implementation) vs the shared,
+pooled VippsClient. The pooled client must still answer correctly; the
+latency comparison is a benchmark (RUN_BENCHMARKS=1, see conftest.py)
+"""
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from vipps import VippsClient, VippsSettings  # noqa: E402
+
+CALLS = 200
+
+RESPONSES = {
+    '/accesstoken/get': {'access_token': 'stub-token', 'expires_in': 3600},
+    '/epayment/v1/payments/fp-stub': {'state': 'AUTHORIZED', 'aggregate': {}},
+}
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Minimal HTTP/1.1 keep-alive server answering with canned JSON"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            path = request_line.split()[1].decode()
+            content_length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b''):
+                    break
+                name, _, value = header.decode().partition(':')
+                if name.lower() == 'content-length':
+                    content_length = int(value)
+            if content_length:
+                await reader.readexactly(content_length)
+            body = json.dumps(RESPONSES.get(path, {})).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _per_call_client(base_url: str, token: str) -> None:
+    async with httpx.AsyncClient() as client:
+        await client.get(f"{base_url}/epayment/v1/payments/fp-stub", headers={
+            "Authorization": f"Bearer {token}",
+            "Ocp-Apim-Subscription-Key": 'key',
+            "Merchant-Serial-Number": 'msn',
+            "Vipps-System-Name": "Firmaprint",
+            "Vipps-System-Version": "1.0.0",
+        })
+
+
+async def _measure(call) -> float:
+    await call()  # warm-up
+    samples = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def _with_stub(run):
+    """Runs run(vipps, base_url) against the stub server with a started VippsClient"""
+    server = await asyncio.start_server(_handle, '127.0.0.1', 0)
+    base_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    vipps = VippsClient(VippsSettings(
+        client_id='id', client_secret='secret', subscription_key='key', msn='msn', api_url=base_url,
+    ))
+    await vipps.start()
+    try:
+        return await run(vipps, base_url)
+    finally:
+        await vipps.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_pooled_client_reads_payment_status():
+    async def statuses(vipps, base_url):
+        return [(await vipps.get_payment('fp-stub')).json()['state'] for _ in range(3)]
+
+    assert asyncio.run(_with_stub(statuses)) == ['AUTHORIZED'] * 3
+
+
+@pytest.mark.benchmark
+def test_pooled_client_is_faster_than_per_call_clients():
+    async def compare(vipps, base_url):
+        before = await _measure(lambda: _per_call_client(base_url, 'stub-token'))
+        after = await _measure(lambda: vipps.get_payment('fp-stub'))
+        return before, after
+
+    before, after = asyncio.run(_with_stub(compare))
+    print(f"\nVipps status call (median of {CALLS}): per-call client {before:.2f} ms, "
+          f"pooled client {after:.2f} ms ({before / after:.1f}x)")
+    assert after < before
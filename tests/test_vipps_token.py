@@ -0,0 +1,67 @@
+"""
+Concurrency test for the Vipps access token: a burst of checkouts with an
+expired token, and several API processes sharing a token file, must each
+result in a single token fetch
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from vipps import FileTokenStore, VippsClient, VippsSettings  # noqa: E402
+
+CHECKOUTS = 200
+WORKERS = 4
+
+SETTINGS = VippsSettings(client_id='id', client_secret='secret', subscription_key='key', msn='msn',
+                         api_url='https://vipps.test')
+
+
+def _token_transport(fetches: list) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == '/accesstoken/get'
+        fetches.append(request)
+        await asyncio.sleep(0.05)  # slow enough for every caller to pile up
+        return httpx.Response(200, json={'access_token': f"token-{len(fetches)}", 'expires_in': 3600})
+    return httpx.MockTransport(handler)
+
+
+def test_concurrent_callers_share_one_token_fetch():
+    async def scenario():
+        fetches = []
+        vipps = VippsClient(SETTINGS, transport=_token_transport(fetches))
+        try:
+            tokens = await asyncio.gather(*(vipps.tokens.get_access_token() for _ in range(CHECKOUTS)))
+            stats = vipps.stats()['token']
+        finally:
+            await vipps.close()
+        return fetches, tokens, stats
+
+    fetches, tokens, stats = asyncio.run(scenario())
+    assert len(fetches) == 1
+    assert set(tokens) == {'token-1'}
+    assert stats['fetches_last_hour'] == 1
+    assert stats['coalesced'] == CHECKOUTS - 1
+
+
+def test_workers_reuse_a_shared_token(tmp_path):
+    async def scenario():
+        fetches = []
+        store = FileTokenStore(str(tmp_path / 'vipps-token.json'))
+        workers = [VippsClient(SETTINGS, transport=_token_transport(fetches), token_store=store)
+                   for _ in range(WORKERS)]
+        try:
+            tokens = [await w.tokens.get_access_token() for w in workers]
+            shared_hits = sum(w.tokens.shared_hits for w in workers)
+        finally:
+            for w in workers:
+                await w.close()
+        return fetches, tokens, shared_hits
+
+    fetches, tokens, shared_hits = asyncio.run(scenario())
+    assert len(fetches) == 1
+    assert set(tokens) == {'token-1'}
+    assert shared_hits == WORKERS - 1
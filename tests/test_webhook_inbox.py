@@ -0,0 +1,94 @@
+"""
+Concurrency test for the webhook inbox: Stripe retries delivered in
+parallel to several API workers must be stored once and applied once.
+Needs a reachable MongoDB (MONGO_URL); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from stripe_gateway import WebhookEvent  # noqa: E402
+from webhook_inbox import WebhookInbox  # noqa: E402
+
+ORDERS = 300
+DELIVERIES = 3  # every event arrives this many times
+WORKERS = 4
+
+
+async def _database():
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+                                serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        return None, None
+    return client, client[f"firmaprint_inbox_test_{uuid.uuid4().hex[:8]}"]
+
+
+async def deliver_and_process(db):
+    await db.orders.insert_many([
+        {'id': str(i), 'stripe_session_id': f"cs_{i}", 'payment_status': 'pending', 'status': 'pending'}
+        for i in range(ORDERS)
+    ])
+    await db.payment_transactions.insert_many([
+        {'id': str(i), 'session_id': f"cs_{i}", 'payment_status': 'pending'} for i in range(ORDERS)
+    ])
+    # Already fulfilled: a late retry must not move it back to processing
+    await db.orders.update_one({'id': '0'}, {'$set': {'payment_status': 'paid', 'status': 'shipped'}})
+
+    workers = [WebhookInbox(db, batch_size=50) for _ in range(WORKERS)]
+    events = [
+        WebhookEvent(event_id=f"evt_{i}", event_type='checkout.session.completed',
+                     session_id=f"cs_{i}", payment_status='paid')
+        for i in range(ORDERS)
+    ]
+    acked = await asyncio.gather(*(
+        workers[(i + attempt) % WORKERS].record('stripe', event)
+        for attempt in range(DELIVERIES) for i, event in enumerate(events)
+    ))
+
+    async def drain(inbox):
+        while await inbox.process_batch():
+            pass
+
+    await asyncio.gather(*(drain(w) for w in workers))
+    await workers[0]._measure_backlog()
+    unpaid = await db.orders.count_documents({'payment_status': {'$ne': 'paid'}})
+    unpaid_tx = await db.payment_transactions.count_documents({'payment_status': {'$ne': 'paid'}})
+    shipped = await db.orders.find_one({'id': '0'})
+    return acked, workers, unpaid, unpaid_tx, shipped['status']
+
+
+def test_retried_webhooks_are_applied_once():
+    async def scenario():
+        client, db = await _database()
+        if db is None:
+            return None
+        try:
+            return await deliver_and_process(db)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    result = asyncio.run(scenario())
+    if result is None:
+        pytest.skip("MongoDB is not reachable")
+    acked, workers, unpaid, unpaid_tx, shipped_status = result
+
+    assert sum(acked) == ORDERS
+    assert sum(w.duplicates for w in workers) == ORDERS * (DELIVERIES - 1)
+    assert sum(w.processed for w in workers) == ORDERS
+    assert sum(w.batches for w in workers) < ORDERS
+    assert workers[0].depth == 0
+    assert unpaid == 0 and unpaid_tx == 0
+    assert shipped_status == 'shipped'